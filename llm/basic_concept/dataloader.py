@@ -1,3 +1,6 @@
+import os
+import json
+import numpy as np
 import torch
 from torch.utils.data import Dataset, DataLoader
 import tiktoken
@@ -36,12 +39,145 @@ def create_dataloader(txt, batch_size = 4, max_length = 256,
                       num_workers = num_workers)
 
 
-base_dir = Path(__file__).resolve().parent
-data_path = base_dir / "data" / "the-verdict.txt"
-with open(str(data_path), "r", encoding="utf-8") as f:
-    raw_text = f.read()
-data_loader = create_dataloader(raw_text, batch_size = 8, max_length = 4, stride = 4, shuffle=False)
-data_iter = iter(data_loader)
-inputs, targetx = next(data_iter)
-print("Inputs:\n", inputs)
-print("Targets:\n", targetx)
\ No newline at end of file
+
+class MemmapGPTDataset(Dataset):
+    """Sliding-window dataset over pre-tokenized uint16 token files.
+
+    token_file is either a single token file or the index.json written by
+    easy-gpt/pretokenize.py, in which case the shards are read as one token stream.
+    Files are memory-mapped instead of loaded, and windows are sliced on the fly,
+    so memory use does not grow with the corpus size. Works with multi-worker DataLoaders:
+    each worker opens its own memmaps.
+
+    Each item copies its window once from the memmap into an int64 tensor (max_length + 1
+    tokens, 8 bytes each): the memmap is read-only and cross_entropy needs int64 targets,
+    so the copy is made here instead of in every training loop.
+    """
+
+    def __init__(self, token_file, max_length, stride, start=0, end=None, dtype=np.uint16):
+        self.max_length = max_length
+        self.stride = stride
+        self.shard_files, self.dtype = load_token_index(token_file, dtype)
+
+        # Global token offset of each shard, so a window can be located without touching the data
+        shard_sizes = [os.path.getsize(f) // self.dtype.itemsize for f in self.shard_files]
+        self.shard_offsets = np.cumsum([0] + shard_sizes)
+
+        # [start, end) restricts the dataset to a token range, e.g. for a train/validation split
+        num_tokens = int(self.shard_offsets[-1])
+        self.start = start
+        self.end = num_tokens if end is None else min(end, num_tokens)
+        self._shards = None
+
+    @property
+    def shards(self):
+        # Opened lazily so that the dataset can be pickled to DataLoader workers
+        if self._shards is None:
+            self._shards = [np.memmap(f, dtype=self.dtype, mode="r") for f in self.shard_files]
+        return self._shards
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    def __len__(self):
+        # Same windows as GPTDataset: range(0, num_tokens - max_length, stride)
+        num_tokens = self.end - self.start
+        if num_tokens <= self.max_length:
+            return 0
+        return (num_tokens - self.max_length - 1) // self.stride + 1
+
+    def _read(self, begin, end):
+        shard_idx = int(np.searchsorted(self.shard_offsets, begin, side="right")) - 1
+        local = begin - self.shard_offsets[shard_idx]
+        shard = self.shards[shard_idx]
+        if local + (end - begin) <= len(shard):
+            return shard[local:local + end - begin]
+        # Rare case: the window spans a shard boundary
+        return np.concatenate([shard[local:], self._read(self.shard_offsets[shard_idx + 1], end)])
+
+    def __getitem__(self, idx):
+        begin = self.start + idx * self.stride
+        # max_length + 1 tokens copied into one int64 tensor; input and target are offset views of it
+        window = torch.from_numpy(self._read(begin, begin + self.max_length + 1).astype(np.int64))
+        return window[:-1], window[1:]
+
+
+class PerplexityWindowDataset(MemmapGPTDataset):
+    """Sliding windows for perplexity evaluation over a token file.
+
+    Every token after the first is predicted exactly once. Window k starts at k * stride;
+    targets already scored by the previous window are set to ignore_index, so each scored
+    token sees at least max_length - stride tokens of context (except in the first window).
+    The last window is shorter and padded to max_length (padding targets are ignored too).
+    """
+
+    def __init__(self, token_file, max_length, stride, start=0, end=None, dtype=np.uint16, ignore_index=-100):
+        assert 0 < stride <= max_length, "stride must be between 1 and max_length"
+        super().__init__(token_file, max_length, stride, start=start, end=end, dtype=dtype)
+        self.ignore_index = ignore_index
+
+    def __len__(self):
+        num_targets = self.end - self.start - 1
+        if num_targets <= 0:
+            return 0
+        return 1 + -(-max(0, num_targets - self.max_length) // self.stride)
+
+    def __getitem__(self, idx):
+        begin = self.start + idx * self.stride
+        window = torch.from_numpy(self._read(begin, min(begin + self.max_length + 1, self.end)).astype(np.int64))
+        input_ids = torch.zeros(self.max_length, dtype=torch.long)
+        target_ids = torch.full((self.max_length,), self.ignore_index, dtype=torch.long)
+        num_targets = len(window) - 1
+        input_ids[:num_targets] = window[:-1]
+        target_ids[:num_targets] = window[1:]
+        if idx > 0:
+            target_ids[:self.max_length - self.stride] = self.ignore_index
+        return input_ids, target_ids
+
+
+def load_token_index(token_file, dtype=np.uint16):
+    # Resolve a token file or a shard index.json into (shard file paths, dtype)
+    token_file = Path(token_file)
+    if token_file.suffix != ".json":
+        return [str(token_file)], np.dtype(dtype)
+    with open(token_file, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    shard_files = [str(token_file.parent / shard["file"]) for shard in index["shards"]]
+    return shard_files, np.dtype(index["dtype"])
+
+
+def count_tokens(token_file):
+    shard_files, dtype = load_token_index(token_file)
+    return sum(os.path.getsize(f) // dtype.itemsize for f in shard_files)
+
+
+def write_token_file(txt, token_file, tokenizer=None, dtype=np.uint16):
+    # Tokenize txt once and store the ids as a flat binary file for MemmapGPTDataset
+    tokenizer = tokenizer or tiktoken.get_encoding("gpt2")
+    token_ids = np.asarray(tokenizer.encode(txt, allowed_special={"<|endoftext|>"}), dtype=dtype)
+    token_ids.tofile(str(token_file))
+    return len(token_ids)
+
+
+def create_memmap_dataloader(token_file, batch_size = 4, max_length = 256, stride = 256, start = 0,
+                             end = None, shuffle = True, drop_last = True, num_workers = 0):
+    dataset = MemmapGPTDataset(token_file, max_length, stride, start=start, end=end)
+    return DataLoader(dataset,
+                      batch_size = batch_size,
+                      shuffle = shuffle,
+                      drop_last = drop_last,
+                      num_workers = num_workers)
+
+
+if __name__ == "__main__":
+    base_dir = Path(__file__).resolve().parent.parent
+    data_path = base_dir / "data" / "the-verdict.txt"
+    with open(str(data_path), "r", encoding="utf-8") as f:
+        raw_text = f.read()
+    data_loader = create_dataloader(raw_text, batch_size = 8, max_length = 4, stride = 4, shuffle=False)
+    data_iter = iter(data_loader)
+    inputs, targetx = next(data_iter)
+    print("Inputs:\n", inputs)
+    print("Targets:\n", targetx)
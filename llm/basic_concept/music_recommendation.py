@@ -1,40 +1,124 @@
+import argparse
+import time
+import numpy as np
 import pandas as pd
-from urllib import request
 from pathlib import Path
 from datetime import datetime
+from gensim.models import Word2Vec, KeyedVectors
 
-base_dir = Path(__file__).resolve().parent
-data_path = base_dir / "data" / "train.txt"
-data = open(str(data_path), "rb")
-lines = data.read().decode("utf-8").split('\n')[2:]
+data_dir = Path(__file__).resolve().parent.parent / "data"
 
-playlists = [s.rstrip().split() for s in lines if len(s.split()) > 1]
 
-songs_path = base_dir / 'data' / 'song_hash.txt'
-songs_file = open(str(songs_path), 'rb')
-songs_file = songs_file.read().decode("utf-8").split('\n')
-songs = [s.rstrip().split('\t') for s in songs_file]
-songs_df = pd.DataFrame(data=songs, columns = ['id', 'title', 'artist'])
-songs_df = songs_df.set_index('id')
+def load_playlists(playlists_path):
+    # train.txt: two header lines, then one playlist (space-separated song ids) per line
+    with open(str(playlists_path), "rb") as data:
+        lines = data.read().decode("utf-8").split('\n')[2:]
+    return [s.rstrip().split() for s in lines if len(s.split()) > 1]
 
-print('Playlist #1:\n', playlists[0], '\n')
-print('Playlist #2:\n', playlists[1])
 
-print("start training model at ", datetime.now())
-from gensim.models import Word2Vec
-model = Word2Vec(sentences=playlists, vector_size=32, window=20, negative=50, min_count=1, workers=4)
-print("model trained at ", datetime.now())
+def load_songs(songs_path):
+    songs_file = open(str(songs_path), 'rb')
+    songs_file = songs_file.read().decode("utf-8").split('\n')
+    songs = [s.rstrip().split('\t') for s in songs_file if s.strip()]
+    songs_df = pd.DataFrame(data=songs, columns = ['id', 'title', 'artist'])
+    songs_df['id'] = songs_df['id'].str.strip().astype(int)
+    return songs_df.set_index('id')
 
-song_id = 2172
-similar_songs = model.wv.most_similar(positive=str(song_id))
 
-print(f"Song ID: {song_id}")
-print(f"Song Title: {songs_df.iloc[song_id]['title']}")
-print(f"Similar Songs: {similar_songs}")
+def train_or_load_vectors(playlists_path, vectors_path, retrain=False):
+    # Word2Vec is only trained when no saved vectors exist; the KeyedVectors are saved with the
+    # vector matrix as a separate .npy file and reloaded memory-mapped (mmap='r'), so later runs
+    # start in milliseconds and processes on the same machine share the pages
+    vectors_path = Path(vectors_path)
+    if retrain or not vectors_path.exists():
+        playlists = load_playlists(playlists_path)
+        print('Playlist #1:\n', playlists[0], '\n')
+        print("start training model at ", datetime.now())
+        model = Word2Vec(sentences=playlists, vector_size=32, window=20, negative=50, min_count=1, workers=4)
+        print("model trained at ", datetime.now())
+        model.wv.save(str(vectors_path), separately=["vectors"])
+    return KeyedVectors.load(str(vectors_path), mmap='r')
 
-import numpy as np
-def print_recommendations(song_id):
-    similar_songs = np.array(model.wv.most_similar(positive=str(song_id), topn=5))[:,0]
-    return songs_df.iloc[similar_songs]
 
-print(print_recommendations(song_id))
+class SongRecommender:
+    """Cosine-similarity recommendations from song embeddings, for many seed songs at once.
+
+    The vectors are L2-normalized once into one contiguous float32 matrix, so similarities are a
+    single matrix product; the top-N per seed are found with argpartition instead of a full sort.
+    Titles and artists are looked up in arrays indexed by song id.
+    """
+
+    def __init__(self, keyed_vectors, songs_df):
+        self.song_ids = np.array([int(key) for key in keyed_vectors.index_to_key])
+        vectors = np.asarray(keyed_vectors.vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.vectors = np.ascontiguousarray(vectors / np.maximum(norms, 1e-12))
+
+        # Song id -> row of the matrix (-1 for songs without an embedding)
+        max_id = max(self.song_ids.max(), songs_df.index.max())
+        self.row_of_id = np.full(max_id + 1, -1, dtype=np.int64)
+        self.row_of_id[self.song_ids] = np.arange(len(self.song_ids))
+
+        # Song id -> title / artist
+        self.titles = np.full(max_id + 1, "", dtype=object)
+        self.artists = np.full(max_id + 1, "", dtype=object)
+        self.titles[songs_df.index.values] = songs_df['title'].values
+        self.artists[songs_df.index.values] = songs_df['artist'].values
+
+    def recommend(self, seed_ids, topn=5, batch_size=256):
+        # Returns (song ids, cosine similarities), both (len(seed_ids), topn), best first.
+        # The seed itself is excluded; seeds are processed batch_size at a time, which bounds the
+        # similarity matrix to batch_size x num_songs floats
+        seed_rows = self.row_of_id[np.asarray(seed_ids)]
+        assert (seed_rows >= 0).all(), "some seed songs have no embedding"
+        ids = np.empty((len(seed_rows), topn), dtype=np.int64)
+        scores = np.empty((len(seed_rows), topn), dtype=np.float32)
+        for start in range(0, len(seed_rows), batch_size):
+            rows = seed_rows[start:start + batch_size]
+            sims = self.vectors[rows] @ self.vectors.T
+            sims[np.arange(len(rows)), rows] = -np.inf
+            # Unordered top-n per row in O(num_songs) (partitioning at the end avoids negating a copy
+            # of sims), then sort only those n
+            top = np.argpartition(sims, sims.shape[1] - topn, axis=1)[:, -topn:]
+            top_sims = np.take_along_axis(sims, top, axis=1)
+            order = np.argsort(-top_sims, axis=1)
+            ids[start:start + len(rows)] = self.song_ids[np.take_along_axis(top, order, axis=1)]
+            scores[start:start + len(rows)] = np.take_along_axis(top_sims, order, axis=1)
+        return ids, scores
+
+    def recommendations_df(self, song_id, topn=5):
+        ids, scores = self.recommend([song_id], topn)
+        return pd.DataFrame({'title': self.titles[ids[0]], 'artist': self.artists[ids[0]],
+                             'similarity': scores[0]}, index=pd.Index(ids[0], name='id'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Song recommendations from Word2Vec playlist embeddings")
+    parser.add_argument("--playlists", type=str, default=str(data_dir / "train.txt"))
+    parser.add_argument("--songs", type=str, default=str(data_dir / "song_hash.txt"))
+    parser.add_argument("--vectors", type=str, default=str(data_dir / "song_vectors.kv"),
+                        help="saved KeyedVectors; trained from the playlists if missing")
+    parser.add_argument("--retrain", action="store_true")
+    args = parser.parse_args()
+
+    songs_df = load_songs(args.songs)
+    start = time.perf_counter()
+    wv = train_or_load_vectors(args.playlists, args.vectors, args.retrain)
+    recommender = SongRecommender(wv, songs_df)
+    print(f"{len(recommender.song_ids)} song vectors ready in {time.perf_counter() - start:.2f}s")
+
+    song_id = 2172
+    print(f"Song ID: {song_id}")
+    print(f"Song Title: {recommender.titles[song_id]}")
+    print(recommender.recommendations_df(song_id))
+
+    # Batch recommendations vs. one most_similar call per seed
+    seeds = recommender.song_ids[:2000]
+    start = time.perf_counter()
+    ids, scores = recommender.recommend(seeds, topn=5)
+    batch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for seed in seeds[:200]:
+        wv.most_similar(positive=str(seed), topn=5)
+    loop_time = (time.perf_counter() - start) * len(seeds) / 200
+    print(f"Top-5 for {len(seeds)} seeds: {batch_time:.2f}s batched, ~{loop_time:.2f}s with most_similar per seed")
@@ -0,0 +1,69 @@
+import argparse
+import multiprocessing as mp
+import time
+import torch
+from gpt_model import GPTModel
+from gpt_config import GPT_CONFIG_124M
+from train_gpt import peak_rss_mb
+
+
+def run_setting(cfg, batch_size, iters, queue):
+    torch.manual_seed(123)
+    model = GPTModel(cfg)
+    model.train()
+    input_batch = torch.randint(0, cfg["vocab_size"], (batch_size, cfg["context_length"]))
+    target_batch = torch.randint(0, cfg["vocab_size"], (batch_size, cfg["context_length"]))
+    baseline = peak_rss_mb()
+
+    def step():
+        logits = model(input_batch)
+        loss = torch.nn.functional.cross_entropy(logits.flatten(0, 1), target_batch.flatten())
+        loss.backward()
+        model.zero_grad(set_to_none=True)
+
+    step()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iters):
+        step()
+    elapsed = (time.perf_counter() - start) / iters
+    queue.put((elapsed, peak_rss_mb() - baseline))
+
+
+def measure(cfg, batch_size, iters):
+    # Each setting runs in a fresh process so that peak RSS is not shared between them
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_setting, args=(cfg, batch_size, iters, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory and speed of a training step with activation checkpointing")
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--context_length", type=int, default=512)
+    parser.add_argument("--every", type=int, nargs="+", default=[0, 4, 2, 1],
+                        help="activation_checkpointing values to compare (0 = off)")
+    parser.add_argument("--iters", type=int, default=2)
+    parser.add_argument("--fused_attn", action="store_true")
+    args = parser.parse_args()
+
+    cfg = dict(GPT_CONFIG_124M, context_length=args.context_length, fused_attn=args.fused_attn)
+    print(f"batch_size={args.batch_size}, context_length={args.context_length}, "
+          f"{cfg['n_layers']} blocks, fused_attn={args.fused_attn}")
+    print(f"{'Checkpointing':<16}{'Step s':>10}{'Tokens/sec':>12}{'Peak RSS MB':>14}{'Slowdown':>10}{'Memory':>8}")
+    base_time, base_mem = None, None
+    for every in args.every:
+        step_time, mem = measure(dict(cfg, activation_checkpointing=every), args.batch_size, args.iters)
+        if base_time is None:
+            base_time, base_mem = step_time, mem
+        name = "off" if every == 0 else f"every {every}"
+        tokens_per_sec = args.batch_size * args.context_length / step_time
+        print(f"{name:<16}{step_time:>10.2f}{tokens_per_sec:>12.0f}{mem:>14.0f}"
+              f"{step_time / base_time:>9.2f}x{mem / base_mem:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
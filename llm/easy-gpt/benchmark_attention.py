@@ -0,0 +1,81 @@
+import argparse
+import multiprocessing as mp
+import time
+import torch
+from multi_head_attention import MultiHeadAttention, FusedMultiHeadAttention
+from gpt_config import GPT_CONFIG_124M
+from train_gpt import peak_rss_mb
+
+
+def build_attention(attn_cls, cfg):
+    return attn_cls(
+        d_in=cfg["emb_dim"],
+        d_out=cfg["emb_dim"],
+        context_length=cfg["context_length"],
+        num_heads=cfg["n_heads"],
+        dropout=0.0,
+        qkv_bias=cfg["qkv_bias"])
+
+
+def run_path(attn_cls, cfg, batch_size, num_tokens, iters, backward, queue):
+    torch.manual_seed(123)
+    attn = build_attention(attn_cls, cfg)
+    x = torch.randn(batch_size, num_tokens, cfg["emb_dim"], requires_grad=backward)
+    baseline = peak_rss_mb()
+
+    def step():
+        if backward:
+            attn(x).sum().backward()
+        else:
+            with torch.inference_mode():
+                attn(x)
+
+    step()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iters):
+        step()
+    elapsed = (time.perf_counter() - start) / iters
+    queue.put((elapsed * 1000, peak_rss_mb() - baseline))
+
+
+def measure(attn_cls, cfg, batch_size, num_tokens, iters, backward):
+    # Each path runs in a fresh process so that peak RSS is not shared between them
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_path, args=(attn_cls, cfg, batch_size, num_tokens, iters, backward, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare MultiHeadAttention with the fused QKV + SDPA path")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--num_tokens", type=int, default=GPT_CONFIG_124M["context_length"])
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--backward", action="store_true", help="Measure forward + backward")
+    args = parser.parse_args()
+
+    cfg = GPT_CONFIG_124M
+
+    # Equivalence check in eval mode: load the reference weights into the fused module
+    torch.manual_seed(123)
+    ref = build_attention(MultiHeadAttention, cfg).eval()
+    fused = build_attention(FusedMultiHeadAttention, cfg).eval()
+    fused.load_state_dict(ref.state_dict())
+    x = torch.randn(2, 64, cfg["emb_dim"])
+    with torch.no_grad():
+        max_diff = (ref(x) - fused(x)).abs().max().item()
+    print(f"Max abs difference (eval mode): {max_diff:.2e}")
+
+    mode = "forward + backward" if args.backward else "forward"
+    print(f"\n{mode}, batch_size={args.batch_size}, num_tokens={args.num_tokens}")
+    for name, attn_cls in [("MultiHeadAttention", MultiHeadAttention),
+                           ("FusedMultiHeadAttention", FusedMultiHeadAttention)]:
+        ms, peak_mb = measure(attn_cls, cfg, args.batch_size, args.num_tokens, args.iters, args.backward)
+        print(f"{name:<25} {ms:8.2f} ms/iter   peak RSS +{peak_mb:8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
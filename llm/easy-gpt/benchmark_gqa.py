@@ -0,0 +1,74 @@
+import argparse
+import time
+import torch
+from gpt_model import GPTModel
+from gpt_config import GPT_CONFIG_124M
+
+
+def kv_cache_mb(model):
+    # Memory currently held by the attention caches of all layers
+    total = 0
+    for blk in model.trf_blocks:
+        if blk.att.cache_k is not None:
+            total += blk.att.cache_k.nbytes + blk.att.cache_v.nbytes
+    return total / 1024**2
+
+
+def benchmark(cfg, batch_size, prompt_len, num_new_tokens):
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    num_params = sum(p.numel() for p in model.parameters())
+    prompt = torch.randint(0, cfg["vocab_size"], (batch_size, prompt_len))
+
+    with torch.inference_mode():
+        model.reset_kv_cache()
+        start = time.perf_counter()
+        logits = model(prompt, use_cache=True)
+        prefill_time = time.perf_counter() - start
+
+        # Greedy decoding up to the full context with the KV cache, one token per step
+        start = time.perf_counter()
+        for _ in range(num_new_tokens):
+            next_token = logits[:, -1].argmax(dim=-1, keepdim=True)
+            logits = model(next_token, use_cache=True)
+        decode_time = time.perf_counter() - start
+        cache_mb = kv_cache_mb(model)
+        model.reset_kv_cache()
+
+    return {
+        "params": num_params,
+        "cache_mb": cache_mb,
+        "prefill_tps": batch_size * prompt_len / prefill_time,
+        "decode_tps": batch_size * num_new_tokens / decode_time,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-head vs. grouped-query vs. multi-query attention on CPU")
+    parser.add_argument("--n_kv_heads", type=int, nargs="+", default=[12, 4, 2, 1],
+                        help="key/value heads to compare (n_heads = multi-head, 1 = multi-query)")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--context_length", type=int, default=1024, help="prompt + generated tokens")
+    parser.add_argument("--num_new_tokens", type=int, default=32, help="decoding steps at the end of the context")
+    parser.add_argument("--fused_attn", action="store_true")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    prompt_len = args.context_length - args.num_new_tokens
+
+    # Warm-up run so that one-time allocations are not measured
+    benchmark(dict(GPT_CONFIG_124M, n_layers=1, fused_attn=args.fused_attn), 1, 16, 2)
+
+    print(f"Batch size {args.batch_size}, {prompt_len} prompt tokens + {args.num_new_tokens} generated "
+          f"({args.context_length} tokens of context)")
+    print(f"{'KV heads':<10}{'Params':>14}{'KV cache MB':>14}{'Prefill tok/s':>16}{'Decode tok/s':>15}")
+    for n_kv_heads in args.n_kv_heads:
+        cfg = dict(GPT_CONFIG_124M, n_kv_heads=n_kv_heads, fused_attn=args.fused_attn)
+        r = benchmark(cfg, args.batch_size, prompt_len, args.num_new_tokens)
+        print(f"{n_kv_heads:<10}{r['params']:>14,}{r['cache_mb']:>14.1f}{r['prefill_tps']:>16.0f}{r['decode_tps']:>15.1f}")
+
+
+if __name__ == "__main__":
+    main()
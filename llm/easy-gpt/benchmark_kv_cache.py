@@ -0,0 +1,56 @@
+import argparse
+import time
+import tiktoken
+import torch
+from gpt_model import GPTModel
+from gpt_model import generate
+from gpt_config import GPT_CONFIG_124M
+
+
+def benchmark(model, encoded_tensor, max_new_tokens, context_size, use_cache):
+    start = time.perf_counter()
+    out = generate(
+        model=model,
+        idx=encoded_tensor,
+        max_new_tokens=max_new_tokens,
+        context_size=context_size,
+        use_cache=use_cache,
+    )
+    elapsed = time.perf_counter() - start
+    num_generated = out.shape[1] - encoded_tensor.shape[1]
+    return out, num_generated / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare generation speed with and without KV cache on CPU")
+    parser.add_argument("--max_new_tokens", type=int, default=200)
+    parser.add_argument("--prompt", type=str, default="Hello, I am")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(123)
+    model = GPTModel(GPT_CONFIG_124M)
+    model.eval()  # disable dropout
+
+    tokenizer = tiktoken.get_encoding("gpt2")
+    encoded_tensor = torch.tensor(tokenizer.encode(args.prompt)).unsqueeze(0)
+    context_size = GPT_CONFIG_124M["context_length"]
+
+    # Warm-up run so that one-time allocations are not measured
+    benchmark(model, encoded_tensor, 5, context_size, use_cache=True)
+
+    out_no_cache, tps_no_cache = benchmark(model, encoded_tensor, args.max_new_tokens, context_size, use_cache=False)
+    out_cache, tps_cache = benchmark(model, encoded_tensor, args.max_new_tokens, context_size, use_cache=True)
+
+    print(f"Generated tokens: {args.max_new_tokens}")
+    print(f"Without KV cache: {tps_no_cache:.1f} tokens/sec")
+    print(f"With KV cache:    {tps_cache:.1f} tokens/sec")
+    print(f"Speedup:          {tps_cache / tps_no_cache:.2f}x")
+    print("Same output:", torch.equal(out_no_cache, out_cache))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import os
+import tempfile
+import time
+import torch
+from gpt_model import GPTModel
+from gpt_model import print_memory_report
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+
+
+def measure(cfg, path):
+    torch.manual_seed(123)
+    model = GPTModel(cfg)
+    total = print_memory_report(model)
+
+    torch.save(model.state_dict(), path)
+    file_mb = os.path.getsize(path) / 1024**2
+
+    start = time.perf_counter()
+    load_gpt_model(cfg, path)
+    load_time = time.perf_counter() - start
+    return total, file_mb, load_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parameter/buffer memory, checkpoint size and load time of GPTModel")
+    parser.add_argument("--fused_attn", action="store_true", help="use the fused attention path in both models")
+    args = parser.parse_args()
+
+    configs = {
+        "default": dict(GPT_CONFIG_124M, fused_attn=args.fused_attn),
+        "tied": dict(GPT_CONFIG_124M, fused_attn=args.fused_attn, tie_weights=True),
+    }
+
+    # Load once so that one-time setup of the meta device is not attributed to the first model
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        warmup_cfg = dict(GPT_CONFIG_124M, n_layers=1)
+        torch.save(GPTModel(warmup_cfg).state_dict(), os.path.join(tmp_dir, "warmup.pth"))
+        load_gpt_model(warmup_cfg, os.path.join(tmp_dir, "warmup.pth"))
+
+        results = {}
+        for name, cfg in configs.items():
+            print(f"\n{name}:")
+            results[name] = measure(cfg, os.path.join(tmp_dir, f"{name}.pth"))
+
+    print()
+    for name, (total, file_mb, load_time) in results.items():
+        print(f"{name:<8} params {total['params']:>12,}  memory {total['params_mb'] + total['buffers_mb']:7.1f} MB  "
+              f"checkpoint {file_mb:7.1f} MB  load {load_time:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
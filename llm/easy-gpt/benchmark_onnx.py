@@ -0,0 +1,80 @@
+import argparse
+import os
+import time
+import warnings
+import torch
+from gpt_model import GPTModel
+from gpt_model import generate
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+from onnx_export import OnnxGPTModel
+from onnx_export import export_onnx
+
+
+def time_call(fn, iters):
+    fn()  # warm-up
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - start) / iters
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Eager PyTorch vs. TorchScript vs. onnxruntime on CPU")
+    parser.add_argument("--model_path", type=str, default=None, help="trained weights; random weights if omitted")
+    parser.add_argument("--export_dir", type=str, default="onnx", help="ONNX files are exported here if missing")
+    parser.add_argument("--shapes", type=str, nargs="+", default=["1x128", "4x256"],
+                        help="forward pass shapes as batch_size x num_tokens")
+    parser.add_argument("--max_new_tokens", type=int, default=50)
+    parser.add_argument("--iters", type=int, default=5)
+    parser.add_argument("--fused_attn", action="store_true")
+    args = parser.parse_args()
+
+    cfg = dict(GPT_CONFIG_124M, fused_attn=args.fused_attn)
+    torch.manual_seed(123)
+    if args.model_path is not None:
+        model = load_gpt_model(cfg, args.model_path)
+    else:
+        model = GPTModel(cfg).eval()
+
+    os.makedirs(args.export_dir, exist_ok=True)
+    path = os.path.join(args.export_dir, "gpt.onnx")
+    with_past_path = os.path.join(args.export_dir, "gpt_with_past.onnx")
+    for p, with_past in ((path, False), (with_past_path, True)):
+        if not os.path.exists(p):
+            start = time.perf_counter()
+            export_onnx(model, p, with_past=with_past)
+            print(f"Exported {p} in {time.perf_counter() - start:.0f}s")
+    onnx_model = OnnxGPTModel(path, with_past_path, num_threads=torch.get_num_threads())
+
+    example = torch.randint(0, cfg["vocab_size"], (1, 8))
+    with torch.no_grad(), warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # tracer warnings about Python control flow on shapes
+        traced = torch.jit.trace(model, (example,), check_trace=False)
+
+    # Full forward pass (prefill) latency
+    print(f"{'Shape':<10}{'Eager ms':>12}{'TorchScript ms':>16}{'ONNX ms':>12}{'Max diff':>12}")
+    for shape in args.shapes:
+        batch_size, num_tokens = (int(v) for v in shape.split("x"))
+        x = torch.randint(0, cfg["vocab_size"], (batch_size, num_tokens))
+        with torch.no_grad():
+            eager_ms = 1000 * time_call(lambda: model(x), args.iters)
+            script_ms = 1000 * time_call(lambda: traced(x), args.iters)
+            onnx_ms = 1000 * time_call(lambda: onnx_model(x), args.iters)
+            max_diff = max((traced(x) - model(x)).abs().max().item(), (onnx_model(x) - model(x)).abs().max().item())
+        print(f"{shape:<10}{eager_ms:>12.1f}{script_ms:>16.1f}{onnx_ms:>12.1f}{max_diff:>12.1e}")
+
+    # Token-by-token generation with the KV cache; the cache is Python state of the eager model,
+    # which TorchScript tracing cannot capture, so only eager and ONNX (with past inputs) are compared
+    prompt = torch.randint(0, cfg["vocab_size"], (1, 16))
+    results = {}
+    for name, m in (("Eager", model), ("ONNX", onnx_model)):
+        start = time.perf_counter()
+        out = generate(m, prompt, args.max_new_tokens, cfg["context_length"])
+        results[name] = out
+        print(f"{name} generation: {args.max_new_tokens / (time.perf_counter() - start):.1f} tokens/sec (KV cache)")
+    print("Same output:", torch.equal(results["Eager"], results["ONNX"]))
+
+
+if __name__ == "__main__":
+    main()
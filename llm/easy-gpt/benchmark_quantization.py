@@ -0,0 +1,88 @@
+import argparse
+import io
+import math
+import sys
+import time
+import tiktoken
+import torch
+from pathlib import Path
+from gpt_model import GPTModel
+from gpt_model import generate
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+from quantization import quantize_model
+sys.path.append(str(Path(__file__).resolve().parent.parent / "basic_concept"))
+from dataloader import create_dataloader
+
+
+def state_dict_mb(model):
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 1024**2
+
+
+@torch.no_grad()
+def perplexity(model, data_loader):
+    total_loss, num_batches = 0., 0
+    for input_batch, target_batch in data_loader:
+        logits = model(input_batch)
+        total_loss += torch.nn.functional.cross_entropy(logits.flatten(0, 1), target_batch.flatten()).item()
+        num_batches += 1
+    return math.exp(total_loss / num_batches)
+
+
+@torch.no_grad()
+def forward_latency(model, input_batch, repeats):
+    model(input_batch)  # warm-up
+    start = time.perf_counter()
+    for _ in range(repeats):
+        model(input_batch)
+    return (time.perf_counter() - start) / repeats
+
+
+def generation_speed(model, encoded_tensor, max_new_tokens, context_size):
+    start = time.perf_counter()
+    out = generate(model=model, idx=encoded_tensor, max_new_tokens=max_new_tokens, context_size=context_size)
+    return (out.shape[1] - encoded_tensor.shape[1]) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fp32 and dynamic int8 inference of GPTModel on CPU")
+    parser.add_argument("--model_path", type=str, default=None, help="fp32 checkpoint; random weights if omitted")
+    parser.add_argument("--max_length", type=int, default=256, help="window length for perplexity and latency")
+    parser.add_argument("--max_new_tokens", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    torch.manual_seed(123)
+    if args.model_path is not None:
+        fp32_model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        fp32_model = GPTModel(GPT_CONFIG_124M).eval()
+    int8_model = quantize_model(fp32_model)  # a quantized copy; fp32_model is left unchanged
+
+    data_path = Path(__file__).resolve().parent.parent / "data" / "the-verdict.txt"
+    with open(data_path, "r", encoding="utf-8") as f:
+        text_data = f.read()
+    data_loader = create_dataloader(text_data, batch_size=4, max_length=args.max_length,
+                                    stride=args.max_length, shuffle=False, drop_last=False)
+    input_batch, _ = next(iter(data_loader))
+
+    tokenizer = tiktoken.get_encoding("gpt2")
+    encoded_tensor = torch.tensor(tokenizer.encode("Every effort moves you")).unsqueeze(0)
+
+    print(f"{'':<6}{'Weights MB':>12}{'Forward ms':>12}{'Tokens/sec':>12}{'Perplexity':>12}")
+    for name, model in (("fp32", fp32_model), ("int8", int8_model)):
+        size = state_dict_mb(model)
+        latency = forward_latency(model, input_batch, args.repeats)
+        speed = generation_speed(model, encoded_tensor, args.max_new_tokens, GPT_CONFIG_124M["context_length"])
+        ppl = perplexity(model, data_loader)
+        print(f"{name:<6}{size:>12.1f}{latency * 1000:>12.1f}{speed:>12.1f}{ppl:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import argparse
+import time
+import torch
+from gpt_config import GPT_CONFIG_124M
+from sampling import Sampler
+
+
+def reference_sample(logits, temperature=0.0, top_k=None):
+    # The sampling step generate() used before sampling.py: new tensors on every call
+    # and a softmax over the full vocabulary
+    if top_k is not None:
+        top_logits, _ = torch.topk(logits, top_k)
+        min_val = top_logits[:, -1:]
+        logits = torch.where(logits < min_val, torch.tensor(float("-inf")).to(logits.device), logits)
+    if temperature > 0.0:
+        logits = logits / temperature
+        probs = torch.softmax(logits, dim=-1)
+        return torch.multinomial(probs, num_samples=1)
+    return torch.argmax(logits, dim=-1, keepdim=True)
+
+
+def time_per_step(fn, iters):
+    fn()  # warm-up, also allocates the Sampler buffers
+    start = time.perf_counter()
+    for _ in range(iters):
+        fn()
+    return (time.perf_counter() - start) / iters * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-step overhead of the logits processors")
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--num_tokens", type=int, default=256, help="length of the token history")
+    parser.add_argument("--iters", type=int, default=50)
+    parser.add_argument("--logit_std", type=float, default=4.0,
+                        help="std of the random logits; 4 gives a top-p 0.9 nucleus of a few hundred tokens, "
+                             "smaller values give flatter distributions and larger nuclei")
+    args = parser.parse_args()
+
+    torch.manual_seed(123)
+    vocab_size = GPT_CONFIG_124M["vocab_size"]
+    settings = [
+        ("greedy", dict(), True),
+        ("temperature", dict(temperature=0.8), True),
+        ("top-k", dict(temperature=0.8, top_k=50), True),
+        ("top-p", dict(temperature=0.8, top_p=0.9), False),
+        ("min-p", dict(temperature=0.8, min_p=0.05), False),
+        ("repetition penalty", dict(temperature=0.8, repetition_penalty=1.2), False),
+        ("all", dict(temperature=0.8, top_k=50, top_p=0.9, min_p=0.05, repetition_penalty=1.2), False),
+    ]
+
+    print(f"{'Processors':<20}" + "".join(f"{'batch ' + str(b):>14}" for b in args.batch_sizes) + "   (us/step)")
+    for name, kwargs, has_reference in settings:
+        sampler_times, reference_times = [], []
+        for batch_size in args.batch_sizes:
+            logits = torch.randn(batch_size, vocab_size) * args.logit_std
+            token_ids = torch.randint(0, vocab_size, (batch_size, args.num_tokens))
+            sampler = Sampler(**kwargs)
+            sampler_times.append(time_per_step(lambda: sampler(logits, token_ids), args.iters))
+            if has_reference:
+                reference_times.append(time_per_step(
+                    lambda: reference_sample(logits, kwargs.get("temperature", 0.0), kwargs.get("top_k")),
+                    args.iters))
+        print(f"{name:<20}" + "".join(f"{t:>14.0f}" for t in sampler_times))
+        if has_reference:
+            print(f"{'  before':<20}" + "".join(f"{t:>14.0f}" for t in reference_times))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import time
+import torch
+from gpt_model import GPTModel
+from gpt_model import generate
+from gpt_config import GPT_CONFIG_124M
+
+
+def kv_cache_mb(model):
+    total = 0
+    for blk in model.trf_blocks:
+        if blk.att.cache_k is not None:
+            total += blk.att.cache_k.nbytes + blk.att.cache_v.nbytes
+    return total / 1024**2
+
+
+def run(cfg, num_tokens, segment):
+    # Greedy generation with the KV cache through generate(); forward hooks time every decoding
+    # step (one model call per new token) and record the KV cache size after it. Returns one row
+    # per segment: (tokens generated so far, tokens/sec of the segment, slowest step in ms, KV cache MB)
+    torch.manual_seed(123)
+    model = GPTModel(cfg).eval()
+    idx = torch.randint(0, cfg["vocab_size"], (1, 8))
+
+    steps = []  # (seconds, KV cache MB) per forward pass
+    step_start = None
+
+    def start_timer(module, inputs):
+        nonlocal step_start
+        step_start = time.perf_counter()
+
+    def stop_timer(module, inputs, output):
+        steps.append((time.perf_counter() - step_start, kv_cache_mb(model)))
+
+    hooks = [model.register_forward_pre_hook(start_timer), model.register_forward_hook(stop_timer)]
+    generate(model, idx, num_tokens, cfg["context_length"], use_cache=True)
+    for hook in hooks:
+        hook.remove()
+
+    rows = []
+    for end in range(segment, len(steps) + 1, segment):
+        times = [seconds for seconds, _ in steps[end - segment:end]]
+        rows.append((end, segment / sum(times), 1000 * max(times), steps[end - 1][1]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generation past the context length: full KV cache vs. sliding window")
+    parser.add_argument("--context_length", type=int, default=256)
+    parser.add_argument("--sliding_window", type=int, default=128)
+    parser.add_argument("--num_tokens", type=int, default=512, help="tokens to generate (several context lengths)")
+    parser.add_argument("--segment", type=int, default=128, help="tokens per reported segment")
+    parser.add_argument("--fused_attn", action="store_true")
+    args = parser.parse_args()
+
+    base = dict(GPT_CONFIG_124M, context_length=args.context_length, fused_attn=args.fused_attn)
+    configs = {
+        "full cache": base,  # rebuilds the cache from the last context_length tokens once it is full
+        f"window {args.sliding_window}": dict(base, sliding_window=args.sliding_window),
+    }
+    for name, cfg in configs.items():
+        print(f"\n{name} (context_length {args.context_length}):")
+        print(f"{'Tokens':>8}{'Tokens/sec':>12}{'Slowest ms':>12}{'KV cache MB':>13}")
+        for num_generated, tps, slowest_ms, cache_mb in run(cfg, args.num_tokens, args.segment):
+            print(f"{num_generated:>8}{tps:>12.1f}{slowest_ms:>12.0f}{cache_mb:>13.1f}")
+
+
+if __name__ == "__main__":
+    main()
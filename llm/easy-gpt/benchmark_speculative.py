@@ -0,0 +1,69 @@
+import argparse
+import time
+import tiktoken
+import torch
+from gpt_model import GPTModel
+from gpt_model import generate
+from gpt_config import GPT_CONFIG_124M
+from gpt_config import GPT_CONFIG_DRAFT
+from checkpoint import load_gpt_model
+from speculative import draft_from_model
+from speculative import generate_speculative
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare plain and speculative decoding on CPU")
+    parser.add_argument("--model_path", type=str, default=None, help="main model checkpoint; random weights if omitted")
+    parser.add_argument("--draft_path", type=str, default=None,
+                        help="draft model checkpoint (GPT_CONFIG_DRAFT); default: first blocks of the main model")
+    parser.add_argument("--num_draft_tokens", type=int, default=4)
+    parser.add_argument("--max_new_tokens", type=int, default=100)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--top_k", type=int, default=None)
+    parser.add_argument("--prompt", type=str, default="Every effort moves you")
+    args = parser.parse_args()
+
+    torch.manual_seed(123)
+    if args.model_path is not None:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        model = GPTModel(GPT_CONFIG_124M).eval()
+    if args.draft_path is not None:
+        draft_model = load_gpt_model(GPT_CONFIG_DRAFT, args.draft_path)
+    else:
+        draft_model = draft_from_model(model, GPT_CONFIG_DRAFT)
+
+    tokenizer = tiktoken.get_encoding("gpt2")
+    encoded_tensor = torch.tensor(tokenizer.encode(args.prompt)).unsqueeze(0)
+    context_size = min(GPT_CONFIG_124M["context_length"], GPT_CONFIG_DRAFT["context_length"])
+
+    # Warm-up
+    generate(model, encoded_tensor, 5, context_size)
+
+    torch.manual_seed(123)
+    start = time.perf_counter()
+    out_plain = generate(model, encoded_tensor, args.max_new_tokens, context_size,
+                         temperature=args.temperature, top_k=args.top_k)
+    plain_time = time.perf_counter() - start
+
+    torch.manual_seed(123)
+    start = time.perf_counter()
+    out_spec, stats = generate_speculative(model, draft_model, encoded_tensor, args.max_new_tokens, context_size,
+                                           num_draft_tokens=args.num_draft_tokens,
+                                           temperature=args.temperature, top_k=args.top_k)
+    spec_time = time.perf_counter() - start
+
+    plain_tps = (out_plain.shape[1] - encoded_tensor.shape[1]) / plain_time
+    spec_tps = stats["generated"] / spec_time
+    print(f"Plain decoding:       {plain_tps:.1f} tokens/sec")
+    print(f"Speculative decoding: {spec_tps:.1f} tokens/sec (k={args.num_draft_tokens})")
+    print(f"Speedup:              {spec_tps / plain_tps:.2f}x")
+    print(f"Acceptance rate:      {stats['acceptance_rate']:.1%}")
+    print(f"Tokens per main pass: {stats['tokens_per_round']:.2f}")
+    if args.temperature == 0.0:
+        print("Same output:", torch.equal(out_plain, out_spec))
+    print("Output text:", tokenizer.decode(out_spec.squeeze(0).tolist()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import torch
+from gpt_model import GPTModel
+
+
+def _to_cpu(obj):
+    # Detached CPU copies, so training can keep updating the live tensors while the copy is written
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, dict):
+        return {k: _to_cpu(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(_to_cpu(v) for v in obj)
+    return obj
+
+
+def get_rng_state():
+    # The numpy key array is stored as a tensor, so checkpoints load with weights_only=True
+    name, keys, pos, has_gauss, cached_gaussian = np.random.get_state()
+    state = {
+        "torch": torch.get_rng_state(),
+        "python": random.getstate(),
+        "numpy": (name, torch.from_numpy(keys.astype(np.int64)), pos, has_gauss, cached_gaussian),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    torch.set_rng_state(state["torch"])
+    random.setstate(state["python"])
+    name, keys, pos, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, keys.numpy().astype(np.uint32), pos, has_gauss, cached_gaussian))
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+class AsyncCheckpointer:
+    """Periodic training checkpoints written from a background thread.
+
+    save() only copies the state to CPU on the training thread; serialization and the
+    disk write happen in the background. At most one write is in flight: a new save
+    waits for the previous one, which bounds the extra memory to one snapshot.
+    """
+
+    def __init__(self, checkpoint_dir, keep_last=2):
+        self.checkpoint_dir = Path(checkpoint_dir)
+        self.checkpoint_dir.mkdir(parents=True, exist_ok=True)
+        self.keep_last = keep_last
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = None
+
+    def save(self, model, optimizer, step, epoch, batch_idx, epoch_rng_state, **extra):
+        # batch_idx is the last batch of the interrupted epoch that was already trained on;
+        # epoch_rng_state is the torch RNG state the epoch's shuffle was drawn from
+        self.wait()
+        model = getattr(model, "_orig_mod", model)  # store the eager model's keys when it was compiled
+        checkpoint = {
+            "model": _to_cpu(model.state_dict()),
+            "optimizer": _to_cpu(optimizer.state_dict()),
+            "step": step,
+            "epoch": epoch,
+            "batch_idx": batch_idx,
+            "epoch_rng_state": epoch_rng_state.clone(),
+            "rng_state": get_rng_state(),
+            **extra
+        }
+        self._pending = self._executor.submit(self._write, checkpoint, step)
+
+    def _write(self, checkpoint, step):
+        path = self.checkpoint_dir / f"ckpt_{step:08d}.pth"
+        tmp_path = path.with_suffix(".tmp")
+        start = time.perf_counter()
+        torch.save(checkpoint, tmp_path)
+        os.replace(tmp_path, path)  # atomic: a crash never leaves a half-written checkpoint behind
+        for old in sorted(self.checkpoint_dir.glob("ckpt_*.pth"))[:-self.keep_last]:
+            old.unlink()
+        print(f"Saved checkpoint {path} in {time.perf_counter() - start:.1f}s (background)")
+
+    def wait(self):
+        if self._pending is not None:
+            self._pending.result()  # re-raises errors from the background write
+            self._pending = None
+
+    def close(self):
+        self.wait()
+        self._executor.shutdown()
+
+
+def latest_checkpoint(checkpoint_dir):
+    checkpoints = sorted(Path(checkpoint_dir).glob("ckpt_*.pth"))
+    return checkpoints[-1] if checkpoints else None
+
+
+def load_checkpoint(path, model, optimizer=None):
+    # Restores model/optimizer in place and returns the rest of the checkpoint (step, epoch, ...).
+    # Always loaded to CPU: load_state_dict copies the weights and optimizer state onto the
+    # parameters' device, and the RNG states must stay CPU tensors for set_rng_state
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    model.load_state_dict(checkpoint.pop("model"))
+    optimizer_state = checkpoint.pop("optimizer")
+    if optimizer is not None:
+        optimizer.load_state_dict(optimizer_state)
+    set_rng_state(checkpoint["rng_state"])
+    return checkpoint
+
+
+def resume_epoch(data_loader, resume=None):
+    # Starts an epoch and returns (epoch_rng_state, iterator over (batch_idx, batch)).
+    # When resuming, the interrupted epoch's shuffle is replayed from its RNG state and the
+    # batches already trained on are skipped, so training continues with the exact next batch.
+    if resume is None:
+        epoch_rng_state = torch.get_rng_state()
+        return epoch_rng_state, enumerate(data_loader)
+
+    epoch_rng_state = resume["epoch_rng_state"]
+    torch.set_rng_state(epoch_rng_state)
+    batches = enumerate(data_loader)
+    for _ in range(resume["batch_idx"] + 1):
+        next(batches)
+    set_rng_state(resume["rng_state"])
+    return epoch_rng_state, batches
+
+
+def load_state_dict(path, mmap=True):
+    # Loads a plain state dict, a training checkpoint or a .safetensors file.
+    # With mmap the tensors stay backed by the file and pages are only read when used.
+    path = str(path)
+    if path.endswith(".safetensors"):
+        from safetensors.torch import load_file
+        return load_file(path)  # safetensors files are always memory-mapped
+    state_dict = torch.load(path, map_location="cpu", weights_only=True, mmap=mmap)
+    return state_dict["model"] if "model" in state_dict and "optimizer" in state_dict else state_dict
+
+
+def save_state_dict(model, path):
+    model = getattr(model, "_orig_mod", model)
+    path = str(path)
+    if path.endswith(".safetensors"):
+        from safetensors.torch import save_model
+        save_model(model, path)  # handles tied weights
+    else:
+        torch.save(model.state_dict(), path)
+
+
+def load_gpt_model(cfg, path, mmap=True):
+    # The model is built on the meta device (no random init, no memory) and the loaded
+    # tensors are assigned instead of copied, so startup is close to the cost of an mmap.
+    with torch.device("meta"):
+        model = GPTModel(cfg)
+    model.load_state_dict(load_state_dict(path, mmap=mmap), assign=True)
+    model.eval()
+    return model
@@ -0,0 +1,101 @@
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+import torch
+from pathlib import Path
+from torch.utils.data import DataLoader
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+from quantization import load_quantized_model
+sys.path.append(str(Path(__file__).resolve().parent.parent / "basic_concept"))
+from dataloader import PerplexityWindowDataset
+from dataloader import write_token_file
+
+
+def scored_nll(model, input_batch, target_batch, ignore_index=-100, logits_chunk_size=1024):
+    # Sum of the negative log-likelihoods and number of scored targets in a batch.
+    # The output head only runs on the positions that are scored, in chunks of logits_chunk_size
+    # positions, so that the (positions, vocab_size) logits never exist for the whole batch at once
+    hidden = model.hidden_states(input_batch)
+    scored = target_batch != ignore_index
+    hidden, targets = hidden[scored], target_batch[scored]
+    nll = 0.0
+    for i in range(0, len(targets), logits_chunk_size):
+        logits = model.out_head(hidden[i:i + logits_chunk_size])
+        nll += torch.nn.functional.cross_entropy(
+            logits.float(), targets[i:i + logits_chunk_size], reduction="sum").item()
+    return nll, len(targets)
+
+
+def evaluate_perplexity(model, data_loader, device, log_every=None):
+    # Perplexity over every window of a PerplexityWindowDataset loader; returns (perplexity, stats)
+    model.eval()
+    total_nll, total_tokens = 0.0, 0
+    start = time.perf_counter()
+    with torch.inference_mode():
+        for batch_idx, (input_batch, target_batch) in enumerate(data_loader):
+            nll, num_tokens = scored_nll(model, input_batch.to(device), target_batch.to(device),
+                                         data_loader.dataset.ignore_index)
+            total_nll += nll
+            total_tokens += num_tokens
+            if log_every and (batch_idx + 1) % log_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"Batch {batch_idx + 1}/{len(data_loader)}: "
+                      f"perplexity {math.exp(total_nll / total_tokens):.2f}, "
+                      f"{total_tokens / elapsed:.0f} tokens/sec")
+    elapsed = time.perf_counter() - start
+    stats = {"tokens": total_tokens, "nll": total_nll / max(total_tokens, 1),
+             "seconds": elapsed, "tokens_per_sec": total_tokens / elapsed}
+    return math.exp(stats["nll"]), stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sliding-window perplexity of GPTModel on a held-out corpus")
+    parser.add_argument("--model_path", type=str, default="model.pth")
+    parser.add_argument("--token_file", type=str, default=None,
+                        help="uint16 token file or pretokenize.py index.json (memory-mapped)")
+    parser.add_argument("--text_file", type=str, default=None, help="plain text, tokenized into a temporary token file")
+    parser.add_argument("--max_length", type=int, default=GPT_CONFIG_124M["context_length"])
+    parser.add_argument("--stride", type=int, default=GPT_CONFIG_124M["context_length"] // 2,
+                        help="new tokens per window; smaller strides give every token more context but cost more")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--num_workers", type=int, default=0)
+    parser.add_argument("--start", type=int, default=0, help="first token of the evaluated range")
+    parser.add_argument("--max_tokens", type=int, default=None, help="evaluate only this many tokens")
+    parser.add_argument("--int8", action="store_true", help="dynamic int8 quantized CPU inference")
+    parser.add_argument("--log_every", type=int, default=10, help="batches between progress lines")
+    args = parser.parse_args()
+    assert (args.token_file is None) != (args.text_file is None), "pass either --token_file or --text_file"
+
+    device = torch.device("cuda" if torch.cuda.is_available() and not args.int8 else "cpu")
+    if args.int8:
+        model = load_quantized_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path).to(device)
+
+    token_file, tmp_dir = args.token_file, None
+    if args.text_file is not None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        token_file = os.path.join(tmp_dir.name, "tokens.bin")
+        with open(args.text_file, "r", encoding="utf-8") as f:
+            write_token_file(f.read(), token_file)
+
+    end = args.start + args.max_tokens if args.max_tokens is not None else None
+    dataset = PerplexityWindowDataset(token_file, args.max_length, args.stride, start=args.start, end=end)
+    data_loader = DataLoader(dataset, batch_size=args.batch_size, shuffle=False, num_workers=args.num_workers)
+    print(f"{dataset.end - dataset.start:,} tokens, {len(dataset)} windows of {args.max_length} "
+          f"(stride {args.stride}), batch size {args.batch_size}")
+
+    ppl, stats = evaluate_perplexity(model, data_loader, device, log_every=args.log_every)
+    print(f"Perplexity: {ppl:.3f} (mean NLL {stats['nll']:.4f} over {stats['tokens']:,} tokens)")
+    print(f"{stats['tokens_per_sec']:.0f} tokens/sec, {stats['seconds']:.1f}s")
+
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+import torch
+import tiktoken
+from pathlib import Path
+from gpt_model import GPTModel
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+from checkpoint import save_state_dict
+from lora import DEFAULT_TARGETS
+from lora import apply_lora
+from lora import merge_lora
+from lora import save_lora
+from lora import trainable_parameters
+from train_gpt import create_optimizer
+from train_gpt import train_model_simple
+sys.path.append(str(Path(__file__).resolve().parent.parent / "basic_concept"))
+from dataloader import create_dataloader
+
+
+def optimizer_state_mb(optimizer):
+    total = 0
+    for state in optimizer.state.values():
+        total += sum(t.nbytes for t in state.values() if isinstance(t, torch.Tensor))
+    return total / 1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune GPTModel with LoRA adapters (base weights frozen)")
+    parser.add_argument("--model_path", type=str, default=None, help="base weights; random weights if omitted")
+    parser.add_argument("--text_file", type=str, default=None, help="fine-tuning text; default: data/the-verdict.txt")
+    parser.add_argument("--rank", type=int, default=8)
+    parser.add_argument("--alpha", type=float, default=16)
+    parser.add_argument("--lora_dropout", type=float, default=0.0)
+    parser.add_argument("--targets", type=str, nargs="+", default=list(DEFAULT_TARGETS),
+                        help="names (or name suffixes) of the nn.Linear layers that get adapters")
+    parser.add_argument("--learning_rate", type=float, default=1e-3)
+    parser.add_argument("--weight_decay", type=float, default=0.0)
+    parser.add_argument("--num_epochs", type=int, default=2)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--max_length", type=int, default=256)
+    parser.add_argument("--output", type=str, default="lora.pth", help="adapter weights only")
+    parser.add_argument("--merged_output", type=str, default=None,
+                        help="also save base + merged adapters as a regular model checkpoint")
+    args = parser.parse_args()
+
+    torch.manual_seed(123)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    if args.model_path is not None:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        model = GPTModel(GPT_CONFIG_124M)
+    model.to(device)
+
+    num_params = sum(p.numel() for p in model.parameters())
+    apply_lora(model, rank=args.rank, alpha=args.alpha, dropout=args.lora_dropout, target_modules=args.targets)
+    model.to(device)
+    num_trainable = sum(p.numel() for p in trainable_parameters(model))
+    print(f"Trainable parameters: {num_trainable:,} of {num_params:,} ({100 * num_trainable / num_params:.2f}%)")
+
+    settings = {"learning_rate": args.learning_rate, "weight_decay": args.weight_decay}
+    optimizer = create_optimizer(model, settings)
+
+    text_path = args.text_file or Path(__file__).resolve().parent.parent / "data" / "the-verdict.txt"
+    with open(str(text_path), "r", encoding="utf-8") as f:
+        text_data = f.read()
+    split_idx = int(0.9 * len(text_data))
+    train_loader = create_dataloader(text_data[:split_idx], batch_size=args.batch_size, max_length=args.max_length,
+                                     stride=args.max_length, drop_last=True, shuffle=True, num_workers=0)
+    val_loader = create_dataloader(text_data[split_idx:], batch_size=args.batch_size, max_length=args.max_length,
+                                   stride=args.max_length, drop_last=False, shuffle=False, num_workers=0)
+
+    start = time.perf_counter()
+    train_model_simple(
+        model, train_loader, val_loader, optimizer, device,
+        num_epochs=args.num_epochs, eval_freq=5, eval_iter=1,
+        start_context="Every effort moves you", tokenizer=tiktoken.get_encoding("gpt2")
+    )
+    print(f"Training took {time.perf_counter() - start:.1f}s")
+
+    # AdamW keeps two fp32 moments per trained parameter
+    full_mb = 2 * num_params * 4 / 1024**2
+    lora_mb = optimizer_state_mb(optimizer)
+    print(f"AdamW state: {lora_mb:.1f} MB (full fine-tuning: {full_mb:.1f} MB, "
+          f"{100 * (1 - lora_mb / full_mb):.1f}% less)")
+
+    save_lora(model, args.output)
+    print(f"Saved adapters to {args.output} ({os.path.getsize(args.output) / 1024**2:.1f} MB)")
+    if args.merged_output is not None:
+        save_state_dict(merge_lora(model), args.merged_output)
+        print(f"Saved merged model to {args.merged_output}")
+
+
+if __name__ == "__main__":
+    main()
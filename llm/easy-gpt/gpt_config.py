@@ -3,7 +3,16 @@ GPT_CONFIG_124M = {
     "context_length": 1024,  # Context length
     "emb_dim": 768,          # Embedding dimension
     "n_heads": 12,           # Number of attention heads
+    "n_kv_heads": None,      # Key/value heads for grouped-query attention (None = n_heads, 1 = multi-query)
     "n_layers": 12,          # Number of layers
     "drop_rate": 0.1,        # Dropout rate
-    "qkv_bias": False        # Query-Key-Value bias
-}
\ No newline at end of file
+    "qkv_bias": False,       # Query-Key-Value bias
+    "fused_attn": False,     # Fused QKV projection + scaled_dot_product_attention
+    "tie_weights": False,    # Share the token embedding matrix with the output head
+    "sliding_window": None,  # Attend to the last N tokens only; enables generation past context_length
+    "activation_checkpointing": 0  # Recompute every N-th block's activations in backward (0 = off)
+}
+
+# Small draft model for speculative decoding (same vocabulary and width as GPT_CONFIG_124M,
+# so it can also be initialized from the main model's embeddings, first blocks and output head)
+GPT_CONFIG_DRAFT = dict(GPT_CONFIG_124M, n_layers=2)
@@ -1,9 +1,11 @@
 import tiktoken
 import torch
 import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
 from transformer_block import TransformerBlock
 from layer_norm import LayerNorm
 from gpt_config import GPT_CONFIG_124M
+from sampling import Sampler
 
 class GPTModel(nn.Module):
     def __init__(self, cfg):
@@ -12,85 +14,263 @@ class GPTModel(nn.Module):
         self.pos_emb = nn.Embedding(cfg["context_length"], cfg["emb_dim"])
         self.drop_emb = nn.Dropout(cfg["drop_rate"])
 
-        self.trf_blocks = nn.Sequential(
-            *[TransformerBlock(cfg) for _ in range(cfg["n_layers"])])
+        self.trf_blocks = nn.ModuleList(
+            [TransformerBlock(cfg) for _ in range(cfg["n_layers"])])
 
         self.final_norm = LayerNorm(cfg["emb_dim"])
         self.out_head = nn.Linear(cfg["emb_dim"], cfg["vocab_size"], bias=False)
 
-    def forward(self, in_idx):
+        # Weight tying: the output head reuses the token embedding matrix (as in the original GPT-2),
+        # which saves vocab_size * emb_dim parameters
+        self.tie_weights = cfg.get("tie_weights", False)
+        if self.tie_weights:
+            self.out_head.weight = self.tok_emb.weight
+
+        # Activation checkpointing: every N-th transformer block (N = activation_checkpointing, 0 = off)
+        # keeps only its input during training and recomputes its activations in the backward pass,
+        # trading one extra block forward pass for most of the block's activation memory
+        self.activation_checkpointing = cfg.get("activation_checkpointing", 0)
+
+        # Sliding-window attention (see MultiHeadAttention): the KV cache becomes a rolling buffer and
+        # generation can continue past context_length at constant cost per token
+        self.sliding_window = cfg.get("sliding_window")
+        assert self.sliding_window is None or 0 < self.sliding_window <= cfg["context_length"], \
+            "sliding_window must be between 1 and context_length"
+
+        # Number of tokens already stored in the KV cache, used as offset for pos_emb
+        self.current_pos = 0
+
+    def forward(self, in_idx, use_cache=False, attention_mask=None):
+        # attention_mask: optional (batch_size, num_tokens_total) tensor with 1 for real tokens and 0 for
+        # (left) padding; with a KV cache it covers the cached tokens plus the new ones
+        x = self.hidden_states(in_idx, use_cache=use_cache, attention_mask=attention_mask)
+        return self.out_head(x)
+
+    def hidden_states(self, in_idx, use_cache=False, attention_mask=None):
+        # Everything up to the output head: (batch_size, num_tokens, emb_dim). Useful when only some
+        # positions need logits, e.g. perplexity evaluation with a stride
         batch_size, seq_len = in_idx.shape
         tok_embeds = self.tok_emb(in_idx)
-        pos_embeds = self.pos_emb(torch.arange(seq_len, device=in_idx.device))
+
+        if attention_mask is not None:
+            # Positions count real tokens only, so left padding does not shift them
+            pos_ids = (attention_mask.long().cumsum(dim=-1) - 1).clamp(min=0)[:, -seq_len:]
+        elif use_cache:
+            pos_ids = torch.arange(self.current_pos, self.current_pos + seq_len, device=in_idx.device)
+        else:
+            pos_ids = torch.arange(seq_len, device=in_idx.device)
+        if use_cache:
+            self.current_pos += seq_len
+        if self.sliding_window is not None:
+            pos_ids = self.wrap_positions(pos_ids)
+        pos_embeds = self.pos_emb(pos_ids)
+
         x = tok_embeds + pos_embeds  # Shape [batch_size, num_tokens, emb_size]
         x = self.drop_emb(x)
-        x = self.trf_blocks(x)
-        x = self.final_norm(x)
-        logits = self.out_head(x)
-        
-        return logits
+        recompute = (self.activation_checkpointing > 0 and self.training and not use_cache
+                     and torch.is_grad_enabled())
+        for i, blk in enumerate(self.trf_blocks):
+            if recompute and i % self.activation_checkpointing == 0:
+                # Non-reentrant checkpoint; dropout masks are replayed with the saved RNG state
+                x = checkpoint(blk, x, attention_mask=attention_mask, use_reentrant=False)
+            else:
+                x = blk(x, use_cache=use_cache, attention_mask=attention_mask)
+        return self.final_norm(x)
 
-def generate_text_simple(model, idx, max_new_tokens, context_size):
-    # idx是当前文本的索引数组，形状为(batch, n_tokens)
-    for _ in range(max_new_tokens):
+    def wrap_positions(self, pos_ids):
+        # pos_emb only has context_length learned positions. Past the end, positions cycle through the
+        # last sliding_window of them, so the positions inside any window stay distinct. The model has
+        # never seen these wrapped windows in training, so quality past context_length depends on how
+        # much it relies on absolute positions; a window smaller than context_length helps
+        context_length = self.pos_emb.num_embeddings
+        wrapped = context_length - self.sliding_window + (pos_ids - context_length) % self.sliding_window
+        return torch.where(pos_ids < context_length, pos_ids, wrapped)
 
-        # 将当前文本截取至支持的长度
-        idx_cond = idx[:, -context_size:]
+    def load_state_dict(self, state_dict, *args, **kwargs):
+        result = super().load_state_dict(state_dict, *args, **kwargs)
+        if self.tie_weights:
+            self.out_head.weight = self.tok_emb.weight  # load_state_dict(assign=True) would untie them
+        return result
 
-        # 获得预测的下一个词元logits
-        with torch.no_grad():
-            logits = model(idx_cond)
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Tied checkpoints may store the shared matrix under only one of the two names
+        # (safetensors drops duplicates); fill in the other one from it
+        if self.tie_weights:
+            tok_key, out_key = f"{prefix}tok_emb.weight", f"{prefix}out_head.weight"
+            shared = state_dict.get(tok_key, state_dict.get(out_key))
+            if shared is not None:
+                state_dict[tok_key] = state_dict[out_key] = shared
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
-        # 只关注最后一个输出的内容
-        # 形状从(batch, n_token, vocab_size)变为(batch, vocab_size)
-        logits = logits[:, -1, :]
+    def reset_kv_cache(self):
+        for blk in self.trf_blocks:
+            blk.att.reset_cache()
+        self.current_pos = 0
 
-        # 获取具有最高logits值的词汇表条目索引
-        idx_next = torch.argmax(logits, dim=-1, keepdim=True)  # (batch, 1)
+    def select_kv_cache_rows(self, rows):
+        for blk in self.trf_blocks:
+            blk.att.select_cache_rows(rows)
 
-        # 将采样索引追加到运行中的序列
-        idx = torch.cat((idx, idx_next), dim=1)  # (batch, n_tokens+1)
+    def truncate_kv_cache(self, num_tokens):
+        for blk in self.trf_blocks:
+            blk.att.truncate_cache(num_tokens)
+        self.current_pos = min(self.current_pos, num_tokens)
 
-    return idx
+def memory_report(model, depth=1):
+    # Parameter and buffer memory grouped by module name (up to `depth` levels).
+    # Tensors shared between modules (e.g. tied weights) are only counted once.
+    rows, seen = {}, set()
+    tensors = [(name, t, "params") for name, t in model.named_parameters(remove_duplicate=False)]
+    tensors += [(name, t, "buffers") for name, t in model.named_buffers(remove_duplicate=False)]
+    for name, tensor, kind in tensors:
+        module_name = ".".join(name.split(".")[:depth]) if "." in name else "(root)"
+        row = rows.setdefault(module_name, {"params": 0, "params_mb": 0.0, "buffers_mb": 0.0})
+        key = (tensor.data_ptr(), tensor.numel()) if tensor.device.type != "meta" else id(tensor)
+        if key in seen:
+            continue
+        seen.add(key)
+        if kind == "params":
+            row["params"] += tensor.numel()
+        row[f"{kind}_mb"] += tensor.numel() * tensor.element_size() / 1024**2
+    return rows
 
-def generate(model, idx, max_new_tokens, context_size, temperature=0.0, top_k=None, eos_id=None):
 
-    # For-loop is the same as before: Get logits, and only focus on last time step
-    for _ in range(max_new_tokens):
-        idx_cond = idx[:, -context_size:]
-        with torch.no_grad():
-            logits = model(idx_cond)
-        logits = logits[:, -1, :]
+def print_memory_report(model, depth=1):
+    rows = memory_report(model, depth)
+    print(f"{'Module':<24}{'Params':>14}{'Params MB':>12}{'Buffers MB':>12}")
+    for module_name, row in rows.items():
+        print(f"{module_name:<24}{row['params']:>14,}{row['params_mb']:>12.1f}{row['buffers_mb']:>12.1f}")
+    total = {k: sum(row[k] for row in rows.values()) for k in ("params", "params_mb", "buffers_mb")}
+    print(f"{'Total':<24}{total['params']:>14,}{total['params_mb']:>12.1f}{total['buffers_mb']:>12.1f}")
+    return total
 
-        # New: Filter logits with top_k sampling
-        if top_k is not None:
-            # Keep only top_k values
-            top_logits, _ = torch.topk(logits, top_k)
-            min_val = top_logits[:, -1]
-            logits = torch.where(logits < min_val, torch.tensor(float("-inf")).to(logits.device), logits)
 
-        # New: Apply temperature scaling
-        if temperature > 0.0:
-            logits = logits / temperature
+def generate_text_simple(model, idx, max_new_tokens, context_size, use_cache=True):
+    # idx是当前文本的索引数组，形状为(batch, n_tokens)
+    # 贪婪解码等价于temperature为0的generate
+    return generate(model, idx, max_new_tokens, context_size, use_cache=use_cache)
 
-            # Apply softmax to get probabilities
-            probs = torch.softmax(logits, dim=-1)  # (batch_size, context_len)
+def _next_logits(model, idx, context_size, use_cache, attention_mask=None):
+    # Without a cache every step re-runs the whole (truncated) window
+    if not use_cache:
+        window_mask = attention_mask[:, -context_size:] if attention_mask is not None else None
+        return model(idx[:, -context_size:], attention_mask=window_mask)[:, -1, :]
 
-            # Sample from the distribution
-            idx_next = torch.multinomial(probs, num_samples=1)  # (batch_size, 1)
+    # Feed only the newest token while the cache still fits into the context window;
+    # otherwise rebuild the cache from the last context_size tokens (prefill). With sliding-window
+    # attention the cache is a rolling buffer that never needs rebuilding
+    rolling = getattr(model, "sliding_window", None) is not None
+    if model.current_pos == 0 or (model.current_pos >= context_size and not rolling):
+        model.reset_kv_cache()
+        window_mask = attention_mask[:, -context_size:] if attention_mask is not None else None
+        return model(idx[:, -context_size:], use_cache=True, attention_mask=window_mask)[:, -1, :]
+    window_mask = attention_mask[:, -(model.current_pos + 1):] if attention_mask is not None else None
+    return model(idx[:, -1:], use_cache=True, attention_mask=window_mask)[:, -1, :]
 
-        # Otherwise same as before: get idx of the vocab entry with the highest logits value
-        else:
-            idx_next = torch.argmax(logits, dim=-1, keepdim=True)  # (batch_size, 1)
+def generate(model, idx, max_new_tokens, context_size, temperature=0.0, top_k=None, eos_id=None,
+             use_cache=True, top_p=None, min_p=None, repetition_penalty=None):
+    # Generates the same number of tokens for every row; use generate_batch for prompts of
+    # different lengths or when each row should stop at its own end-of-sequence token
+    # New: top_p, min_p and repetition_penalty (see sampling.py)
+    sampler = Sampler(temperature, top_k, top_p, min_p, repetition_penalty)
 
-        if idx_next == eos_id:  # Stop generating early if end-of-sequence token is encountered and eos_id is specified
+    if use_cache:
+        model.reset_kv_cache()
+
+    # For-loop is the same as before: Get logits, and only focus on last time step
+    for _ in range(max_new_tokens):
+        with torch.no_grad():
+            logits = _next_logits(model, idx, context_size, use_cache)
+
+        idx_next = sampler(logits, idx)
+
+        # Stop generating early once every row produced the end-of-sequence token (if eos_id is specified)
+        if eos_id is not None and bool((idx_next == eos_id).all()):
             break
 
         # Same as before: append sampled index to the running sequence
         idx = torch.cat((idx, idx_next), dim=1)  # (batch_size, num_tokens+1)
 
+    if use_cache:
+        model.reset_kv_cache()
+
     return idx
 
+def left_pad(token_id_lists, pad_id=0, device=None):
+    # Left-pad prompts of different lengths into one batch; returns (idx, attention_mask)
+    max_len = max(len(ids) for ids in token_id_lists)
+    idx = torch.full((len(token_id_lists), max_len), pad_id, dtype=torch.long, device=device)
+    attention_mask = torch.zeros((len(token_id_lists), max_len), dtype=torch.long, device=device)
+    for row, ids in enumerate(token_id_lists):
+        if ids:
+            idx[row, max_len - len(ids):] = torch.tensor(ids, dtype=torch.long, device=device)
+            attention_mask[row, max_len - len(ids):] = 1
+    return idx, attention_mask
+
+def generate_batch(model, token_id_lists, max_new_tokens, context_size, temperature=0.0, top_k=None,
+                   eos_id=None, pad_id=0, use_cache=True, top_p=None, min_p=None, repetition_penalty=None,
+                   on_token=None):
+    # Batched generation for prompts of different lengths. Prompts are left-padded and the padding
+    # mask is passed through GPTModel.forward; each row stops at its own eos_id and finished rows
+    # are dropped from the batch (and the KV cache), so the remaining rows run on a smaller batch.
+    # max_new_tokens can also be a list with one limit per prompt.
+    # on_token(row, token_id) is called for every generated token as soon as it is sampled, and with
+    # token_id None once the row has finished (used for streaming).
+    # Returns one list of token ids (prompt + generated tokens) per prompt.
+    device = next(model.parameters()).device
+    idx, attention_mask = left_pad(token_id_lists, pad_id, device)
+    outputs = [list(ids) for ids in token_id_lists]
+    active = torch.arange(len(token_id_lists), device=device)  # original row index of each batch row
+    sampler = Sampler(temperature, top_k, top_p, min_p, repetition_penalty)
+    if isinstance(max_new_tokens, int):
+        max_new_tokens = [max_new_tokens] * len(token_id_lists)
+    remaining = torch.tensor(max_new_tokens, device=device)  # tokens left per batch row
+
+    if use_cache:
+        model.reset_kv_cache()
+
+    for _ in range(max(max_new_tokens, default=0)):
+        with torch.no_grad():
+            logits = _next_logits(model, idx, context_size, use_cache, attention_mask)
+
+        history = None
+        if sampler.uses_token_ids:
+            # Padding is not part of the history; the last token of a row is never padding
+            history = torch.where(attention_mask.bool(), idx, idx[:, -1:])
+        idx_next = sampler(logits, history)  # (batch_size, 1)
+
+        if eos_id is not None:
+            hit_eos = idx_next.squeeze(1) == eos_id
+        else:
+            hit_eos = torch.zeros(idx_next.shape[0], dtype=torch.bool, device=device)
+
+        for row, token in zip(active[~hit_eos].tolist(), idx_next[~hit_eos, 0].tolist()):
+            outputs[row].append(token)
+            if on_token is not None:
+                on_token(row, token)
+
+        remaining -= 1
+        finished = hit_eos | (remaining <= 0)
+        if bool(finished.any()):
+            if on_token is not None:
+                for row in active[finished].tolist():
+                    on_token(row, None)
+            keep = (~finished).nonzero(as_tuple=True)[0]
+            if keep.numel() == 0:
+                break
+            active, idx, attention_mask, idx_next = active[keep], idx[keep], attention_mask[keep], idx_next[keep]
+            remaining = remaining[keep]
+            if use_cache:
+                model.select_kv_cache_rows(keep)
+
+        idx = torch.cat((idx, idx_next), dim=1)
+        attention_mask = torch.cat((attention_mask, torch.ones_like(idx_next)), dim=1)
+
+    if use_cache:
+        model.reset_kv_cache()
+
+    return outputs
+
 def main():
     torch.manual_seed(123)
     model = GPTModel(GPT_CONFIG_124M)
@@ -1,15 +1,40 @@
+import argparse
+import time
 import torch
 import tiktoken
-from gpt_model import GPTModel
 from gpt_model import generate
+from checkpoint import load_gpt_model
+from quantization import load_quantized_model
+from quantization import save_quantized_model
+from lora import load_lora
+from lora import merge_lora
 from gpt_config import GPT_CONFIG_124M
 
 import sys
 sys.path.append('..')
 
 def main():
-    model = GPTModel(GPT_CONFIG_124M)
-    model.load_state_dict(torch.load("model.pth", weights_only=True))
+    parser = argparse.ArgumentParser(description="Load a trained GPT model and generate text")
+    parser.add_argument("--model_path", type=str, default="model.pth")
+    parser.add_argument("--int8", action="store_true",
+                        help="dynamic int8 quantized CPU inference; model_path may be fp32 or already quantized")
+    parser.add_argument("--save_int8", type=str, default=None, help="save the quantized model to this path")
+    parser.add_argument("--lora_path", type=str, default=None,
+                        help="LoRA adapters from finetune_lora.py, merged into the fp32 weights after loading")
+    args = parser.parse_args()
+
+    # Memory-mapped load; also accepts a training checkpoint (checkpoints/ckpt_*.pth) or model.safetensors
+    start = time.perf_counter()
+    if args.lora_path:
+        assert not (args.int8 or args.save_int8), "merge the adapters (finetune_lora.py --merged_output) before quantizing"
+        model = merge_lora(load_lora(load_gpt_model(GPT_CONFIG_124M, args.model_path), args.lora_path)).eval()
+    elif args.int8 or args.save_int8:
+        model = load_quantized_model(GPT_CONFIG_124M, args.model_path)
+        if args.save_int8:
+            save_quantized_model(model, args.save_int8)
+    else:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    print(f"Model loaded in {time.perf_counter() - start:.2f}s")
 
     ###########################
     # Generate text
@@ -0,0 +1,109 @@
+import math
+import torch
+import torch.nn as nn
+
+# Linear layers that get adapters by default: the attention projections (W_qkv for
+# FusedMultiHeadAttention) and both FeedForward linears (ff.layers.0 / ff.layers.2)
+DEFAULT_TARGETS = ("W_query", "W_key", "W_value", "W_qkv", "out_proj", "ff.layers.0", "ff.layers.2")
+
+
+class LoRALinear(nn.Module):
+    # nn.Linear plus a trainable low-rank update: y = x W^T + b + (x A^T B^T) * alpha / rank.
+    # The base weight and bias are taken over from the wrapped layer (same parameter names, so base
+    # checkpoints still load) and frozen; only lora_A (rank, in) and lora_B (out, rank) are trained.
+    # lora_B starts at zero, so the adapted model starts out identical to the base model.
+    def __init__(self, linear, rank=8, alpha=16, dropout=0.0):
+        super().__init__()
+        self.in_features, self.out_features = linear.in_features, linear.out_features
+        self.weight, self.bias = linear.weight, linear.bias
+        self.weight.requires_grad_(False)
+        if self.bias is not None:
+            self.bias.requires_grad_(False)
+
+        self.rank, self.alpha = rank, alpha
+        self.scaling = alpha / rank
+        factory = {"device": linear.weight.device, "dtype": linear.weight.dtype}
+        self.lora_A = nn.Parameter(torch.empty(rank, self.in_features, **factory))
+        self.lora_B = nn.Parameter(torch.zeros(self.out_features, rank, **factory))
+        nn.init.kaiming_uniform_(self.lora_A, a=math.sqrt(5))  # same init as nn.Linear weights
+        self.dropout = nn.Dropout(dropout)
+
+    def forward(self, x):
+        out = nn.functional.linear(x, self.weight, self.bias)
+        return out + (self.dropout(x) @ self.lora_A.T @ self.lora_B.T) * self.scaling
+
+    def merged_linear(self):
+        # Plain nn.Linear with the update folded into the weight: no extra cost at inference
+        linear = nn.Linear(self.in_features, self.out_features, bias=self.bias is not None,
+                           device="meta")
+        with torch.no_grad():
+            weight = self.weight + (self.lora_B @ self.lora_A) * self.scaling
+        linear.weight = nn.Parameter(weight)
+        if self.bias is not None:
+            linear.bias = nn.Parameter(self.bias.detach())
+        return linear
+
+
+def _target_linears(model, target_modules):
+    # (parent module, attribute name) of every nn.Linear whose name ends with a target
+    for name, module in list(model.named_modules()):
+        for child_name, child in module.named_children():
+            full_name = f"{name}.{child_name}" if name else child_name
+            if isinstance(child, nn.Linear) and any(
+                    full_name == t or full_name.endswith(f".{t}") for t in target_modules):
+                yield module, child_name
+
+
+def apply_lora(model, rank=8, alpha=16, dropout=0.0, target_modules=DEFAULT_TARGETS):
+    # Freezes the whole model and replaces the target linears with LoRALinear, in place.
+    # Afterwards only the adapter parameters require gradients, so create_optimizer (train_gpt.py)
+    # keeps AdamW state for the adapters only
+    for param in model.parameters():
+        param.requires_grad_(False)
+    replaced = 0
+    for parent, child_name in _target_linears(model, target_modules):
+        setattr(parent, child_name, LoRALinear(getattr(parent, child_name), rank, alpha, dropout))
+        replaced += 1
+    assert replaced > 0, f"no nn.Linear matches {target_modules}"
+    model.lora_config = {"rank": rank, "alpha": alpha, "dropout": dropout, "target_modules": list(target_modules)}
+    return model
+
+
+def trainable_parameters(model):
+    return [p for p in model.parameters() if p.requires_grad]
+
+
+def lora_state_dict(model):
+    return {name: t.detach().cpu() for name, t in model.state_dict().items() if ".lora_" in name}
+
+
+def save_lora(model, path):
+    # Only the adapter weights (a few MB) and the settings needed to re-create them
+    torch.save({"lora_config": model.lora_config, "lora": lora_state_dict(model)}, path)
+
+
+def load_lora(model, path):
+    # Attaches the adapters saved by save_lora to a model holding the same base weights
+    checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+    if not hasattr(model, "lora_config"):
+        apply_lora(model, **checkpoint["lora_config"])
+    missing, unexpected = model.load_state_dict(checkpoint["lora"], strict=False)
+    assert not unexpected, f"unexpected adapter weights: {unexpected}"
+    missing_adapters = [name for name in missing if ".lora_" in name]
+    assert not missing_adapters, f"adapter weights missing from {path}: {missing_adapters}"
+    return model
+
+
+def merge_lora(model):
+    # Folds every adapter into its base weight and puts plain nn.Linear layers back, in place.
+    # The merged model has exactly the base architecture: it saves as a regular checkpoint and
+    # runs (or quantizes) without any LoRA overhead
+    for name, module in list(model.named_modules()):
+        for child_name, child in module.named_children():
+            if isinstance(child, LoRALinear):
+                setattr(module, child_name, child.merged_linear())
+    for param in model.parameters():
+        param.requires_grad_(True)  # undo the freezing of apply_lora
+    if hasattr(model, "lora_config"):
+        del model.lora_config
+    return model
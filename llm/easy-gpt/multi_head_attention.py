@@ -1,57 +1,260 @@
 import torch
 import torch.nn as nn
 
+# Boolean causal masks (True above the diagonal) per (context_length, device, sliding_window), shared by
+# all attention layers instead of every layer holding its own context_length x context_length buffer
+_causal_masks = {}
+
+
+def _build_causal_mask(context_length, device, sliding_window):
+    ones = torch.ones(context_length, context_length, dtype=torch.bool, device=device)
+    mask = torch.triu(ones, diagonal=1)
+    if sliding_window is not None:
+        # Sliding-window attention: keys sliding_window or more positions back are masked too
+        mask |= torch.tril(ones, diagonal=-sliding_window)
+    return mask
+
+
+def get_causal_mask(context_length, device, sliding_window=None):
+    if torch.compiler.is_compiling():
+        # Traced by torch.compile / torch.export (ONNX export): build the mask inside the graph,
+        # caching it here would store a fake tensor that breaks later eager calls
+        return _build_causal_mask(context_length, device, sliding_window)
+    key = (context_length, torch.device(device), sliding_window)
+    if key not in _causal_masks:
+        _causal_masks[key] = _build_causal_mask(context_length, device, sliding_window)
+    return _causal_masks[key]
+
+
+def update_kv_cache(module, keys_new, values_new, num_tokens):
+    # Appends the new keys/values to the cache of an attention module and returns the keys/values
+    # to attend over. With a sliding window, the cache is a rolling buffer of the last
+    # sliding_window positions, and keys that none of the num_tokens queries can reach are dropped,
+    # so memory and cost per generated token stay constant however long the sequence gets
+    if module.cache_k is None:
+        module.cache_k, module.cache_v = keys_new, values_new
+    else:
+        module.cache_k = torch.cat([module.cache_k, keys_new], dim=2)
+        module.cache_v = torch.cat([module.cache_v, values_new], dim=2)
+    keys, values = module.cache_k, module.cache_v
+    window = module.sliding_window
+    if window is not None:
+        # The oldest query sits at num_tokens_k - num_tokens and sees window - 1 keys before it
+        first_visible = max(0, keys.shape[2] - num_tokens - (window - 1))
+        keys, values = keys[:, :, first_visible:], values[:, :, first_visible:]
+        module.cache_k, module.cache_v = module.cache_k[:, :, -window:], module.cache_v[:, :, -window:]
+    return keys, values
+
+
 class MultiHeadAttention(nn.Module):
-    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False):
+    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False, num_kv_heads=None,
+                 sliding_window=None):
         super().__init__()
         assert d_out % num_heads == 0, "d_out must be divisible by num_heads"
 
+        # Grouped-query attention: num_kv_heads key/value heads, each shared by a group of
+        # num_heads // num_kv_heads query heads (num_kv_heads=1 is multi-query attention).
+        # Shrinks the key/value projections and the KV cache by the group size
+        num_kv_heads = num_kv_heads or num_heads
+        assert num_heads % num_kv_heads == 0, "num_heads must be divisible by num_kv_heads"
+
         self.d_out = d_out
         self.num_heads = num_heads
+        self.num_kv_heads = num_kv_heads
         self.head_dim = d_out // num_heads  # Reduce the projection dim to match desired output dim
+        self.context_length = context_length
+        # Sliding-window attention: each token attends to itself and the sliding_window - 1 tokens before it
+        self.sliding_window = sliding_window
 
         self.W_query = nn.Linear(d_in, d_out, bias=qkv_bias)
-        self.W_key = nn.Linear(d_in, d_out, bias=qkv_bias)
-        self.W_value = nn.Linear(d_in, d_out, bias=qkv_bias)
+        self.W_key = nn.Linear(d_in, num_kv_heads * self.head_dim, bias=qkv_bias)
+        self.W_value = nn.Linear(d_in, num_kv_heads * self.head_dim, bias=qkv_bias)
         self.out_proj = nn.Linear(d_out, d_out)  # Linear layer to combine head outputs
         self.dropout = nn.Dropout(dropout)
-        self.register_buffer("mask", torch.triu(torch.ones(context_length, context_length), diagonal=1))
 
-    def forward(self, x):
+        # KV cache: keys/values of all tokens seen so far, used for incremental decoding
+        self.register_buffer("cache_k", None, persistent=False)
+        self.register_buffer("cache_v", None, persistent=False)
+
+    def forward(self, x, use_cache=False, attention_mask=None):
         b, num_tokens, d_in = x.shape
 
-        keys = self.W_key(x)  # Shape: (b, num_tokens, d_out)
+        keys_new = self.W_key(x)  # Shape: (b, num_tokens, d_out)
         queries = self.W_query(x)
-        values = self.W_value(x)
+        values_new = self.W_value(x)
 
         # We implicitly split the matrix by adding a `num_heads` dimension
         # Unroll last dim: (b, num_tokens, d_out) -> (b, num_tokens, num_heads, head_dim)
-        keys = keys.view(b, num_tokens, self.num_heads, self.head_dim)
-        values = values.view(b, num_tokens, self.num_heads, self.head_dim)
+        keys_new = keys_new.view(b, num_tokens, self.num_kv_heads, self.head_dim)
+        values_new = values_new.view(b, num_tokens, self.num_kv_heads, self.head_dim)
         queries = queries.view(b, num_tokens, self.num_heads, self.head_dim)
 
         # Transpose: (b, num_tokens, num_heads, head_dim) -> (b, num_heads, num_tokens, head_dim)
-        keys = keys.transpose(1, 2)
+        keys_new = keys_new.transpose(1, 2)
         queries = queries.transpose(1, 2)
-        values = values.transpose(1, 2)
+        values_new = values_new.transpose(1, 2)
+
+        if use_cache:
+            # Append the new keys/values to the cache and attend over the whole cached sequence
+            # (or its last sliding_window positions)
+            keys, values = update_kv_cache(self, keys_new, values_new, num_tokens)
+        else:
+            keys, values = keys_new, values_new
+
+        # Group the query heads by the key/value head they share:
+        # (b, num_heads, num_tokens, head_dim) -> (b, num_kv_heads, group_size * num_tokens, head_dim),
+        # so that one batched matmul per key/value head covers its whole group without copying the keys
+        group_size = self.num_heads // self.num_kv_heads
+        queries = queries.reshape(b, self.num_kv_heads, group_size * num_tokens, self.head_dim)
 
         # Compute scaled dot-product attention (aka self-attention) with a causal mask
         attn_scores = queries @ keys.transpose(2, 3)  # Dot product for each head
+        # (b, num_kv_heads, group_size, num_tokens, num_tokens_k)
+        attn_scores = attn_scores.view(b, self.num_kv_heads, group_size, num_tokens, -1)
 
-        # Original mask truncated to the number of tokens and converted to boolean
-        mask_bool = self.mask.bool()[:num_tokens, :num_tokens]
+        # Shared boolean causal mask; the queries are the last num_tokens of the
+        # num_tokens_k cached positions, so take the matching rows of the mask
+        # (a sliding window can attend over more than context_length positions in one pass)
+        num_tokens_k = keys.shape[2]
+        mask_size = max(self.context_length, num_tokens_k)
+        mask_bool = get_causal_mask(mask_size, x.device, self.sliding_window)[num_tokens_k - num_tokens:num_tokens_k, :num_tokens_k]
 
         # Use the mask to fill attention scores
-        attn_scores.masked_fill_(mask_bool, -torch.inf)
+        if attention_mask is None:
+            attn_scores.masked_fill_(mask_bool, -torch.inf)
+        else:
+            # Padding mask (b, num_tokens_k) with 0 for padding tokens, combined with the causal mask
+            # and filled once with the smallest finite value instead of -inf, so that query rows made
+            # only of padding do not turn into NaN (same as FusedMultiHeadAttention)
+            pad_mask = attention_mask[:, None, None, None, -num_tokens_k:] == 0
+            attn_scores.masked_fill_(mask_bool | pad_mask, torch.finfo(attn_scores.dtype).min)
 
         attn_weights = torch.softmax(attn_scores / keys.shape[-1]**0.5, dim=-1)
         attn_weights = self.dropout(attn_weights)
+        attn_weights = attn_weights.view(b, self.num_kv_heads, group_size * num_tokens, num_tokens_k)
 
         # Shape: (b, num_tokens, num_heads, head_dim)
-        context_vec = (attn_weights @ values).transpose(1, 2)
+        context_vec = (attn_weights @ values).view(b, self.num_heads, num_tokens, self.head_dim).transpose(1, 2)
 
         # Combine heads, where self.d_out = self.num_heads * self.head_dim
         context_vec = context_vec.contiguous().view(b, num_tokens, self.d_out)
         context_vec = self.out_proj(context_vec)  # optional projection
 
-        return context_vec
\ No newline at end of file
+        return context_vec
+
+    def reset_cache(self):
+        self.cache_k, self.cache_v = None, None
+
+    def select_cache_rows(self, rows):
+        # Keep only the given batch rows in the cache (e.g. when finished sequences leave the batch)
+        if self.cache_k is not None:
+            self.cache_k, self.cache_v = self.cache_k[rows], self.cache_v[rows]
+
+    def truncate_cache(self, num_tokens):
+        # Keep only the first num_tokens cached positions (e.g. to drop rejected draft tokens)
+        if self.cache_k is not None:
+            self.cache_k, self.cache_v = self.cache_k[:, :, :num_tokens], self.cache_v[:, :, :num_tokens]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Accept checkpoints of FusedMultiHeadAttention by splitting W_qkv on load
+        kv_dim = self.num_kv_heads * self.head_dim
+        for name in ("weight", "bias"):
+            fused_key = f"{prefix}W_qkv.{name}"
+            if fused_key in state_dict:
+                q, k, v = state_dict.pop(fused_key).split([self.d_out, kv_dim, kv_dim], dim=0)
+                state_dict[f"{prefix}W_query.{name}"] = q
+                state_dict[f"{prefix}W_key.{name}"] = k
+                state_dict[f"{prefix}W_value.{name}"] = v
+        # Older checkpoints contain a per-layer float mask; the mask is now shared and not saved
+        state_dict.pop(f"{prefix}mask", None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+
+class FusedMultiHeadAttention(nn.Module):
+    """Same computation as MultiHeadAttention, but with one fused QKV projection and
+    torch.nn.functional.scaled_dot_product_attention instead of explicit scores/mask/softmax."""
+
+    def __init__(self, d_in, d_out, context_length, dropout, num_heads, qkv_bias=False, num_kv_heads=None,
+                 sliding_window=None):
+        super().__init__()
+        assert d_out % num_heads == 0, "d_out must be divisible by num_heads"
+        num_kv_heads = num_kv_heads or num_heads
+        assert num_heads % num_kv_heads == 0, "num_heads must be divisible by num_kv_heads"
+
+        self.d_out = d_out
+        self.num_heads = num_heads
+        self.num_kv_heads = num_kv_heads
+        self.head_dim = d_out // num_heads
+        self.context_length = context_length
+        self.sliding_window = sliding_window
+
+        # query, key and value in one matmul (d_out query features, then the key and value heads)
+        self.W_qkv = nn.Linear(d_in, d_out + 2 * num_kv_heads * self.head_dim, bias=qkv_bias)
+        self.out_proj = nn.Linear(d_out, d_out)
+        self.dropout = dropout
+
+        self.register_buffer("cache_k", None, persistent=False)
+        self.register_buffer("cache_v", None, persistent=False)
+
+    def forward(self, x, use_cache=False, attention_mask=None):
+        b, num_tokens, d_in = x.shape
+
+        # (b, num_tokens, num_heads + 2 * num_kv_heads, head_dim) -> per projection (b, heads, num_tokens, head_dim)
+        qkv = self.W_qkv(x).view(b, num_tokens, self.num_heads + 2 * self.num_kv_heads, self.head_dim).transpose(1, 2)
+        queries, keys, values = qkv.split([self.num_heads, self.num_kv_heads, self.num_kv_heads], dim=1)
+
+        if use_cache:
+            keys, values = update_kv_cache(self, keys, values, num_tokens)
+
+        num_tokens_k = keys.shape[2]
+        mask_size = max(self.context_length, num_tokens_k)
+        # Whether the sliding window hides some earlier keys from some queries
+        banded = self.sliding_window is not None and num_tokens_k > self.sliding_window
+        if attention_mask is not None:
+            # Additive mask: smallest finite value for future and padding keys (combined, filled once),
+            # so that query rows made only of padding do not turn into NaN
+            future = get_causal_mask(mask_size, x.device, self.sliding_window)[num_tokens_k - num_tokens:num_tokens_k, :num_tokens_k]
+            pad = attention_mask[:, None, None, -num_tokens_k:] == 0
+            attn_mask = torch.zeros(b, 1, num_tokens, num_tokens_k, dtype=queries.dtype, device=x.device)
+            attn_mask.masked_fill_(future | pad, torch.finfo(queries.dtype).min)
+            is_causal = False
+        elif num_tokens == num_tokens_k and not banded:
+            attn_mask, is_causal = None, True
+        elif num_tokens == 1:
+            # A single new query may attend to every cached position (the cache holds only the window)
+            attn_mask, is_causal = None, False
+        else:
+            # Several new queries on top of a cache, or a sliding window: explicit (shifted) mask
+            future = get_causal_mask(mask_size, x.device, self.sliding_window)[num_tokens_k - num_tokens:num_tokens_k, :num_tokens_k]
+            attn_mask = ~future
+            is_causal = False
+
+        # enable_gqa (PyTorch 2.5+) lets each key/value head serve its group of query heads;
+        # only passed when needed, so plain multi-head attention also runs on older versions
+        gqa_kwargs = {"enable_gqa": True} if self.num_kv_heads != self.num_heads else {}
+        context_vec = nn.functional.scaled_dot_product_attention(
+            queries, keys, values, attn_mask=attn_mask,
+            dropout_p=self.dropout if self.training else 0.0, is_causal=is_causal, **gqa_kwargs)
+
+        context_vec = context_vec.transpose(1, 2).contiguous().view(b, num_tokens, self.d_out)
+        return self.out_proj(context_vec)
+
+    def reset_cache(self):
+        self.cache_k, self.cache_v = None, None
+
+    def select_cache_rows(self, rows):
+        if self.cache_k is not None:
+            self.cache_k, self.cache_v = self.cache_k[rows], self.cache_v[rows]
+
+    def truncate_cache(self, num_tokens):
+        if self.cache_k is not None:
+            self.cache_k, self.cache_v = self.cache_k[:, :, :num_tokens], self.cache_v[:, :, :num_tokens]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # Accept checkpoints of MultiHeadAttention by fusing W_query/W_key/W_value on load
+        for name in ("weight", "bias"):
+            keys = [f"{prefix}W_query.{name}", f"{prefix}W_key.{name}", f"{prefix}W_value.{name}"]
+            if all(key in state_dict for key in keys):
+                state_dict[f"{prefix}W_qkv.{name}"] = torch.cat([state_dict.pop(key) for key in keys], dim=0)
+        state_dict.pop(f"{prefix}mask", None)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
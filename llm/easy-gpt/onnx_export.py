@@ -0,0 +1,132 @@
+import argparse
+import numpy as np
+import torch
+import torch.nn as nn
+from gpt_model import GPTModel
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import load_gpt_model
+
+# Needs the onnx extra (onnx, onnxscript, onnxruntime); onnxruntime is imported when a session is created
+
+
+def past_names(n_layers, prefix="past"):
+    # past_key_0, past_value_0, past_key_1, ... (prefix "present" for the outputs)
+    return [f"{prefix}_{kind}_{i}" for i in range(n_layers) for kind in ("key", "value")]
+
+
+class GPTWithPast(nn.Module):
+    # Stateless KV-cache interface for export: the keys/values of the previous tokens come in as
+    # inputs (batch_size, n_kv_heads, past_len, head_dim) per layer, and the updated ones go out next
+    # to the logits. past_len may be 0 for the first (prefill) step. Internally it fills the
+    # attention caches and runs the regular GPTModel forward with use_cache=True.
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, past):
+        blocks = self.model.trf_blocks
+        for i, blk in enumerate(blocks):
+            blk.att.cache_k, blk.att.cache_v = past[2 * i], past[2 * i + 1]
+        self.model.current_pos = past[0].shape[2]  # positions continue after the cached tokens
+        logits = self.model(input_ids, use_cache=True)
+        present = []
+        for blk in blocks:
+            present += [blk.att.cache_k, blk.att.cache_v]
+        self.model.reset_kv_cache()
+        return logits, *present
+
+
+def export_onnx(model, path, with_past=False, example_batch_size=2, example_num_tokens=8):
+    # Exports GPTModel (input_ids -> logits) or, with with_past, GPTWithPast
+    # (input_ids, past keys/values -> logits, present keys/values) with dynamic batch, sequence
+    # and cache-length axes
+    model.eval()
+    # GPTWithPast derives positions from the past length, which a rolling sliding-window cache caps
+    assert not (with_past and model.sliding_window is not None), "with_past does not support sliding windows"
+    context_length = model.pos_emb.num_embeddings
+    n_layers = len(model.trf_blocks)
+    att = model.trf_blocks[0].att
+    input_ids = torch.randint(0, model.tok_emb.num_embeddings, (example_batch_size, example_num_tokens))
+
+    batch = torch.export.Dim("batch")
+    seq = torch.export.Dim("seq", max=context_length)
+    if with_past:
+        past_len = torch.export.Dim("past", min=0, max=context_length)
+        past = tuple(torch.zeros(example_batch_size, att.num_kv_heads, 5, att.head_dim) for _ in range(2 * n_layers))
+        module, args = GPTWithPast(model), (input_ids, past)
+        dynamic_shapes = ({0: batch, 1: seq}, ({0: batch, 2: past_len},) * (2 * n_layers))
+        input_names = ["input_ids"] + past_names(n_layers)
+        output_names = ["logits"] + past_names(n_layers, "present")
+    else:
+        module, args = model, (input_ids,)
+        dynamic_shapes = ({0: batch, 1: seq},)
+        input_names, output_names = ["input_ids"], ["logits"]
+
+    with torch.no_grad():
+        torch.onnx.export(module, args, path, input_names=input_names, output_names=output_names,
+                          dynamic_shapes=dynamic_shapes, dynamo=True)
+    return path
+
+
+class OnnxGPTModel:
+    # onnxruntime (CPU provider) stand-in for GPTModel in generate(): model(idx, use_cache=...)
+    # returns torch logits, and the KV cache lives in this object between calls.
+    # path: export without past (used for use_cache=False); with_past_path: export with past
+    # (used for use_cache=True). Either may be None if only one mode is needed.
+    def __init__(self, path=None, with_past_path=None, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        providers = ["CPUExecutionProvider"]
+        self.session = ort.InferenceSession(path, options, providers=providers) if path else None
+        self.session_with_past = (ort.InferenceSession(with_past_path, options, providers=providers)
+                                  if with_past_path else None)
+        if self.session_with_past is not None:
+            inputs = self.session_with_past.get_inputs()
+            self.past_names = [i.name for i in inputs[1:]]
+            _, self.n_heads, _, self.head_dim = inputs[1].shape  # (batch, n_kv_heads, past, head_dim)
+        self.past = None
+        self.current_pos = 0
+
+    def __call__(self, in_idx, use_cache=False, attention_mask=None):
+        assert attention_mask is None, "the exported graphs have no padding mask input"
+        input_ids = in_idx.cpu().numpy().astype(np.int64)
+        if not use_cache:
+            assert self.session is not None, "needs an export without past (path)"
+            return torch.from_numpy(self.session.run(None, {"input_ids": input_ids})[0])
+
+        assert self.session_with_past is not None, "use_cache=True needs an export with past (with_past_path)"
+        if self.past is None:
+            empty = np.zeros((input_ids.shape[0], self.n_heads, 0, self.head_dim), dtype=np.float32)
+            self.past = [empty] * len(self.past_names)
+        outputs = self.session_with_past.run(None, {"input_ids": input_ids, **dict(zip(self.past_names, self.past))})
+        logits, self.past = outputs[0], outputs[1:]
+        self.current_pos += input_ids.shape[1]
+        return torch.from_numpy(logits)
+
+    def reset_kv_cache(self):
+        self.past = None
+        self.current_pos = 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export GPTModel to ONNX (with and without KV-cache inputs)")
+    parser.add_argument("--model_path", type=str, default=None, help="trained weights; random weights if omitted")
+    parser.add_argument("--output", type=str, default="gpt.onnx")
+    parser.add_argument("--output_with_past", type=str, default="gpt_with_past.onnx")
+    args = parser.parse_args()
+
+    if args.model_path is not None:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        torch.manual_seed(123)
+        model = GPTModel(GPT_CONFIG_124M).eval()
+
+    export_onnx(model, args.output)
+    export_onnx(model, args.output_with_past, with_past=True)
+    print(f"Saved {args.output} and {args.output_with_past}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import time
+import numpy as np
+import tiktoken
+from pathlib import Path
+
+
+def iter_text_chunks(file_path, chunk_chars):
+    # Stream a text file in chunks of roughly chunk_chars characters.
+    # Chunks end on line boundaries so that words are never split between chunks.
+    with open(file_path, "r", encoding="utf-8") as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= chunk_chars:
+                yield "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines)
+
+
+class ShardWriter:
+    """Writes a token stream into fixed-size uint16 shards plus an index.json."""
+
+    def __init__(self, output_dir, shard_size, dtype=np.uint16):
+        self.output_dir = Path(output_dir)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.shard_size = shard_size
+        self.dtype = np.dtype(dtype)
+        self.buffer = np.empty(shard_size, dtype=self.dtype)
+        self.pos = 0
+        self.shards = []
+
+    def write(self, token_ids):
+        token_ids = np.asarray(token_ids, dtype=self.dtype)
+        while len(token_ids) > 0:
+            n = min(self.shard_size - self.pos, len(token_ids))
+            self.buffer[self.pos:self.pos + n] = token_ids[:n]
+            self.pos += n
+            token_ids = token_ids[n:]
+            if self.pos == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if self.pos == 0:
+            return
+        file_name = f"shard_{len(self.shards):05d}.bin"
+        self.buffer[:self.pos].tofile(str(self.output_dir / file_name))
+        self.shards.append({"file": file_name, "num_tokens": self.pos})
+        self.pos = 0
+
+    def close(self, **metadata):
+        self.flush()
+        index = {
+            "dtype": self.dtype.name,
+            "shard_size": self.shard_size,
+            "num_tokens": sum(shard["num_tokens"] for shard in self.shards),
+            "shards": self.shards,
+            **metadata
+        }
+        index_path = self.output_dir / "index.json"
+        with open(index_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        return index_path, index
+
+
+def pretokenize(input_files, output_dir, encoding="gpt2", shard_size=10_000_000,
+                chunk_chars=1 << 20, num_threads=None):
+    tokenizer = tiktoken.get_encoding(encoding)
+    if tokenizer.max_token_value > np.iinfo(np.uint16).max:
+        raise ValueError(f"Encoding {encoding} does not fit into uint16 token ids")
+
+    num_threads = num_threads or os.cpu_count() or 1
+    writer = ShardWriter(output_dir, shard_size)
+
+    for file_path in input_files:
+        batch = []
+        for chunk in iter_text_chunks(file_path, chunk_chars):
+            batch.append(chunk)
+            # A few chunks per thread keep all threads busy while bounding memory use
+            if len(batch) == 4 * num_threads:
+                for token_ids in tokenizer.encode_ordinary_batch(batch, num_threads=num_threads):
+                    writer.write(token_ids)
+                batch = []
+        for token_ids in tokenizer.encode_ordinary_batch(batch, num_threads=num_threads):
+            writer.write(token_ids)
+        # Separate documents the same way GPT-2 training data does
+        writer.write([tokenizer.eot_token])
+
+    return writer.close(encoding=encoding, input_files=[str(f) for f in input_files])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tokenize text files once into uint16 token shards for training")
+    parser.add_argument("input_files", nargs="+", help="UTF-8 text files, one document per file")
+    parser.add_argument("--output_dir", type=str, required=True)
+    parser.add_argument("--encoding", type=str, default="gpt2")
+    parser.add_argument("--shard_size", type=int, default=10_000_000, help="tokens per shard")
+    parser.add_argument("--chunk_chars", type=int, default=1 << 20, help="characters per tokenization chunk")
+    parser.add_argument("--num_threads", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index_path, index = pretokenize(
+        args.input_files, args.output_dir, encoding=args.encoding, shard_size=args.shard_size,
+        chunk_chars=args.chunk_chars, num_threads=args.num_threads
+    )
+    elapsed = time.perf_counter() - start
+
+    print(f"Tokens:  {index['num_tokens']:,} in {len(index['shards'])} shard(s)")
+    print(f"Speed:   {index['num_tokens'] / elapsed:,.0f} tokens/sec")
+    print(f"Index:   {index_path}")
+    print(f'Train with OTHER_SETTINGS["token_file"] = "{index_path}"')
+
+
+if __name__ == "__main__":
+    main()
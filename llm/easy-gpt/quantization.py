@@ -0,0 +1,41 @@
+import torch
+import torch.nn as nn
+from torch.ao.quantization import quantize_dynamic
+from torch.ao.quantization import per_channel_dynamic_qconfig
+from gpt_model import GPTModel
+from checkpoint import load_state_dict
+
+
+def quantize_model(model):
+    # Dynamic int8 quantization for CPU inference: the weights of every nn.Linear
+    # (attention projections, feed-forward layers and out_head) are stored as int8 with one
+    # scale per output channel, activations are quantized on the fly per batch.
+    # Embeddings and LayerNorms stay fp32.
+    # Returns a quantized copy; the fp32 model is left unchanged.
+    model.eval()
+    quantized = quantize_dynamic(model, {nn.Linear: per_channel_dynamic_qconfig}, dtype=torch.qint8)
+    # out_head now holds its own int8 copy of the weights, so it is no longer tied to tok_emb
+    quantized.tie_weights = False
+    return quantized
+
+
+def is_quantized_state_dict(state_dict):
+    return any(key.endswith("_packed_params._packed_params") for key in state_dict)
+
+
+def save_quantized_model(model, path):
+    torch.save(model.state_dict(), path)
+
+
+def load_quantized_model(cfg, path):
+    # Accepts a checkpoint saved by save_quantized_model, or an fp32 checkpoint
+    # (plain state dict, training checkpoint or .safetensors) that is quantized after loading
+    state_dict = load_state_dict(path)
+    model = GPTModel(cfg)
+    if is_quantized_state_dict(state_dict):
+        model = quantize_model(model)
+        model.load_state_dict(state_dict)
+    else:
+        model.load_state_dict(state_dict)
+        model = quantize_model(model)
+    return model
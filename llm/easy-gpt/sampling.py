@@ -0,0 +1,199 @@
+import math
+import torch
+
+
+def _buffer(owner, name, shape, dtype, device):
+    # Work tensor stored on owner; reallocated only when the shape (e.g. the batch size) changes
+    buf = getattr(owner, name, None)
+    if buf is None or buf.shape != shape or buf.dtype != dtype or buf.device != device:
+        buf = torch.empty(shape, dtype=dtype, device=device)
+        setattr(owner, name, buf)
+    return buf
+
+
+class LogitsProcessor:
+    # A processor takes the logits of the candidate tokens (batch_size, num_candidates) and their
+    # vocabulary ids (batch_size, num_candidates), or None while the candidates are the whole
+    # vocabulary, and returns both. Processors either change the logits in place (-inf removes a
+    # token) or narrow the candidates down, so that later steps no longer work on all 50257 logits.
+    # token_ids (batch_size, num_tokens) holds the tokens generated so far (prompt included).
+    # Work tensors are kept between calls and only reallocated when their shape changes.
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        raise NotImplementedError
+
+
+class RepetitionPenaltyProcessor(LogitsProcessor):
+    # Repetition penalty from the CTRL paper: logits of tokens that already occur in token_ids are
+    # divided by penalty if positive and multiplied by it if negative (penalty > 1 discourages repeats)
+    def __init__(self, penalty):
+        assert penalty > 0.0, "repetition_penalty must be positive"
+        self.penalty = penalty
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        assert candidate_ids is None, "the repetition penalty has to run on the full vocabulary"
+        batch_size, num_tokens = token_ids.shape
+        # token_ids grows by one token per step: keep spare capacity and work on a view
+        scores = getattr(self, "scores", None)
+        if (scores is None or scores.shape[0] != batch_size or scores.shape[1] < num_tokens
+                or scores.dtype != logits.dtype or scores.device != logits.device):
+            shape = (batch_size, 2 * num_tokens)
+            scores = _buffer(self, "scores", shape, logits.dtype, logits.device)
+            _buffer(self, "factors", shape, logits.dtype, logits.device)
+            _buffer(self, "negative", shape, torch.bool, logits.device)
+        scores = scores[:, :num_tokens]
+        factors, negative = self.factors[:, :num_tokens], self.negative[:, :num_tokens]
+        torch.gather(logits, 1, token_ids, out=scores)
+        torch.lt(scores, 0, out=negative)
+        factors.fill_(1.0 / self.penalty).masked_fill_(negative, self.penalty)
+        scores.mul_(factors)
+        logits.scatter_(1, token_ids, scores)
+        return logits, candidate_ids
+
+
+class TemperatureProcessor(LogitsProcessor):
+    def __init__(self, temperature):
+        assert temperature > 0.0, "temperature must be positive"
+        self.temperature = temperature
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        return logits.div_(self.temperature), candidate_ids
+
+
+class TopKProcessor(LogitsProcessor):
+    # Narrows the candidates down to the top_k largest logits (sorted in descending order)
+    def __init__(self, top_k):
+        assert top_k > 0, "top_k must be positive"
+        self.top_k = top_k
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        top_k = min(self.top_k, logits.shape[-1])
+        shape = (logits.shape[0], top_k)
+        top_logits = _buffer(self, "top_logits", shape, logits.dtype, logits.device)
+        top_pos = _buffer(self, "top_pos", shape, torch.long, logits.device)
+        torch.topk(logits, top_k, out=(top_logits, top_pos))
+        if candidate_ids is None:
+            return top_logits, top_pos
+        top_ids = _buffer(self, "top_ids", shape, torch.long, logits.device)
+        return top_logits, torch.gather(candidate_ids, 1, top_pos, out=top_ids)
+
+
+class TopPProcessor(LogitsProcessor):
+    # Nucleus sampling: keep the smallest set of tokens whose probabilities add up to at least top_p
+    # (the most likely token is always kept). Sorting all 50257 probabilities is slow on the CPU, so
+    # the most likely tokens are taken with topk, starting with min_candidates and growing until they
+    # cover top_p in every row; usually the nucleus is much smaller than the vocabulary.
+    def __init__(self, top_p, min_candidates=256):
+        assert 0.0 < top_p <= 1.0, "top_p must be in (0, 1]"
+        self.top_p = top_p
+        self.min_candidates = min_candidates
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        batch_size, num_candidates = logits.shape
+        device = logits.device
+        probs = _buffer(self, "probs", logits.shape, logits.dtype, device)
+        torch.softmax(logits, dim=-1, out=probs)
+
+        k = min(self.min_candidates, num_candidates)
+        while True:
+            shape = (batch_size, k)
+            top_probs = _buffer(self, "top_probs", shape, logits.dtype, device)
+            top_pos = _buffer(self, "top_pos", shape, torch.long, device)
+            torch.topk(probs, k, out=(top_probs, top_pos))
+            if k == num_candidates or bool((top_probs.sum(dim=-1) >= self.top_p).all()):
+                break
+            k = min(4 * k, num_candidates)
+
+        # Remove a token if the tokens before it already reach top_p
+        cum_probs = _buffer(self, "cum_probs", shape, logits.dtype, device)
+        remove = _buffer(self, "remove", shape, torch.bool, device)
+        torch.cumsum(top_probs, dim=-1, out=cum_probs)
+        cum_probs.sub_(top_probs)
+        torch.ge(cum_probs, self.top_p, out=remove)
+        remove[:, 0] = False
+
+        top_logits = _buffer(self, "top_logits", shape, logits.dtype, device)
+        torch.gather(logits, 1, top_pos, out=top_logits)
+        top_logits.masked_fill_(remove, float("-inf"))
+        if candidate_ids is None:
+            return top_logits, top_pos
+        top_ids = _buffer(self, "top_ids", shape, torch.long, device)
+        return top_logits, torch.gather(candidate_ids, 1, top_pos, out=top_ids)
+
+
+class MinPProcessor(LogitsProcessor):
+    # Keep tokens whose probability is at least min_p times the probability of the most likely token.
+    # Compared in log space, logit >= max_logit + log(min_p), so no softmax is needed
+    def __init__(self, min_p):
+        assert 0.0 < min_p <= 1.0, "min_p must be in (0, 1]"
+        self.log_min_p = math.log(min_p)
+
+    def __call__(self, logits, candidate_ids, token_ids):
+        threshold = _buffer(self, "threshold", (logits.shape[0], 1), logits.dtype, logits.device)
+        mask = _buffer(self, "mask", logits.shape, torch.bool, logits.device)
+        torch.amax(logits, dim=-1, keepdim=True, out=threshold)
+        threshold.add_(self.log_min_p)
+        torch.lt(logits, threshold, out=mask)
+        return logits.masked_fill_(mask, float("-inf")), candidate_ids
+
+
+class LogitsProcessorList(list):
+    def __call__(self, logits, candidate_ids, token_ids):
+        for processor in self:
+            logits, candidate_ids = processor(logits, candidate_ids, token_ids)
+        return logits, candidate_ids
+
+
+class Sampler:
+    # Turns the last-position logits of a batch into the next tokens (batch_size, 1).
+    # Processors run in the order repetition penalty -> temperature -> top-k -> top-p -> min-p.
+    # temperature 0 means greedy decoding: only the repetition penalty applies (top-k, top-p and
+    # min-p always keep the most likely token) and the argmax is taken.
+    # Create one Sampler per generation call; its buffers are reused on every step, so the returned
+    # tokens are only valid until the next call.
+    def __init__(self, temperature=0.0, top_k=None, top_p=None, min_p=None, repetition_penalty=None):
+        self.greedy = temperature <= 0.0
+        self.processors = LogitsProcessorList()
+        if repetition_penalty is not None and repetition_penalty != 1.0:
+            self.processors.append(RepetitionPenaltyProcessor(repetition_penalty))
+        if not self.greedy:
+            if temperature != 1.0:
+                self.processors.append(TemperatureProcessor(temperature))
+            if top_k is not None:
+                self.processors.append(TopKProcessor(top_k))
+            if top_p is not None and top_p < 1.0:
+                self.processors.append(TopPProcessor(top_p))
+            if min_p is not None and min_p > 0.0:
+                self.processors.append(MinPProcessor(min_p))
+        self.uses_token_ids = any(isinstance(p, RepetitionPenaltyProcessor) for p in self.processors)
+
+    def process(self, logits, token_ids=None):
+        # Returns (candidate logits, candidate ids or None for the whole vocabulary).
+        # The processors work on a copy; the caller's logits stay unchanged
+        work = _buffer(self, "work", logits.shape, logits.dtype, logits.device)
+        work.copy_(logits)
+        return self.processors(work, None, token_ids)
+
+    def __call__(self, logits, token_ids=None):
+        batch_size = logits.shape[0]
+        next_token = _buffer(self, "next_token", (batch_size, 1), torch.long, logits.device)
+        if self.processors:
+            logits, candidate_ids = self.process(logits, token_ids)
+        else:
+            candidate_ids = None
+        if self.greedy:
+            return torch.argmax(logits, dim=-1, keepdim=True, out=next_token)
+
+        # Inverse transform sampling: the first candidate whose cumulative probability exceeds a
+        # uniform random number; much faster than torch.multinomial over the whole vocabulary
+        probs = _buffer(self, "probs", logits.shape, logits.dtype, logits.device)
+        torch.softmax(logits, dim=-1, out=probs)
+        torch.cumsum(probs, dim=-1, out=probs)
+        u = _buffer(self, "u", (batch_size, 1), logits.dtype, logits.device)
+        u.uniform_().mul_(probs[:, -1:])
+        pos = torch.searchsorted(probs, u, right=True, out=next_token)
+        pos.clamp_(max=probs.shape[-1] - 1)
+        if candidate_ids is None:
+            return pos
+        token = _buffer(self, "token", (batch_size, 1), torch.long, logits.device)
+        return torch.gather(candidate_ids, 1, pos, out=token)
@@ -0,0 +1,324 @@
+import argparse
+import codecs
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+import tiktoken
+import torch
+from gpt_model import generate_batch
+from sampling import Sampler
+from checkpoint import load_gpt_model
+from quantization import load_quantized_model
+from gpt_config import GPT_CONFIG_124M
+
+
+class GenerationRequest:
+    # One client request. The scheduler puts every generated token id into tokens as soon as it is
+    # sampled, then None when the request is done (or the exception if generation failed).
+    def __init__(self, token_ids, max_new_tokens, temperature=0.0, top_k=None, top_p=None, min_p=None,
+                 repetition_penalty=None):
+        self.token_ids = token_ids
+        self.max_new_tokens = max_new_tokens
+        self.sampling = dict(temperature=temperature, top_k=top_k, top_p=top_p, min_p=min_p,
+                             repetition_penalty=repetition_penalty)
+        self.tokens = queue.Queue()
+        self.submitted = time.perf_counter()
+
+
+class BatchScheduler:
+    # Runs the model on a single background thread. Requests that arrive within batch_window_ms of
+    # the first waiting request are grouped into one micro-batch (up to max_batch_size) and generated
+    # together with generate_batch and the KV cache. The sampler is shared by the whole batch, so a
+    # batch only holds requests with the same sampling settings; the others wait for the next batch.
+    def __init__(self, model, context_size, eos_id=None, max_batch_size=8, batch_window_ms=20.0):
+        self.model = model
+        self.context_size = context_size
+        self.eos_id = eos_id
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window_ms / 1000
+        self.incoming = queue.Queue()
+        self.pending = deque()  # taken from incoming, but left for a later batch
+        self.lock = threading.Lock()
+        self.stats = {
+            "requests_total": 0,
+            "requests_completed": 0,
+            "batches_total": 0,
+            "batched_requests": 0,
+            "active_requests": 0,
+            "last_batch_size": 0,
+            "tokens_generated": 0,
+            "generation_seconds": 0.0,
+            "queue_wait_seconds": 0.0,
+            "last_batch_tokens_per_sec": 0.0,
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, request):
+        with self.lock:
+            self.stats["requests_total"] += 1
+        self.incoming.put(request)
+        return request
+
+    def metrics(self):
+        with self.lock:
+            stats = dict(self.stats)
+        batches = max(stats["batches_total"], 1)
+        return {
+            "queue_depth": self.incoming.qsize() + len(self.pending),
+            "active_requests": stats["active_requests"],
+            "requests_total": stats["requests_total"],
+            "requests_completed": stats["requests_completed"],
+            "batches_total": stats["batches_total"],
+            "last_batch_size": stats["last_batch_size"],
+            "avg_batch_size": stats["batched_requests"] / batches,
+            "max_batch_size": self.max_batch_size,
+            "tokens_generated": stats["tokens_generated"],
+            "tokens_per_sec": stats["tokens_generated"] / max(stats["generation_seconds"], 1e-9),
+            "last_batch_tokens_per_sec": stats["last_batch_tokens_per_sec"],
+            "avg_queue_wait_ms": 1000 * stats["queue_wait_seconds"] / max(stats["requests_completed"], 1),
+        }
+
+    def _next_batch(self):
+        batch = [self.pending.popleft() if self.pending else self.incoming.get()]
+        deadline = time.perf_counter() + self.batch_window
+
+        # Waiting requests with the same settings first (oldest first), then new arrivals until the
+        # batch is full or the window closes
+        for request in list(self.pending):
+            if len(batch) == self.max_batch_size:
+                return batch
+            if request.sampling == batch[0].sampling:
+                self.pending.remove(request)
+                batch.append(request)
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                request = self.incoming.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if request.sampling == batch[0].sampling:
+                batch.append(request)
+            else:
+                self.pending.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            with self.lock:
+                self.stats["active_requests"] = len(batch)
+                self.stats["queue_wait_seconds"] += sum(start - request.submitted for request in batch)
+
+            num_tokens = 0
+
+            def on_token(row, token):
+                nonlocal num_tokens
+                if token is None:
+                    with self.lock:
+                        self.stats["requests_completed"] += 1
+                        self.stats["active_requests"] -= 1
+                else:
+                    num_tokens += 1
+                batch[row].tokens.put(token)
+
+            try:
+                generate_batch(
+                    self.model, [request.token_ids for request in batch],
+                    [request.max_new_tokens for request in batch], self.context_size,
+                    eos_id=self.eos_id, on_token=on_token, **batch[0].sampling
+                )
+            except Exception as e:
+                for request in batch:
+                    request.tokens.put(e)
+
+            # Batch statistics are updated once the whole batch is done
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stats["requests_completed"] += self.stats["active_requests"]  # failed batch
+                self.stats["active_requests"] = 0
+                self.stats["batches_total"] += 1
+                self.stats["batched_requests"] += len(batch)
+                self.stats["last_batch_size"] = len(batch)
+                self.stats["tokens_generated"] += num_tokens
+                self.stats["generation_seconds"] += elapsed
+                self.stats["last_batch_tokens_per_sec"] = num_tokens / elapsed
+
+
+def _optional(body, key, cast):
+    return cast(body[key]) if body.get(key) is not None else None
+
+
+def make_handler(scheduler, tokenizer, max_new_tokens_limit=1024):
+    class GenerationHandler(BaseHTTPRequestHandler):
+        # POST /generate  {"prompt": str, "max_new_tokens": int, "temperature": float, "top_k": int,
+        #                  "top_p": float, "min_p": float, "repetition_penalty": float, "stream": bool}
+        # GET  /metrics   queue depth, batch sizes and tokens/sec as JSON
+        # GET  /health
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                self._send_json(200, scheduler.metrics())
+            elif self.path == "/health":
+                self._send_json(200, {"status": "ok"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            if self.path != "/generate":
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                request = self._parse_request(body)
+            except (ValueError, TypeError, AssertionError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            scheduler.submit(request)
+            if body.get("stream", False):
+                self._stream(request)
+            else:
+                self._respond(request)
+
+        def _parse_request(self, body):
+            prompt = body.get("prompt")
+            if not isinstance(prompt, str):
+                raise ValueError("'prompt' must be a string")
+            max_new_tokens = int(body.get("max_new_tokens", 50))
+            if not 1 <= max_new_tokens <= max_new_tokens_limit:
+                raise ValueError(f"'max_new_tokens' must be between 1 and {max_new_tokens_limit}")
+            # An empty prompt starts from the end-of-text token, like unconditional GPT-2 samples
+            token_ids = tokenizer.encode(prompt) or [tokenizer.eot_token]
+            request = GenerationRequest(
+                token_ids, max_new_tokens,
+                temperature=float(body.get("temperature", 0.0)),
+                top_k=_optional(body, "top_k", int),
+                top_p=_optional(body, "top_p", float),
+                min_p=_optional(body, "min_p", float),
+                repetition_penalty=_optional(body, "repetition_penalty", float),
+            )
+            Sampler(**request.sampling)  # invalid settings fail here instead of failing the whole batch
+            return request
+
+        def _tokens(self, request):
+            # Yields generated token ids until the request is done
+            while True:
+                token = request.tokens.get()
+                if token is None:
+                    return
+                if isinstance(token, Exception):
+                    raise token
+                yield token
+
+        def _respond(self, request):
+            try:
+                token_ids = list(self._tokens(request))
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+                return
+            self._send_json(200, {
+                "text": tokenizer.decode(token_ids),
+                "num_tokens": len(token_ids),
+                "latency_s": time.perf_counter() - request.submitted,
+            })
+
+        def _stream(self, request):
+            # Newline-delimited JSON over chunked transfer encoding: one {"token": text} line per token,
+            # then a final {"done": true, ...} line. Tokens are decoded incrementally, so multi-byte
+            # characters split across tokens are only sent once complete.
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+            token_ids = []
+            first_token_s = None
+            try:
+                for token in self._tokens(request):
+                    if first_token_s is None:
+                        first_token_s = time.perf_counter() - request.submitted
+                    token_ids.append(token)
+                    text = decoder.decode(tokenizer.decode_single_token_bytes(token))
+                    if text:
+                        self._write_chunk({"token": text})
+                tail = decoder.decode(b"", final=True)
+                if tail:
+                    self._write_chunk({"token": tail})
+                self._write_chunk({
+                    "done": True,
+                    "text": tokenizer.decode(token_ids),
+                    "num_tokens": len(token_ids),
+                    "time_to_first_token_s": first_token_s,
+                    "latency_s": time.perf_counter() - request.submitted,
+                })
+            except (BrokenPipeError, ConnectionResetError):
+                return  # client went away; the batch still finishes the request
+            except Exception as e:
+                self._write_chunk({"error": str(e)})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, obj):
+            data = (json.dumps(obj) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def _send_json(self, status, obj):
+            data = json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass  # one line per request would drown the output; see /metrics
+
+    return GenerationHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP text generation server with dynamic batching")
+    parser.add_argument("--model_path", type=str, default="model.pth")
+    parser.add_argument("--int8", action="store_true", help="dynamic int8 quantized CPU inference")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=8)
+    parser.add_argument("--batch_window_ms", type=float, default=20.0,
+                        help="how long the first waiting request waits for others to join its batch")
+    parser.add_argument("--num_threads", type=int, default=None, help="torch intra-op threads")
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+    start = time.perf_counter()
+    if args.int8:
+        model = load_quantized_model(GPT_CONFIG_124M, args.model_path)
+    else:
+        model = load_gpt_model(GPT_CONFIG_124M, args.model_path)
+    print(f"Model loaded in {time.perf_counter() - start:.2f}s")
+
+    tokenizer = tiktoken.get_encoding("gpt2")
+    scheduler = BatchScheduler(model, GPT_CONFIG_124M["context_length"], eos_id=tokenizer.eot_token,
+                               max_batch_size=args.max_batch_size, batch_window_ms=args.batch_window_ms).start()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(scheduler, tokenizer))
+    print(f"Serving on http://{args.host}:{args.port} (POST /generate, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == "__main__":
+    main()
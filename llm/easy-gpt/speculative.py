@@ -0,0 +1,122 @@
+import torch
+from gpt_model import GPTModel
+from sampling import Sampler
+
+
+def token_probs(logits, sampler):
+    # The full-vocabulary distribution sampler draws from for each row of logits (..., vocab_size):
+    # the Sampler's own processors (temperature, top-k) followed by a softmax, or a one-hot argmax
+    # for greedy decoding (temperature 0)
+    flat = logits.reshape(-1, logits.shape[-1])
+    if sampler.greedy:
+        probs = torch.zeros_like(flat).scatter_(1, flat.argmax(dim=-1, keepdim=True), 1.0)
+        return probs.view(logits.shape)
+    candidate_logits, candidate_ids = sampler.process(flat) if sampler.processors else (flat, None)
+    probs = torch.softmax(candidate_logits, dim=-1)
+    if candidate_ids is not None:
+        probs = torch.zeros_like(flat).scatter_(1, candidate_ids, probs)  # back to vocabulary ids
+    return probs.view(logits.shape)
+
+
+def draft_from_model(model, draft_cfg):
+    # Draft model made of the main model's embeddings, its first draft_cfg["n_layers"] transformer
+    # blocks and its output head; needs the same emb_dim and vocabulary. Useful when no separately
+    # trained draft model is available.
+    draft_model = GPTModel(draft_cfg)
+    draft_model.load_state_dict(model.state_dict(), strict=False)
+    return draft_model.eval()
+
+
+def generate_speculative(model, draft_model, idx, max_new_tokens, context_size, num_draft_tokens=4,
+                         temperature=0.0, top_k=None, eos_id=None):
+    # Speculative decoding for a single sequence (batch size 1). Each round, the small draft model
+    # proposes num_draft_tokens tokens one by one, and the main model scores all of them in a single
+    # forward pass. Draft token x is accepted with probability min(1, p(x) / q(x)) (p: main model,
+    # q: draft model); at the first rejection a replacement is sampled from max(0, p - q), and if all
+    # are accepted one extra token is sampled from p. The output has the same distribution as
+    # generate() with the main model (for temperature 0: exactly the same tokens while the sequence
+    # fits into context_size).
+    # Both models must share the tokenizer. Returns (idx, stats).
+    assert idx.shape[0] == 1, "speculative decoding supports batch size 1"
+    k = num_draft_tokens
+    assert k + 1 < context_size, "num_draft_tokens must be smaller than the context size"
+    # Rejected draft tokens are dropped with truncate_kv_cache, which a rolling buffer cannot undo
+    assert model.sliding_window is None and draft_model.sliding_window is None, \
+        "speculative decoding does not support sliding-window attention"
+    # One Sampler per model: their work buffers differ in shape (1 row vs. k + 1 rows)
+    draft_sampler, main_sampler = Sampler(temperature, top_k), Sampler(temperature, top_k)
+    stats = {"rounds": 0, "proposed": 0, "accepted": 0}
+    start_len = idx.shape[1]
+    offset = 0  # tokens before the models' window; positions in the KV caches are relative to it
+
+    model.reset_kv_cache()
+    draft_model.reset_kv_cache()
+
+    with torch.no_grad():
+        while idx.shape[1] - start_len < max_new_tokens:
+            # Slide the window so that the new round (up to k + 1 positions) still fits, and rebuild
+            # both caches from the kept tokens on the next forward passes
+            if idx.shape[1] - offset + k > context_size:
+                offset = idx.shape[1] - (context_size - k - 1)
+                model.reset_kv_cache()
+                draft_model.reset_kv_cache()
+            window = idx[:, offset:]
+            window_len = window.shape[1]
+
+            # 1) Draft model proposes k tokens autoregressively, feeding only what is not cached yet
+            draft_tokens, draft_probs = [], []
+            draft_input = window[:, draft_model.current_pos:]
+            for _ in range(k):
+                q = token_probs(draft_model(draft_input, use_cache=True)[:, -1, :], draft_sampler)
+                token = torch.multinomial(q, num_samples=1)
+                draft_tokens.append(token)
+                draft_probs.append(q)
+                draft_input = token
+            draft_tokens = torch.cat(draft_tokens, dim=1)  # (1, k)
+
+            # 2) Main model scores the uncached part of the window plus all draft tokens at once;
+            # the last k + 1 positions give its distributions for draft token 1..k and the token after
+            main_input = torch.cat([window[:, model.current_pos:], draft_tokens], dim=1)
+            p = token_probs(model(main_input, use_cache=True)[:, -(k + 1):, :], main_sampler)
+
+            # 3) Accept/reject from left to right
+            num_accepted, next_token = 0, None
+            for i in range(k):
+                x = draft_tokens[0, i]
+                p_x, q_x = p[0, i, x], draft_probs[i][0, x]
+                if torch.rand(()) < torch.clamp(p_x / q_x, max=1.0):
+                    num_accepted += 1
+                    continue
+                residual = torch.clamp(p[0, i] - draft_probs[i][0], min=0.0)
+                residual = residual if residual.sum() > 0 else p[0, i]
+                next_token = torch.multinomial(residual / residual.sum(), num_samples=1).view(1, 1)
+                break
+            if next_token is None:
+                next_token = torch.multinomial(p[0, k], num_samples=1).view(1, 1)
+
+            stats["rounds"] += 1
+            stats["proposed"] += k
+            stats["accepted"] += num_accepted
+
+            new_tokens = torch.cat([draft_tokens[:, :num_accepted], next_token], dim=1)
+            new_tokens = new_tokens[:, :max_new_tokens - (idx.shape[1] - start_len)]
+
+            # Stop at the end-of-sequence token (not included in the output, like generate)
+            if eos_id is not None and bool((new_tokens == eos_id).any()):
+                eos_pos = int((new_tokens[0] == eos_id).nonzero()[0])
+                idx = torch.cat([idx, new_tokens[:, :eos_pos]], dim=1)
+                break
+            idx = torch.cat([idx, new_tokens], dim=1)
+
+            # Drop cache entries of rejected draft tokens; the newest token is fed next round
+            valid = window_len + num_accepted
+            model.truncate_kv_cache(valid)
+            draft_model.truncate_kv_cache(valid)
+
+    model.reset_kv_cache()
+    draft_model.reset_kv_cache()
+
+    stats["generated"] = idx.shape[1] - start_len
+    stats["acceptance_rate"] = stats["accepted"] / max(stats["proposed"], 1)
+    stats["tokens_per_round"] = stats["generated"] / max(stats["rounds"], 1)
+    return idx, stats
@@ -0,0 +1,225 @@
+import argparse
+import contextlib
+import os
+import socket
+import sys
+import time
+import matplotlib.pyplot as plt
+import tiktoken
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from pathlib import Path
+from torch.nn.parallel import DistributedDataParallel as DDP
+from torch.utils.data import DataLoader
+from torch.utils.data.distributed import DistributedSampler
+from gpt_model import GPTModel
+from gpt_config import GPT_CONFIG_124M
+from checkpoint import AsyncCheckpointer
+from checkpoint import latest_checkpoint
+from checkpoint import load_checkpoint
+from checkpoint import save_state_dict
+from train_gpt import calc_loss_batch
+from train_gpt import create_optimizer
+from train_gpt import evaluate_model
+from train_gpt import generate_and_print_sample
+from train_gpt import peak_rss_mb
+from train_gpt import plot_losses
+sys.path.append(str(Path(__file__).resolve().parent.parent / "basic_concept"))
+from dataloader import GPTDataset
+from dataloader import MemmapGPTDataset
+from dataloader import count_tokens
+
+
+def create_datasets(gpt_config, settings, train_ratio=0.90):
+    max_length = stride = gpt_config["context_length"]
+    if settings.get("token_file"):
+        token_file = settings["token_file"]
+        split_idx = int(train_ratio * count_tokens(token_file))
+        return (MemmapGPTDataset(token_file, max_length, stride, end=split_idx),
+                MemmapGPTDataset(token_file, max_length, stride, start=split_idx))
+
+    data_path = Path(__file__).resolve().parent.parent / "data" / "the-verdict.txt"
+    with open(str(data_path), "r", encoding="utf-8") as f:
+        text_data = f.read()
+    split_idx = int(train_ratio * len(text_data))
+    tokenizer = tiktoken.get_encoding("gpt2")
+    return (GPTDataset(text_data[:split_idx], tokenizer, max_length, stride),
+            GPTDataset(text_data[split_idx:], tokenizer, max_length, stride))
+
+
+def train_model_ddp(model, train_loader, val_loader, optimizer, device, num_epochs,
+                    eval_freq, eval_iter, start_context, tokenizer, rank, world_size,
+                    grad_accum_steps=1, amp_dtype=None, checkpointer=None, checkpoint_freq=100, resume=None):
+    # model is wrapped in DDP: backward() all-reduces (averages) the gradients over all processes,
+    # so every rank applies the same update. Evaluation, samples and checkpoints only run on rank 0.
+    train_losses, val_losses, track_tokens_seen = [], [], []
+    tokens_seen = 0
+    global_step = -1
+    start_epoch, skip_batches = 0, 0
+    if resume is not None:
+        train_losses, val_losses, track_tokens_seen = resume["train_losses"], resume["val_losses"], resume["track_tokens_seen"]
+        tokens_seen, global_step, start_epoch = resume["tokens_seen"], resume["step"], resume["epoch"]
+        skip_batches = resume["batch_idx"] + 1
+    use_amp = amp_dtype is not None
+
+    for epoch in range(start_epoch, num_epochs):
+        model.train()
+        train_loader.sampler.set_epoch(epoch)  # same shuffle on all ranks, different shard per rank
+        optimizer.zero_grad(set_to_none=True)
+        interval_start, interval_tokens = time.perf_counter(), 0
+
+        num_batches = len(train_loader)  # per rank; the same on every rank
+        for batch_idx, (input_batch, target_batch) in enumerate(train_loader):
+            if epoch == start_epoch and batch_idx < skip_batches:
+                continue  # already trained on before the checkpoint
+            # The last window of the epoch may be shorter than grad_accum_steps
+            window_start = batch_idx - batch_idx % grad_accum_steps
+            window_size = min(grad_accum_steps, num_batches - window_start)
+            sync = batch_idx + 1 == window_start + window_size
+
+            # Skip the gradient all-reduce on accumulation steps; it runs once per optimizer step
+            with model.no_sync() if not sync else contextlib.nullcontext():
+                with torch.autocast(device_type=device.type, dtype=amp_dtype or torch.bfloat16, enabled=use_amp):
+                    loss = calc_loss_batch(input_batch, target_batch, model, device)
+                (loss / window_size).backward()
+            # Tokens over all ranks
+            tokens_seen += input_batch.numel() * world_size
+            interval_tokens += input_batch.numel() * world_size
+
+            if not sync:
+                continue
+
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            global_step += 1
+
+            if rank == 0 and global_step % eval_freq == 0:
+                tokens_per_sec = interval_tokens / (time.perf_counter() - interval_start)
+                train_loss, val_loss = evaluate_model(
+                    model.module, train_loader, val_loader, device, eval_iter)
+                train_losses.append(train_loss)
+                val_losses.append(val_loss)
+                track_tokens_seen.append(tokens_seen)
+                print(f"Ep {epoch+1} (Step {global_step:06d}): "
+                      f"Train loss {train_loss:.3f}, Val loss {val_loss:.3f}, "
+                      f"{tokens_per_sec:.0f} tokens/sec ({world_size} processes), "
+                      f"peak RSS {peak_rss_mb():.0f} MB")
+                interval_start, interval_tokens = time.perf_counter(), 0
+
+            if rank == 0 and checkpointer is not None and (global_step + 1) % checkpoint_freq == 0:
+                checkpointer.save(
+                    model.module, optimizer, global_step, epoch, batch_idx, torch.get_rng_state(),
+                    tokens_seen=tokens_seen, train_losses=train_losses, val_losses=val_losses,
+                    track_tokens_seen=track_tokens_seen
+                )
+
+        if rank == 0:
+            generate_and_print_sample(
+                model.module, tokenizer, device, start_context
+            )
+
+    return train_losses, val_losses, track_tokens_seen
+
+
+def worker(rank, world_size, gpt_config, settings):
+    dist.init_process_group("gloo", rank=rank, world_size=world_size)
+    # Split the cores between the processes instead of every process using all of them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    device = torch.device("cpu")
+
+    torch.manual_seed(123)  # identical initial weights on every rank
+    model = GPTModel(gpt_config)
+    if "activation_checkpointing" in settings:
+        model.activation_checkpointing = settings["activation_checkpointing"]
+    optimizer = create_optimizer(model, settings)
+
+    checkpointer, resume = None, None
+    if settings.get("checkpoint_dir"):
+        checkpoint_path = latest_checkpoint(settings["checkpoint_dir"])
+        if checkpoint_path is not None and settings.get("resume", True):
+            resume = load_checkpoint(checkpoint_path, model, optimizer)
+            if rank == 0:
+                print(f"Resuming from {checkpoint_path} (step {resume['step']})")
+        if rank == 0:
+            checkpointer = AsyncCheckpointer(settings["checkpoint_dir"], keep_last=settings.get("keep_checkpoints", 2))
+        dist.barrier()  # all ranks have read the checkpoint before rank 0 may write the next one
+    # Different dropout masks on every rank
+    torch.manual_seed(123 + rank + (resume["step"] + 1 if resume is not None else 0))
+
+    ddp_model = DDP(model)
+
+    train_dataset, val_dataset = create_datasets(gpt_config, settings)
+    train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True, seed=123,
+                                       drop_last=True)
+    train_loader = DataLoader(train_dataset, batch_size=settings["batch_size"], sampler=train_sampler,
+                              drop_last=True, num_workers=settings.get("num_workers", 0))
+    val_loader = DataLoader(val_dataset, batch_size=settings["batch_size"], shuffle=False,
+                            drop_last=False, num_workers=settings.get("num_workers", 0))
+
+    tokenizer = tiktoken.get_encoding("gpt2")
+
+    if rank == 0:
+        print(f"start train model on {world_size} processes...")
+    train_losses, val_losses, tokens_seen = train_model_ddp(
+        ddp_model, train_loader, val_loader, optimizer, device,
+        num_epochs=settings["num_epochs"], eval_freq=5, eval_iter=1,
+        start_context="Every effort moves you", tokenizer=tokenizer,
+        rank=rank, world_size=world_size,
+        grad_accum_steps=settings.get("grad_accum_steps", 1),
+        amp_dtype=torch.bfloat16 if settings.get("bf16", False) else None,
+        checkpointer=checkpointer, checkpoint_freq=settings.get("checkpoint_freq", 100), resume=resume
+    )
+
+    if rank == 0:
+        if checkpointer is not None:
+            checkpointer.close()
+        print("train model done...")
+        epochs_tensor = torch.linspace(0, settings["num_epochs"], len(train_losses))
+        plot_losses(epochs_tensor, tokens_seen, train_losses, val_losses)
+        plt.savefig("loss.pdf")
+        save_state_dict(model, "model.pth")
+
+    dist.destroy_process_group()
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-parallel GPT training on CPU (torch.distributed, gloo)")
+    parser.add_argument("--nproc", type=int, default=2, help="number of training processes")
+    parser.add_argument("--token_file", type=str, default=None,
+                        help="uint16 token file or pretokenize.py index.json; default tokenizes the-verdict.txt")
+    args = parser.parse_args()
+
+    settings = {
+        "learning_rate": 5e-4,
+        "num_epochs": 10,
+        "batch_size": 2,           # per process; the global batch is batch_size * nproc * grad_accum_steps
+        "weight_decay": 0.1,
+        "bf16": False,             # bf16 autocast
+        "grad_accum_steps": 1,
+        "fused_adamw": False,
+        "activation_checkpointing": 0,  # recompute every N-th block in backward
+        "token_file": args.token_file,
+        "num_workers": 0,
+        "checkpoint_dir": None,    # written by rank 0 only
+        "checkpoint_freq": 100,
+        "resume": True
+    }
+
+    if "RANK" in os.environ:
+        # Started by torchrun, e.g. torchrun --nproc_per_node 4 train_ddp.py
+        worker(int(os.environ["RANK"]), int(os.environ["WORLD_SIZE"]), GPT_CONFIG_124M, settings)
+    else:
+        os.environ.setdefault("MASTER_ADDR", "127.0.0.1")
+        os.environ.setdefault("MASTER_PORT", str(find_free_port()))
+        mp.spawn(worker, args=(args.nproc, GPT_CONFIG_124M, settings), nprocs=args.nproc)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,23 @@
 import matplotlib.pyplot as plt
+import resource
+import sys
+import time
 import torch
 import tiktoken
 from pathlib import Path
 from gpt_model import GPTModel
 from gpt_model import generate_text_simple
 from gpt_model import generate
-import sys
-sys.path.append('..')
+from checkpoint import AsyncCheckpointer
+from checkpoint import latest_checkpoint
+from checkpoint import load_checkpoint
+from checkpoint import resume_epoch
+from checkpoint import save_state_dict
+from checkpoint import load_gpt_model
+sys.path.append(str(Path(__file__).resolve().parent.parent / "basic_concept"))
 from dataloader import create_dataloader
+from dataloader import create_memmap_dataloader
+from dataloader import count_tokens
 from gpt_config import GPT_CONFIG_124M
 
 def text_to_token_ids(text, tokenizer):
@@ -54,7 +64,32 @@ def evaluate_model(model, train_loader, val_loader, device, eval_iter):
     return train_loss, val_loss
 
 
+def peak_rss_mb():
+    # ru_maxrss is reported in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def create_optimizer(model, settings):
+    # Fused AdamW runs the whole update in one kernel; fall back to the default
+    # implementation where the platform/PyTorch build does not support it.
+    # Frozen parameters (e.g. the base weights under LoRA adapters) get no optimizer state
+    params = [p for p in model.parameters() if p.requires_grad]
+    if settings.get("fused_adamw", False):
+        try:
+            return torch.optim.AdamW(
+                params, lr=settings["learning_rate"], weight_decay=settings["weight_decay"],
+                fused=True
+            )
+        except (RuntimeError, TypeError) as e:
+            print(f"Fused AdamW not available ({e}), using the default AdamW")
+    return torch.optim.AdamW(
+        params, lr=settings["learning_rate"], weight_decay=settings["weight_decay"]
+    )
+
+
 def generate_and_print_sample(model, tokenizer, device, start_context):
+    model = getattr(model, "_orig_mod", model)  # sample with the eager model when it was compiled
     model.eval()
     context_size = model.pos_emb.weight.shape[0]
     encoded = text_to_token_ids(start_context, tokenizer).to(device)
@@ -69,17 +104,25 @@ def generate_and_print_sample(model, tokenizer, device, start_context):
 
 
 def train_model_simple(model, train_loader, val_loader, optimizer, device, num_epochs,
-                       eval_freq, eval_iter, start_context, tokenizer):
+                       eval_freq, eval_iter, start_context, tokenizer,
+                       checkpointer=None, checkpoint_freq=100, resume=None):
     # Initialize lists to track losses and tokens seen
     train_losses, val_losses, track_tokens_seen = [], [], []
     tokens_seen = 0
     global_step = -1
+    start_epoch = 0
+    if resume is not None:
+        train_losses, val_losses, track_tokens_seen = resume["train_losses"], resume["val_losses"], resume["track_tokens_seen"]
+        tokens_seen, global_step, start_epoch = resume["tokens_seen"], resume["step"], resume["epoch"]
+    start_time, start_tokens = time.perf_counter(), tokens_seen
 
     # Main training loop
-    for epoch in range(num_epochs):
+    for epoch in range(start_epoch, num_epochs):
         model.train()  # Set model to training mode
 
-        for input_batch, target_batch in train_loader:
+        # Continues the interrupted epoch after the last checkpointed batch when resuming
+        epoch_rng_state, batches = resume_epoch(train_loader, resume if epoch == start_epoch else None)
+        for batch_idx, (input_batch, target_batch) in batches:
             optimizer.zero_grad()  # Reset loss gradients from previous batch iteration
             loss = calc_loss_batch(input_batch, target_batch, model, device)
             loss.backward()  # Calculate loss gradients
@@ -94,8 +137,16 @@ def train_model_simple(model, train_loader, val_loader, optimizer, device, num_e
                 train_losses.append(train_loss)
                 val_losses.append(val_loss)
                 track_tokens_seen.append(tokens_seen)
+                tokens_per_sec = (tokens_seen - start_tokens) / (time.perf_counter() - start_time)
                 print(f"Ep {epoch+1} (Step {global_step:06d}): "
-                      f"Train loss {train_loss:.3f}, Val loss {val_loss:.3f}")
+                      f"Train loss {train_loss:.3f}, Val loss {val_loss:.3f}, "
+                      f"{tokens_per_sec:.0f} tokens/sec, peak RSS {peak_rss_mb():.0f} MB")
+
+            if checkpointer is not None and (global_step + 1) % checkpoint_freq == 0:
+                checkpointer.save(
+                    model, optimizer, global_step, epoch, batch_idx, epoch_rng_state, tokens_seen=tokens_seen,
+                    train_losses=train_losses, val_losses=val_losses, track_tokens_seen=track_tokens_seen
+                )
 
         # Print a sample text after each epoch
         generate_and_print_sample(
@@ -105,6 +156,74 @@ def train_model_simple(model, train_loader, val_loader, optimizer, device, num_e
     return train_losses, val_losses, track_tokens_seen
 
 
+def train_model_fast(model, train_loader, val_loader, optimizer, device, num_epochs,
+                     eval_freq, eval_iter, start_context, tokenizer,
+                     grad_accum_steps=1, amp_dtype=torch.bfloat16,
+                     checkpointer=None, checkpoint_freq=100, resume=None):
+    # Same as train_model_simple, but runs forward/backward under autocast (bf16 by default, also on CPU)
+    # and accumulates gradients over grad_accum_steps batches, so the effective batch size is
+    # batch_size * grad_accum_steps. A "step" is one optimizer update. When the number of batches
+    # is not a multiple of grad_accum_steps, the last, shorter window of the epoch still gets its step.
+    train_losses, val_losses, track_tokens_seen = [], [], []
+    tokens_seen = 0
+    global_step = -1
+    start_epoch = 0
+    if resume is not None:
+        train_losses, val_losses, track_tokens_seen = resume["train_losses"], resume["val_losses"], resume["track_tokens_seen"]
+        tokens_seen, global_step, start_epoch = resume["tokens_seen"], resume["step"], resume["epoch"]
+    use_amp = amp_dtype is not None
+
+    for epoch in range(start_epoch, num_epochs):
+        model.train()
+        optimizer.zero_grad(set_to_none=True)
+        interval_start, interval_tokens = time.perf_counter(), 0
+
+        # Checkpoints are only taken right after an optimizer step, so a resumed
+        # epoch never starts in the middle of an accumulation window
+        epoch_rng_state, batches = resume_epoch(train_loader, resume if epoch == start_epoch else None)
+        num_batches = len(train_loader)
+        for batch_idx, (input_batch, target_batch) in batches:
+            # Average the loss over the batches of the current window (fewer in the last one)
+            window_start = batch_idx - batch_idx % grad_accum_steps
+            window_size = min(grad_accum_steps, num_batches - window_start)
+            with torch.autocast(device_type=device.type, dtype=amp_dtype or torch.bfloat16, enabled=use_amp):
+                loss = calc_loss_batch(input_batch, target_batch, model, device)
+            (loss / window_size).backward()
+            tokens_seen += input_batch.numel()
+            interval_tokens += input_batch.numel()
+
+            if batch_idx + 1 != window_start + window_size:
+                continue
+
+            optimizer.step()
+            optimizer.zero_grad(set_to_none=True)
+            global_step += 1
+
+            if global_step % eval_freq == 0:
+                tokens_per_sec = interval_tokens / (time.perf_counter() - interval_start)
+                train_loss, val_loss = evaluate_model(
+                    model, train_loader, val_loader, device, eval_iter)
+                train_losses.append(train_loss)
+                val_losses.append(val_loss)
+                track_tokens_seen.append(tokens_seen)
+                print(f"Ep {epoch+1} (Step {global_step:06d}): "
+                      f"Train loss {train_loss:.3f}, Val loss {val_loss:.3f}, "
+                      f"{tokens_per_sec:.0f} tokens/sec, peak RSS {peak_rss_mb():.0f} MB")
+                interval_start, interval_tokens = time.perf_counter(), 0
+
+            if checkpointer is not None and (global_step + 1) % checkpoint_freq == 0:
+                checkpointer.save(
+                    model, optimizer, global_step, epoch, batch_idx, epoch_rng_state, tokens_seen=tokens_seen,
+                    train_losses=train_losses, val_losses=val_losses, track_tokens_seen=track_tokens_seen
+                )
+
+        generate_and_print_sample(
+            model, tokenizer, device, start_context
+        )
+
+    return train_losses, val_losses, track_tokens_seen
+
+
 def plot_losses(epochs_seen, tokens_seen, train_losses, val_losses):
     fig, ax1 = plt.subplots()
 
@@ -129,21 +248,28 @@ def main(gpt_config, settings):
     torch.manual_seed(123)
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-
-    base_dir = Path(__file__).resolve().parent.parent
-    data_path = base_dir / "data" / "the-verdict.txt"
-    with open(str(data_path), "r", encoding="utf-8") as f:
-        text_data = f.read()
-
     ##############################
     # Initialize model
     ##############################
     print("Initializing model...")
     model = GPTModel(gpt_config)
     model.to(device)  # no assignment model = model.to(device) necessary for nn.Module classes
-    optimizer = torch.optim.AdamW(
-        model.parameters(), lr=settings["learning_rate"], weight_decay=settings["weight_decay"]
-    )
+    if "activation_checkpointing" in settings:
+        model.activation_checkpointing = settings["activation_checkpointing"]
+    optimizer = create_optimizer(model, settings)
+
+    # Periodic background checkpoints; an interrupted run continues from the latest one
+    checkpointer, resume = None, None
+    if settings.get("checkpoint_dir"):
+        checkpointer = AsyncCheckpointer(settings["checkpoint_dir"], keep_last=settings.get("keep_checkpoints", 2))
+        checkpoint_path = latest_checkpoint(settings["checkpoint_dir"])
+        if checkpoint_path is not None and settings.get("resume", True):
+            resume = load_checkpoint(checkpoint_path, model, optimizer)
+            print(f"Resuming from {checkpoint_path} (step {resume['step']})")
+
+    # torch.compile wraps the model; the returned model stays the eager one so that
+    # its state_dict keys do not get the "_orig_mod." prefix
+    train_model = torch.compile(model) if settings.get("compile", False) else model
 
     ##############################
     # Set up dataloaders
@@ -151,27 +277,62 @@ def main(gpt_config, settings):
 
     # Train/validation ratio
     train_ratio = 0.90
-    split_idx = int(train_ratio * len(text_data))
-
-    train_loader = create_dataloader(
-        text_data[:split_idx],
-        batch_size=settings["batch_size"],
-        max_length=gpt_config["context_length"],
-        stride=gpt_config["context_length"],
-        drop_last=True,
-        shuffle=True,
-        num_workers=0
-    )
 
-    val_loader = create_dataloader(
-        text_data[split_idx:],
-        batch_size=settings["batch_size"],
-        max_length=gpt_config["context_length"],
-        stride=gpt_config["context_length"],
-        drop_last=False,
-        shuffle=False,
-        num_workers=0
-    )
+    if settings.get("token_file"):
+        # Pre-tokenized uint16 corpus (write_token_file or pretokenize.py's index.json);
+        # memory-mapped, so it can be larger than RAM
+        token_file = settings["token_file"]
+        split_idx = int(train_ratio * count_tokens(token_file))
+        num_workers = settings.get("num_workers", 0)
+
+        train_loader = create_memmap_dataloader(
+            token_file,
+            batch_size=settings["batch_size"],
+            max_length=gpt_config["context_length"],
+            stride=gpt_config["context_length"],
+            end=split_idx,
+            drop_last=True,
+            shuffle=True,
+            num_workers=num_workers
+        )
+
+        val_loader = create_memmap_dataloader(
+            token_file,
+            batch_size=settings["batch_size"],
+            max_length=gpt_config["context_length"],
+            stride=gpt_config["context_length"],
+            start=split_idx,
+            drop_last=False,
+            shuffle=False,
+            num_workers=num_workers
+        )
+    else:
+        base_dir = Path(__file__).resolve().parent.parent
+        data_path = base_dir / "data" / "the-verdict.txt"
+        with open(str(data_path), "r", encoding="utf-8") as f:
+            text_data = f.read()
+
+        split_idx = int(train_ratio * len(text_data))
+
+        train_loader = create_dataloader(
+            text_data[:split_idx],
+            batch_size=settings["batch_size"],
+            max_length=gpt_config["context_length"],
+            stride=gpt_config["context_length"],
+            drop_last=True,
+            shuffle=True,
+            num_workers=0
+        )
+
+        val_loader = create_dataloader(
+            text_data[split_idx:],
+            batch_size=settings["batch_size"],
+            max_length=gpt_config["context_length"],
+            stride=gpt_config["context_length"],
+            drop_last=False,
+            shuffle=False,
+            num_workers=0
+        )
 
     ##############################
     # Train model
@@ -180,11 +341,24 @@ def main(gpt_config, settings):
     tokenizer = tiktoken.get_encoding("gpt2")
 
     print("start train model...")
-    train_losses, val_losses, tokens_seen = train_model_simple(
-        model, train_loader, val_loader, optimizer, device,
-        num_epochs=settings["num_epochs"], eval_freq=5, eval_iter=1,
-        start_context="Every effort moves you", tokenizer=tokenizer
-    )
+    if settings.get("fast_mode", False):
+        train_losses, val_losses, tokens_seen = train_model_fast(
+            train_model, train_loader, val_loader, optimizer, device,
+            num_epochs=settings["num_epochs"], eval_freq=5, eval_iter=1,
+            start_context="Every effort moves you", tokenizer=tokenizer,
+            grad_accum_steps=settings.get("grad_accum_steps", 1),
+            amp_dtype=torch.bfloat16 if settings.get("bf16", True) else None,
+            checkpointer=checkpointer, checkpoint_freq=settings.get("checkpoint_freq", 100), resume=resume
+        )
+    else:
+        train_losses, val_losses, tokens_seen = train_model_simple(
+            train_model, train_loader, val_loader, optimizer, device,
+            num_epochs=settings["num_epochs"], eval_freq=5, eval_iter=1,
+            start_context="Every effort moves you", tokenizer=tokenizer,
+            checkpointer=checkpointer, checkpoint_freq=settings.get("checkpoint_freq", 100), resume=resume
+        )
+    if checkpointer is not None:
+        checkpointer.close()  # wait for the last background write
     print("train model done...")
 
     return train_losses, val_losses, tokens_seen, model
@@ -195,7 +369,18 @@ if __name__ == "__main__":
         "learning_rate": 5e-4,
         "num_epochs": 10,
         "batch_size": 2,
-        "weight_decay": 0.1
+        "weight_decay": 0.1,
+        "fast_mode": False,        # bf16 autocast + gradient accumulation (train_model_fast)
+        "bf16": True,              # autocast dtype in fast mode; False trains in fp32
+        "grad_accum_steps": 1,     # effective batch size = batch_size * grad_accum_steps
+        "compile": False,          # torch.compile the model
+        "fused_adamw": False,      # fused AdamW where the platform supports it
+        "activation_checkpointing": 0,  # recompute every N-th block in backward: less memory, ~1 extra forward
+        "token_file": None,        # uint16 token file or pretokenize.py index.json; None tokenizes the-verdict.txt
+        "num_workers": 0,          # DataLoader workers for the token file
+        "checkpoint_dir": None,    # e.g. "checkpoints": save model/optimizer/RNG/data position in the background
+        "checkpoint_freq": 100,    # optimizer steps between checkpoints
+        "resume": True             # continue from the latest checkpoint in checkpoint_dir
     }
 
     ###########################
@@ -213,7 +398,6 @@ if __name__ == "__main__":
     plot_losses(epochs_tensor, tokens_seen, train_losses, val_losses)
     plt.savefig("loss.pdf")
 
-    # Save and load model
-    torch.save(model.state_dict(), "model.pth")
-    model = GPTModel(GPT_CONFIG_124M)
-    model.load_state_dict(torch.load("model.pth", weights_only=True))
\ No newline at end of file
+    # Save and load model (memory-mapped; "model.safetensors" works too)
+    save_state_dict(model, "model.pth")
+    model = load_gpt_model(GPT_CONFIG_124M, "model.pth")
\ No newline at end of file
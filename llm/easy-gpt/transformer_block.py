@@ -1,17 +1,20 @@
 import torch
 import torch.nn as nn
-from multi_head_attention import MultiHeadAttention
+from multi_head_attention import MultiHeadAttention, FusedMultiHeadAttention
 from feed_forward import FeedForward
 from layer_norm import LayerNorm
 
 class TransformerBlock(nn.Module):
     def __init__(self, cfg):
         super().__init__()
-        self.att = MultiHeadAttention(
+        attn_cls = FusedMultiHeadAttention if cfg.get("fused_attn", False) else MultiHeadAttention
+        self.att = attn_cls(
             d_in=cfg["emb_dim"],
             d_out=cfg["emb_dim"],
             context_length=cfg["context_length"],
             num_heads=cfg["n_heads"],
+            num_kv_heads=cfg.get("n_kv_heads"),
+            sliding_window=cfg.get("sliding_window"),
             dropout=cfg["drop_rate"],
             qkv_bias=cfg["qkv_bias"])
         self.ff = FeedForward(cfg)
@@ -19,11 +22,11 @@ class TransformerBlock(nn.Module):
         self.norm2 = LayerNorm(cfg["emb_dim"])
         self.drop_shortcut = nn.Dropout(cfg["drop_rate"])
 
-    def forward(self, x):
+    def forward(self, x, use_cache=False, attention_mask=None):
         # Shortcut connection for attention block
         shortcut = x
         x = self.norm1(x)
-        x = self.att(x)   # Shape [batch_size, num_tokens, emb_size]
+        x = self.att(x, use_cache=use_cache, attention_mask=attention_mask)   # Shape [batch_size, num_tokens, emb_size]
         x = self.drop_shortcut(x)
         x = x + shortcut  # Add the original input back
 
@@ -1,6 +1,14 @@
+import argparse
+import bisect
 import os
-from transformers import AutoTokenizer
-from datasets import load_dataset, load_from_disk
+import random
+import tempfile
+import time
+import torch
+from torch.utils.data import DataLoader
+from transformers import AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from datasets import Dataset, load_dataset, load_from_disk
+from peft import LoraConfig, get_peft_model, prepare_model_for_kbit_training
 
 # 设置本地缓存目录
 CACHE_DIR = "./cache"
@@ -11,13 +19,30 @@ DATASET_CACHE_DIR = os.path.join(CACHE_DIR, "datasets")
 os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
 os.makedirs(DATASET_CACHE_DIR, exist_ok=True)
 
+# TinyLlama（Zephyr）的对话模板，冒烟测试中的小分词器也使用它
+CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if message['role'] == 'user' %}{{ '<|user|>\n' + message['content'] + eos_token }}"
+    "{% elif message['role'] == 'system' %}{{ '<|system|>\n' + message['content'] + eos_token }}"
+    "{% elif message['role'] == 'assistant' %}{{ '<|assistant|>\n' + message['content'] + eos_token }}"
+    "{% endif %}"
+    "{% if loop.last and add_generation_prompt %}{{ '<|assistant|>' }}{% endif %}"
+    "{% endfor %}"
+)
+
+# LoRA适配器挂载到Llama的注意力投影和MLP线性层
+LORA_TARGET_MODULES = ["q_proj", "k_proj", "v_proj", "o_proj", "gate_proj", "up_proj", "down_proj"]
+
+
 def load_tokenizer_with_cache(model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0"):
     """加载分词器，优先从本地缓存加载"""
     model_path = os.path.join(MODEL_CACHE_DIR, model_name.replace("/", "--"))
-    
+
     if os.path.exists(model_path):
         print(f"从本地缓存加载模型: {model_path}")
         tokenizer = AutoTokenizer.from_pretrained(model_path)
+    elif os.path.isdir(model_name):
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
     else:
         print(f"从HuggingFace下载模型: {model_name}")
         tokenizer = AutoTokenizer.from_pretrained(
@@ -27,27 +52,27 @@ def load_tokenizer_with_cache(model_name="TinyLlama/TinyLlama-1.1B-Chat-v1.0"):
         # 保存到本地缓存
         tokenizer.save_pretrained(model_path)
         print(f"模型已保存到本地缓存: {model_path}")
-    
+
     return tokenizer
 
 def load_dataset_with_cache(dataset_name="HuggingFaceH4/ultrachat_200k", split="test_sft"):
     """加载数据集，优先从本地缓存加载"""
     dataset_path = os.path.join(DATASET_CACHE_DIR, dataset_name.replace("/", "--"))
-    
+
     if os.path.exists(dataset_path):
         print(f"从本地缓存加载数据集: {dataset_path}")
         dataset = load_from_disk(dataset_path)
     else:
         print(f"从HuggingFace下载数据集: {dataset_name}")
         dataset = load_dataset(
-            dataset_name, 
+            dataset_name,
             split=split,
             cache_dir=DATASET_CACHE_DIR
         )
         # 保存到本地缓存
         dataset.save_to_disk(dataset_path)
         print(f"数据集已保存到本地缓存: {dataset_path}")
-    
+
     return dataset
 
 def format_prompt(example, tokenizer):
@@ -57,18 +82,228 @@ def format_prompt(example, tokenizer):
     prompt = tokenizer.apply_chat_template(chat, tokenize=False)
     return {"text": prompt}
 
-# 加载分词器
-template_tokenizer = load_tokenizer_with_cache()
+def tokenize_dataset_with_cache(dataset, tokenizer, max_length, num_proc, cache_name):
+    """格式化并分词，结果以Arrow格式保存到本地缓存，之后的运行直接加载而不再重新map。
+
+    num_proc个进程并行处理；超过max_length的样本被截断。只保留input_ids。
+    """
+    cache_path = os.path.join(DATASET_CACHE_DIR, cache_name.replace("/", "--"))
+    if os.path.exists(cache_path):
+        print(f"从本地缓存加载分词结果: {cache_path}")
+        return load_from_disk(cache_path)
+
+    def tokenize(batch):
+        texts = [format_prompt({"messages": chat}, tokenizer)["text"] for chat in batch["messages"]]
+        encoded = tokenizer(texts, truncation=True, max_length=max_length)
+        return {"input_ids": encoded["input_ids"]}
+
+    start = time.perf_counter()
+    tokenized = dataset.map(
+        tokenize,
+        batched=True,
+        num_proc=num_proc,
+        remove_columns=dataset.column_names,
+        desc="分词"
+    )
+    tokenized.save_to_disk(cache_path)
+    print(f"分词完成（{num_proc}个进程，{time.perf_counter() - start:.1f}s），已保存到本地缓存: {cache_path}")
+    return tokenized
+
+def pack_sequences(tokenized, max_length, pad_token_id):
+    """把多条样本装进固定长度为max_length的序列（最佳适应递减装箱），减少填充浪费。
+
+    未装满的序列按剩余容量有序保存，每条样本用二分查找放进剩余容量最小且放得下的序列，
+    装箱耗时为O(样本数 × log 序列数)。
+
+    position_ids在每条样本开头重新从0开始；不传attention_mask时，transformers据此
+    构造块对角的因果掩码，样本之间互不可见。每条样本第一个token的标签为-100，
+    避免用上一条样本预测它；序列末尾的填充同样不参与损失。
+    """
+    lengths = [len(ids) for ids in tokenized["input_ids"]]
+    bins = []
+    open_bins = []  # 按(剩余容量, 序列编号)排序，只包含还有空位的序列
+    for i in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        pos = bisect.bisect_left(open_bins, (lengths[i], -1))
+        if pos < len(open_bins):
+            free, b = open_bins.pop(pos)
+            bins[b].append(i)
+        else:
+            free, b = max_length, len(bins)
+            bins.append([i])
+        free -= lengths[i]
+        if free > 0:
+            bisect.insort(open_bins, (free, b))
+
+    input_ids = tokenized["input_ids"]
+    packed = {"input_ids": [], "position_ids": [], "labels": []}
+    for sample_indices in bins:
+        ids, positions, labels = [], [], []
+        for i in sample_indices:
+            ids += input_ids[i]
+            positions += list(range(lengths[i]))
+            labels += [-100] + input_ids[i][1:]
+        num_pad = max_length - len(ids)
+        packed["input_ids"].append(ids + [pad_token_id] * num_pad)
+        packed["position_ids"].append(positions + list(range(num_pad)))
+        packed["labels"].append(labels + [-100] * num_pad)
+
+    total = sum(lengths)
+    print(f"打包: {len(lengths)}条样本 -> {len(bins)}条长度为{max_length}的序列，"
+          f"有效token占比 {total / (len(bins) * max_length):.1%}（逐条填充: {total / (len(lengths) * max_length):.1%}）")
+    return Dataset.from_dict(packed)
+
+def load_4bit_model(model_name, compute_dtype, rank, alpha, dropout, gradient_checkpointing=True):
+    """以4位NF4量化加载基础模型（双重量化），冻结后挂载LoRA适配器"""
+    bnb_config = BitsAndBytesConfig(
+        load_in_4bit=True,
+        bnb_4bit_quant_type="nf4",
+        bnb_4bit_use_double_quant=True,
+        bnb_4bit_compute_dtype=compute_dtype
+    )
+    model = AutoModelForCausalLM.from_pretrained(
+        model_name,
+        quantization_config=bnb_config,
+        dtype=compute_dtype,
+        cache_dir=MODEL_CACHE_DIR,
+        device_map={"": 0} if torch.cuda.is_available() else None
+    )
+    model = prepare_model_for_kbit_training(model, use_gradient_checkpointing=gradient_checkpointing)
+    lora_config = LoraConfig(
+        r=rank,
+        lora_alpha=alpha,
+        lora_dropout=dropout,
+        target_modules=LORA_TARGET_MODULES,
+        bias="none",
+        task_type="CAUSAL_LM"
+    )
+    model = get_peft_model(model, lora_config)
+    model.print_trainable_parameters()
+    return model
+
+def train(model, packed, batch_size, grad_accum_steps, learning_rate, num_epochs, log_every=10):
+    """只更新LoRA参数的训练循环；有效批大小为batch_size * grad_accum_steps"""
+    device = next(model.parameters()).device
+    loader = DataLoader(packed.with_format("torch"), batch_size=batch_size, shuffle=True)
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=learning_rate)
+    model.train()
+
+    step, tokens_seen, start = 0, 0, time.perf_counter()
+    num_batches = len(loader)
+    for epoch in range(num_epochs):
+        window_loss = 0.0
+        for batch_idx, batch in enumerate(loader):
+            # 按当前累积窗口的实际批次数取平均（每轮最后一个窗口可能不足grad_accum_steps个批次）
+            window_start = batch_idx - batch_idx % grad_accum_steps
+            window_size = min(grad_accum_steps, num_batches - window_start)
+            batch = {k: v.to(device) for k, v in batch.items()}
+            # 不传attention_mask，模型才会按position_ids把打包的样本分开
+            loss = model(**batch, use_cache=False).loss / window_size
+            loss.backward()
+            window_loss += loss.detach()
+            tokens_seen += int((batch["labels"] != -100).sum())
+            if batch_idx + 1 == window_start + window_size:
+                optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
+                step += 1
+                if step % log_every == 0:
+                    print(f"Ep {epoch + 1} (Step {step:06d}): loss {float(window_loss):.3f}, "
+                          f"{tokens_seen / (time.perf_counter() - start):.0f} tokens/sec")
+                window_loss = 0.0
+    return model
+
+def build_smoke_model(model_dir, max_length):
+    """冒烟测试用的小模型：字节级分词器和随机初始化的2层Llama，无需下载，CPU上几秒即可跑完"""
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    vocab = {ch: i for i, ch in enumerate(pre_tokenizers.ByteLevel.alphabet())}
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, eos_token="</s>", pad_token="</s>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+    tokenizer.save_pretrained(model_dir)
+
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=max_length
+    )
+    torch.manual_seed(123)
+    LlamaForCausalLM(config).save_pretrained(model_dir)
+    return model_dir
+
+def build_smoke_dataset(num_samples):
+    """随机长度的合成对话数据，格式与ultrachat_200k的messages列相同"""
+    rng = random.Random(42)
+    words = "the a model token cache attention layer weight train loss batch sequence".split()
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(2, 12)))
+
+    return Dataset.from_list([
+        {"messages": [{"role": "user", "content": sentence()}, {"role": "assistant", "content": sentence()}]}
+        for _ in range(num_samples)
+    ])
+
+def main():
+    parser = argparse.ArgumentParser(description="QLoRA微调：4位量化的基础模型 + LoRA适配器，样本打包训练")
+    parser.add_argument("--model_name", type=str, default="TinyLlama/TinyLlama-1.1B-Chat-v1.0")
+    parser.add_argument("--dataset_name", type=str, default="HuggingFaceH4/ultrachat_200k")
+    parser.add_argument("--num_samples", type=int, default=3_000)
+    parser.add_argument("--max_length", type=int, default=1024, help="打包后序列的长度")
+    parser.add_argument("--num_proc", type=int, default=os.cpu_count(), help="分词的进程数")
+    parser.add_argument("--rank", type=int, default=64)
+    parser.add_argument("--alpha", type=int, default=32)
+    parser.add_argument("--lora_dropout", type=float, default=0.1)
+    parser.add_argument("--learning_rate", type=float, default=2e-4)
+    parser.add_argument("--batch_size", type=int, default=2)
+    parser.add_argument("--grad_accum_steps", type=int, default=4)
+    parser.add_argument("--num_epochs", type=int, default=1)
+    parser.add_argument("--output_dir", type=str, default="./qlora-adapter")
+    parser.add_argument("--smoke", action="store_true", help="在CPU上用小模型和合成数据跑通整个流程")
+    args = parser.parse_args()
+
+    smoke_dir = None
+    if args.smoke:
+        smoke_dir = tempfile.TemporaryDirectory()
+        args.model_name = build_smoke_model(smoke_dir.name, args.max_length)
+        dataset = build_smoke_dataset(args.num_samples)
+        cache_name = f"smoke-tokenized-{args.num_samples}-{args.max_length}"
+    else:
+        dataset = load_dataset_with_cache(args.dataset_name)
+        dataset = (
+            dataset
+            .shuffle(seed=42)
+            .select(range(args.num_samples))
+        )
+        cache_name = f"{args.dataset_name}-{args.model_name}-tokenized-{args.num_samples}-{args.max_length}"
+
+    # 加载分词器，分词结果写入本地缓存，打包成定长序列
+    tokenizer = load_tokenizer_with_cache(args.model_name)
+    print("格式化后的提示词示例:")
+    print(format_prompt(dataset[0], tokenizer)["text"])
+    tokenized = tokenize_dataset_with_cache(dataset, tokenizer, args.max_length, args.num_proc, cache_name)
+    pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    packed = pack_sequences(tokenized, args.max_length, pad_token_id)
+
+    # CPU没有高效的bf16矩阵乘法，用fp32计算
+    compute_dtype = torch.bfloat16 if torch.cuda.is_available() else torch.float32
+    model = load_4bit_model(args.model_name, compute_dtype, args.rank, args.alpha, args.lora_dropout,
+                            gradient_checkpointing=not args.smoke)
+    train(model, packed, args.batch_size, args.grad_accum_steps, args.learning_rate, args.num_epochs,
+          log_every=1 if args.smoke else 10)
+
+    # 只保存LoRA适配器（几十MB），推理时与基础模型一起加载
+    model.save_pretrained(args.output_dir)
+    print(f"LoRA适配器已保存到: {args.output_dir}")
+    if smoke_dir is not None:
+        smoke_dir.cleanup()
 
-# 加载数据并利用TinyLlama使用的模板进行格式化
-dataset = load_dataset_with_cache()
-dataset = (
-    dataset
-    .shuffle(seed=42)
-    .select(range(3_000))
-)
-dataset = dataset.map(lambda x: format_prompt(x, template_tokenizer))
 
-# 格式化后的提示词示例
-print("格式化后的提示词示例:")
-print(dataset["text"][2576])
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,17 @@ ChromaRepository类 - 处理ChromaDB向量数据库操作
 """
 
 import os
+import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable, Callable
 from llama_index.vector_stores.chroma import ChromaVectorStore
 from llama_index.core import StorageContext, VectorStoreIndex, Settings
-from llama_index.core.schema import Document
-from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, Document
 import chromadb
+import numpy as np
 
 from custom_query_engine import FilteredQueryEngine
+from chunking_pipeline import get_chunking_pipeline
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -84,38 +86,17 @@ class ChromaRepository:
             
             logger.info(f"正在存储 {len(documents)} 个文档片段到ChromaDB...")
             
-            # 使用文档分割器
-            text_splitter = SentenceSplitter(
-                chunk_size=1024,
-                chunk_overlap=200,
-                separator=" "
-            )
-            nodes = text_splitter.get_nodes_from_documents(documents)
-            
-            # 准备数据以存储到ChromaDB
-            ids = [node.id_ for node in nodes]
-            texts = [node.text for node in nodes]
-            metadatas = [node.metadata for node in nodes]
-            
-            # 添加文件名为元数据
-            for metadata in metadatas:
-                metadata["file_name"] = file_name
-                metadata["source"] = file_name
-            
-            # 使用Settings中的嵌入模型生成嵌入向量
-            logger.info("正在生成嵌入向量...")
-            embeddings = []
-            for text in texts:
-                embedding = Settings.embed_model.get_text_embedding(text)
-                embeddings.append(embedding)
-            
-            # 批量添加文档到ChromaDB，包含嵌入向量
-            self.chroma_collection.add(
-                documents=texts,
-                metadatas=metadatas,
-                ids=ids,
-                embeddings=embeddings
-            )
+            # 使用共享的分块流水线并行分割，节点按批次流式交给嵌入和存储
+            # 失败时store_chunk_batches会删除已写入的片段，关闭节点流以取消剩余的分割任务
+            node_batches = get_chunking_pipeline().iter_node_batches(documents)
+            try:
+                stored = self.store_chunk_batches(node_batches, file_name)
+            finally:
+                node_batches.close()
+            if not stored:
+                if progress_callback:
+                    progress_callback(0, "存储失败，请查看日志")
+                return False
             
             logger.info(f"成功存储{len(documents)}个文档片段到ChromaDB")
             return True
@@ -125,7 +106,79 @@ class ChromaRepository:
             if progress_callback:
                 progress_callback(0, f"存储失败: {str(e)}")
             return False
-    
+
+    def store_chunk_batches(self, batches: Iterable[List[BaseNode]], file_name: str,
+                            batch_callback: Optional[Callable[[int], None]] = None) -> bool:
+        """
+        按批次存储已分好片段的文档到ChromaDB，不再进行二次分割
+        每个批次独立生成嵌入向量并写入，内存占用只与批次大小相关
+        任一批次失败时删除本次已写入的片段，不会留下只存了一部分的文档
+
+        Args:
+            batches: 文档片段批次的可迭代对象
+            file_name: 原始文件名
+            batch_callback: 每个批次写入后的回调函数，接收已存储的片段总数
+
+        Returns:
+            bool: 是否成功存储
+        """
+        stored_ids: List[str] = []
+        try:
+            if not self.is_available or not self.chroma_collection:
+                logger.error("ChromaDB不可用，无法存储文档")
+                return False
+
+            stored_count = 0
+            for batch in batches:
+                if not batch:
+                    continue
+
+                ids = [chunk.id_ for chunk in batch]
+                texts = [chunk.text for chunk in batch]
+                metadatas = []
+                for chunk in batch:
+                    metadata = dict(chunk.metadata)
+                    metadata["file_name"] = file_name
+                    metadata["source"] = file_name
+                    metadatas.append(metadata)
+
+                embeddings = Settings.embed_model.get_text_embedding_batch(texts)
+
+                self.chroma_collection.add(
+                    documents=texts,
+                    metadatas=metadatas,
+                    ids=ids,
+                    embeddings=embeddings
+                )
+                stored_ids.extend(ids)
+
+                stored_count += len(batch)
+                logger.info(f"已存储 {stored_count} 个文档片段到ChromaDB")
+                if batch_callback:
+                    batch_callback(stored_count)
+
+            if stored_count == 0:
+                logger.error(f"文件 '{file_name}' 没有可存储的文档片段")
+                return False
+
+            logger.info(f"成功按批次存储{stored_count}个文档片段到ChromaDB")
+            return True
+
+        except Exception as e:
+            logger.error(f"按批次存储文档到ChromaDB失败: {e}")
+            self._delete_partial_upload(stored_ids, file_name)
+            return False
+
+    def _delete_partial_upload(self, ids: List[str], file_name: str):
+        """删除上传失败的文件已写入的片段"""
+        if not ids:
+            return
+        try:
+            self.chroma_collection.delete(ids=ids)
+            logger.info(f"已删除文件 '{file_name}' 上传失败前写入的 {len(ids)} 个文档片段")
+        except Exception as e:
+            logger.error(f"删除文件 '{file_name}' 已写入的文档片段失败: {e}")
+
     def _create_vector_store(self):
         """创建ChromaDB向量存储"""
         try:
@@ -389,6 +442,128 @@ class ChromaRepository:
             logger.error(f"删除文件文档时出错: {e}")
             return False
     
+    def export_snapshot(self, snapshot_path: str, page_size: int = 5000) -> bool:
+        """
+        将集合导出为紧凑的NPZ快照，包含ID、文本、元数据和float16嵌入向量
+        没有文本的记录在texts中存为空字符串，并在text_is_null中标记，导入时恢复为None
+        可在新节点上直接导入，无需重新上传和生成嵌入
+
+        Args:
+            snapshot_path: 快照文件路径（.npz）
+            page_size: 分页读取集合时每页的记录数
+
+        Returns:
+            bool: 是否成功导出
+        """
+        try:
+            if not self.is_available or not self.chroma_collection:
+                logger.error("ChromaDB不可用，无法导出快照")
+                return False
+
+            logger.info(f"正在导出ChromaDB集合 '{self.collection_name}' 到快照: {snapshot_path}")
+
+            ids, texts, metadatas, embeddings = [], [], [], []
+            offset = 0
+            while True:
+                page = self.chroma_collection.get(
+                    include=["documents", "metadatas", "embeddings"],
+                    limit=page_size,
+                    offset=offset
+                )
+                page_ids = page.get('ids', [])
+                if not page_ids:
+                    break
+
+                ids.extend(page_ids)
+                texts.extend(page['documents'])
+                metadatas.extend(json.dumps(metadata or {}, ensure_ascii=False) for metadata in page['metadatas'])
+                embeddings.append(np.asarray(page['embeddings'], dtype=np.float16))
+                offset += len(page_ids)
+
+            if not ids:
+                logger.error("ChromaDB集合中没有数据，无法导出快照")
+                return False
+
+            directory = os.path.dirname(snapshot_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            np.savez_compressed(
+                snapshot_path,
+                ids=np.array(ids, dtype=str),
+                texts=np.array(["" if text is None else text for text in texts], dtype=str),
+                text_is_null=np.array([text is None for text in texts], dtype=bool),
+                metadatas=np.array(metadatas, dtype=str),
+                embeddings=np.concatenate(embeddings)
+            )
+
+            logger.info(f"成功导出 {len(ids)} 个文档片段到快照: {snapshot_path}")
+            return True
+
+        except Exception as e:
+            logger.error(f"导出ChromaDB快照失败: {e}")
+            return False
+
+    def import_snapshot(self, snapshot_path: str, batch_size: Optional[int] = None) -> bool:
+        """
+        从NPZ快照批量导入文档片段，直接使用快照中的嵌入向量
+
+        Args:
+            snapshot_path: 快照文件路径（.npz）
+            batch_size: 每次add调用写入的记录数，None表示使用ChromaDB允许的最大批次
+
+        Returns:
+            bool: 是否成功导入
+        """
+        try:
+            if not self.is_available or not self.chroma_collection:
+                logger.error("ChromaDB不可用，无法导入快照")
+                return False
+
+            if not os.path.exists(snapshot_path):
+                logger.error(f"快照文件不存在: {snapshot_path}")
+                return False
+
+            if batch_size is None:
+                batch_size = self.chroma_client.get_max_batch_size()
+
+            logger.info(f"正在从快照导入ChromaDB集合 '{self.collection_name}': {snapshot_path}")
+
+            with np.load(snapshot_path) as snapshot:
+                ids = snapshot['ids']
+                texts = snapshot['texts']
+                metadatas = snapshot['metadatas']
+                embeddings = snapshot['embeddings']
+                # 旧版快照没有text_is_null，其中的文本均按原样导入
+                if 'text_is_null' in snapshot.files:
+                    text_is_null = snapshot['text_is_null']
+                else:
+                    text_is_null = np.zeros(len(ids), dtype=bool)
+
+            total = len(ids)
+            for start in range(0, total, batch_size):
+                end = min(start + batch_size, total)
+                self.chroma_collection.upsert(
+                    ids=ids[start:end].tolist(),
+                    documents=[None if is_null else text
+                               for text, is_null in zip(texts[start:end].tolist(), text_is_null[start:end])],
+                    metadatas=[json.loads(metadata) for metadata in metadatas[start:end]],
+                    embeddings=embeddings[start:end].astype(np.float32)
+                )
+                logger.info(f"已导入 {end}/{total} 个文档片段")
+
+            # 集合内容已变化，下次查询时重新创建索引
+            self.index = None
+            self.vector_store = None
+            self.storage_context = None
+
+            logger.info(f"成功从快照导入 {total} 个文档片段")
+            return True
+
+        except Exception as e:
+            logger.error(f"导入ChromaDB快照失败: {e}")
+            return False
+
     def update_vector_store_with_new_documents(self):
         """
         当新文档上传后，更新向量存储和查询引擎
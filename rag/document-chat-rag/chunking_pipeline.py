@@ -0,0 +1,168 @@
+"""
+文档分块流水线模块
+在进程池中并行分割文档，以中英文标点作为句子边界，并以流的形式按批次产出节点
+节点批次可直接交给嵌入和存储，使分割与嵌入交替进行
+"""
+
+import os
+import re
+import logging
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode, Document
+
+logger = logging.getLogger(__name__)
+
+# 句子边界：中文句末标点（可带后引号/括号）、后接空白的英文句末标点、换行
+_SENTENCE_PATTERN = re.compile(r'.*?(?:[。！？；…]+[”’」』）》]*|[.!?;]+(?=\s)|\n+|$)\s*', re.S)
+
+# 句子仍超过分块大小时使用的次级切分规则，补充中文逗号、顿号和分号
+_SECONDARY_CHUNKING_REGEX = "[^,.;，、；。？！]+[,.;，、；。？！]?"
+
+# 每个工作进程按(chunk_size, chunk_overlap)缓存的分割器
+_worker_splitters: Dict[Tuple[int, int], SentenceSplitter] = {}
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    按中英文句子边界切分文本，切分结果拼接后与原文完全一致
+
+    Args:
+        text: 待切分的文本
+
+    Returns:
+        句子列表
+    """
+    return [sentence for sentence in _SENTENCE_PATTERN.findall(text) if sentence]
+
+
+def _get_splitter(chunk_size: int, chunk_overlap: int) -> SentenceSplitter:
+    """获取当前进程中可复用的分割器"""
+    key = (chunk_size, chunk_overlap)
+    if key not in _worker_splitters:
+        _worker_splitters[key] = SentenceSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separator=" ",
+            chunking_tokenizer_fn=split_sentences,
+            secondary_chunking_regex=_SECONDARY_CHUNKING_REGEX
+        )
+    return _worker_splitters[key]
+
+
+def _split_documents(documents: List[Document], chunk_size: int, chunk_overlap: int) -> List[BaseNode]:
+    """在工作进程中分割一组文档"""
+    return _get_splitter(chunk_size, chunk_overlap).get_nodes_from_documents(documents)
+
+
+class ChunkingPipeline:
+    """文档分块流水线，复用分割器和进程池，流式产出节点批次"""
+
+    def __init__(self, chunk_size: int = 1024, chunk_overlap: int = 200, batch_size: int = 64,
+                 docs_per_task: int = 8, max_workers: Optional[int] = None):
+        """
+        初始化分块流水线
+
+        Args:
+            chunk_size: 分块大小（token数）
+            chunk_overlap: 分块重叠大小（token数）
+            batch_size: 每个节点批次的节点数量
+            docs_per_task: 每个进程池任务处理的文档数量
+            max_workers: 进程池大小，None表示使用CPU核数
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.docs_per_task = docs_per_task
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """懒加载进程池，多次调用之间复用"""
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            logger.info(f"分块进程池已启动，进程数: {self.max_workers}")
+        return self._executor
+
+    def iter_node_batches(self, documents: List[Document]) -> Iterator[List[BaseNode]]:
+        """
+        分割文档并按批次产出节点
+        文档按组提交到进程池，调用方处理当前批次时，后续的文档组仍在后台分割（最多2 * max_workers组）
+
+        Args:
+            documents: LlamaIndex Document对象列表
+
+        Yields:
+            List[BaseNode]: 一批节点；提前关闭生成器会取消剩余的分割任务
+        """
+        groups = [documents[i:i + self.docs_per_task] for i in range(0, len(documents), self.docs_per_task)]
+
+        if len(groups) <= 1 or self.max_workers <= 1:
+            # 文档较少时直接在当前进程分割，避免进程间传输开销
+            node_groups = (_split_documents(group, self.chunk_size, self.chunk_overlap) for group in groups)
+        else:
+            node_groups = self._iter_split_groups(groups)
+
+        batch: List[BaseNode] = []
+        try:
+            for nodes in node_groups:
+                for node in nodes:
+                    batch.append(node)
+                    if len(batch) >= self.batch_size:
+                        yield batch
+                        batch = []
+            if batch:
+                yield batch
+        finally:
+            # 调用方提前关闭（例如存储失败）时取消尚未开始的分割任务
+            node_groups.close()
+
+    def _iter_split_groups(self, groups: List[List[Document]]) -> Iterator[List[BaseNode]]:
+        """
+        在进程池中按顺序分割各组文档，同时最多有2 * max_workers个任务在执行或等待取走
+        每取走一组结果才提交下一组，已完成但未处理的节点不会随上传文件的大小堆积在主进程中
+
+        Args:
+            groups: 文档分组列表
+
+        Yields:
+            List[BaseNode]: 一组文档分割出的节点
+        """
+        executor = self._get_executor()
+        max_in_flight = 2 * self.max_workers
+        pending: Deque[Future] = deque()
+        next_group = 0
+        try:
+            while next_group < len(groups) or pending:
+                while next_group < len(groups) and len(pending) < max_in_flight:
+                    pending.append(executor.submit(
+                        _split_documents, groups[next_group], self.chunk_size, self.chunk_overlap))
+                    next_group += 1
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def shutdown(self):
+        """关闭进程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+_default_pipeline: Optional[ChunkingPipeline] = None
+
+
+def get_chunking_pipeline() -> ChunkingPipeline:
+    """
+    获取全局共享的分块流水线，所有仓库实例复用同一个进程池
+
+    Returns:
+        ChunkingPipeline实例
+    """
+    global _default_pipeline
+    if _default_pipeline is None:
+        _default_pipeline = ChunkingPipeline()
+    return _default_pipeline
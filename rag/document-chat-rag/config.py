@@ -3,6 +3,7 @@
 确保整个程序中使用统一的LLM和嵌入模型配置
 """
 
+import os
 import logging
 from llama_index.llms.deepseek import DeepSeek
 from llama_index.embeddings.ollama import OllamaEmbedding
@@ -10,6 +11,9 @@ from llama_index.core import Settings
 
 logger = logging.getLogger(__name__)
 
+# ChromaDB分片数量，大于1时启用分片集合（可通过环境变量KFLOW_CHROMA_SHARDS配置）
+CHROMA_NUM_SHARDS = int(os.getenv("KFLOW_CHROMA_SHARDS", "1"))
+
 
 def initialize_settings():
     """
@@ -8,12 +8,14 @@ import tempfile
 import uuid
 import logging
 from typing import List, Dict, Any, Optional
-from llama_index.readers.file import PDFReader, DocxReader, MarkdownReader, CSVReader
+from llama_index.readers.file import PDFReader, DocxReader, MarkdownReader
 from llama_index.core import Settings, VectorStoreIndex, PromptTemplate
 from llama_index.core.response_synthesizers import ResponseMode
 from llama_index.core.readers import SimpleDirectoryReader
 from chroma_repository import ChromaRepository
-from config import get_llm, get_embed_model, verify_settings
+from sharded_chroma_repository import ShardedChromaRepository
+from csv_stream_reader import StreamingCSVReader
+from config import get_llm, get_embed_model, verify_settings, CHROMA_NUM_SHARDS
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -31,8 +33,11 @@ class DocumentChatModel:
         if not verify_settings():
             raise RuntimeError("Settings配置验证失败，请检查config.py")
         
-        # 初始化ChromaDB仓库
-        self.chroma_repo = ChromaRepository(collection_name="kflow")
+        # 初始化ChromaDB仓库，配置了多个分片时使用分片仓库
+        if CHROMA_NUM_SHARDS > 1:
+            self.chroma_repo = ShardedChromaRepository(num_shards=CHROMA_NUM_SHARDS, collection_name="kflow")
+        else:
+            self.chroma_repo = ChromaRepository(collection_name="kflow")
         
         logger.info("DocumentChatModel初始化完成")
         
@@ -62,7 +67,6 @@ class DocumentChatModel:
             '.doc': DocxReader(),
             '.md': MarkdownReader(),
             '.markdown': MarkdownReader(),
-            '.csv': CSVReader(),
             '.txt': None,  # 使用SimpleDirectoryReader处理txt文件
         }
         
@@ -91,7 +95,33 @@ class DocumentChatModel:
         else:
             # 使用专门的加载器
             return loader.load_data(file=file_path)
-    
+
+    def _store_csv_stream(self, file_path: str, file_name: str, progress_callback=None) -> bool:
+        """
+        流式读取CSV文件并按批次存储到ChromaDB
+        每个片段都包含表头，读取、嵌入和写入按批次交替进行，内存占用保持平稳
+
+        Args:
+            file_path: CSV文件路径
+            file_name: 原始文件名
+            progress_callback: 进度回调函数
+
+        Returns:
+            bool: 是否成功存储
+        """
+        reader = StreamingCSVReader()
+
+        def batch_callback(stored_count: int):
+            if progress_callback:
+                progress = 5 + int(75 * reader.progress)
+                progress_callback(progress, f"已存储 {stored_count} 个CSV片段...")
+
+        return self.chroma_repo.store_chunk_batches(
+            reader.iter_batches(file_path),
+            file_name,
+            batch_callback
+        )
+
     def process_document_file(self, uploaded_file, progress_callback=None) -> tuple[bool, str, Optional[Any]]:
         """
         处理上传的文档文件（支持PDF、Word、Markdown、CSV、TXT）
@@ -133,37 +163,42 @@ class DocumentChatModel:
                 if not os.path.exists(file_path):
                     return False, "无法找到上传的文件", None
                 
-                # 阶段1：解析文档 (0% - 20%)
-                if progress_callback:
-                    progress_callback(5, "正在解析文档...")
-                
-                # 根据文件类型加载文档
-                docs = self._load_document(file_path, file_extension)
-                
-                if not docs:
-                    return False, "文档加载失败，请检查文件格式", None
-                
-                # 记录文档加载信息
-                total_chars = sum(len(doc.text) for doc in docs)
-                print(f"成功加载 {len(docs)} 个文档片段，总字符数: {total_chars}")
-                
-                if progress_callback:
-                    progress_callback(20, "文档解析完成")
-                
-                # 嵌入模型已在config.py中统一配置
-                
-                # 阶段2：存储到ChromaDB (20% - 80%)
-                if progress_callback:
-                    progress_callback(30, "正在存储到ChromaDB向量数据库...")
-                
-                # 嵌入模型已在config.py中统一配置
-                
-                # 存储文档到ChromaDB
-                storage_success = self.chroma_repo.store_documents(
-                    docs, 
-                    uploaded_file.name, 
-                    progress_callback
-                )
+                if file_extension.lower() == '.csv':
+                    # CSV文件走流式路径：按行批量读取、分片并直接写入ChromaDB (0% - 80%)
+                    if progress_callback:
+                        progress_callback(5, "正在流式读取CSV文件...")
+
+                    storage_success = self._store_csv_stream(file_path, uploaded_file.name, progress_callback)
+                else:
+                    # 阶段1：解析文档 (0% - 20%)
+                    if progress_callback:
+                        progress_callback(5, "正在解析文档...")
+
+                    # 根据文件类型加载文档
+                    docs = self._load_document(file_path, file_extension)
+
+                    if not docs:
+                        return False, "文档加载失败，请检查文件格式", None
+
+                    # 记录文档加载信息
+                    total_chars = sum(len(doc.text) for doc in docs)
+                    print(f"成功加载 {len(docs)} 个文档片段，总字符数: {total_chars}")
+
+                    if progress_callback:
+                        progress_callback(20, "文档解析完成")
+
+                    # 阶段2：存储到ChromaDB (20% - 80%)
+                    if progress_callback:
+                        progress_callback(30, "正在存储到ChromaDB向量数据库...")
+
+                    # 嵌入模型已在config.py中统一配置
+
+                    # 存储文档到ChromaDB
+                    storage_success = self.chroma_repo.store_documents(
+                        docs,
+                        uploaded_file.name,
+                        progress_callback
+                    )
                 
                 if not storage_success:
                     return False, "存储到ChromaDB失败", None
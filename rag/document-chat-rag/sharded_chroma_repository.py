@@ -0,0 +1,348 @@
+"""
+ShardedChromaRepository类 - 将知识库拆分到多个ChromaDB集合
+每个分片拥有独立的集合和持久化目录，检索时并发查询相关分片并按相似度合并top-k结果
+对外提供与ChromaRepository相同的接口，可直接替换使用
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import zlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional, Iterable, Callable
+from llama_index.core import Settings
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import BaseNode, Document, NodeWithScore, QueryBundle, TextNode
+
+from chroma_repository import ChromaRepository
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 分片键同时用作子目录名和集合名后缀，只允许ChromaDB集合名中的字符，不能包含路径分隔符
+_SHARD_KEY_PATTERN = re.compile(r'[A-Za-z0-9._-]+')
+# ChromaDB集合名规则：3-512个字符，首尾为字母或数字，不含连续的两个句点
+_COLLECTION_NAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]{1,510}[A-Za-z0-9]')
+
+# 按文件名哈希分组时记录分片数量的文件，位于分片根目录下
+_SHARD_CONFIG_FILE = "shards.json"
+
+
+class ShardedRetriever(BaseRetriever):
+    """分片检索器，并发查询多个分片并合并top-k结果"""
+
+    def __init__(self, repository: "ShardedChromaRepository", target_files: Optional[List[str]] = None,
+                 similarity_top_k: int = 5, **kwargs):
+        """
+        初始化分片检索器
+
+        Args:
+            repository: 分片仓库
+            target_files: 目标文件名列表，None表示检索全部分片
+            similarity_top_k: 合并后返回的节点数量
+        """
+        self._repository = repository
+        self.target_files = target_files
+        self.similarity_top_k = similarity_top_k
+        super().__init__(**kwargs)
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        """检索相关节点"""
+        if query_bundle.embedding is None:
+            query_bundle.embedding = Settings.embed_model.get_query_embedding(query_bundle.query_str)
+        return self._repository.search(
+            query_bundle.embedding,
+            similarity_top_k=self.similarity_top_k,
+            file_names=self.target_files
+        )
+
+
+class ShardedChromaRepository:
+    """分片ChromaDB仓库类，按租户或文件分组将文档片段路由到不同分片"""
+
+    def __init__(self, num_shards: int = 4, collection_name: str = "kflow",
+                 persist_directory: str = "./chroma_shards",
+                 shard_key_fn: Optional[Callable[[str], str]] = None,
+                 max_workers: Optional[int] = None):
+        """
+        初始化分片ChromaDB仓库
+
+        Args:
+            num_shards: 按文件名哈希分组时的分片数量
+            collection_name: 集合名称前缀，每个分片的集合名为"{collection_name}_{分片键}"
+            persist_directory: 分片根目录，每个分片持久化到其下的独立子目录
+            shard_key_fn: 自定义分片函数，接收文件名返回分片键（例如租户ID），None表示按文件名哈希分组；
+                分片键只能包含字母、数字和"._-"，并需满足ChromaDB集合名规则
+            max_workers: 并发查询分片的线程数，None表示与num_shards相同
+        """
+        self.num_shards = num_shards
+        self.collection_name = collection_name
+        self.persist_directory = persist_directory
+        self.shard_key_fn = shard_key_fn
+        self.shards: Dict[str, ChromaRepository] = {}
+        self._shards_lock = threading.Lock()
+
+        if self.shard_key_fn is None:
+            self._check_num_shards()
+
+        # 加载已有分片；按哈希分组时预先创建全部分片
+        if os.path.isdir(self.persist_directory):
+            for shard_key in sorted(os.listdir(self.persist_directory)):
+                if not os.path.isdir(os.path.join(self.persist_directory, shard_key)):
+                    continue
+                try:
+                    self._get_shard(shard_key)
+                except ValueError as e:
+                    logger.warning(f"跳过分片目录 '{shard_key}': {e}")
+        if self.shard_key_fn is None:
+            for i in range(self.num_shards):
+                self._get_shard(f"shard_{i}")
+
+        # 线程数不随启动时已有的分片数变化：使用shard_key_fn时分片在写入时才逐个创建
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or max(self.num_shards, 1))
+        logger.info(f"ShardedChromaRepository初始化完成，分片数量: {len(self.shards)}")
+
+    @property
+    def is_available(self) -> bool:
+        """至少一个分片可用时认为仓库可用"""
+        return any(shard.is_available for shard in list(self.shards.values()))
+
+    def shard_key_for_file(self, file_name: str) -> str:
+        """
+        计算文件所属的分片键
+
+        Args:
+            file_name: 文件名
+
+        Returns:
+            分片键
+        """
+        if self.shard_key_fn is not None:
+            return self._validate_shard_key(self.shard_key_fn(file_name))
+        # 使用稳定哈希，保证重启后同一文件仍路由到同一分片
+        return f"shard_{zlib.crc32(file_name.encode('utf-8')) % self.num_shards}"
+
+    def _check_num_shards(self):
+        """
+        记录按哈希分组时的分片数量；数量变化后文件会被路由到其他分片，已有数据无法再按文件检索，
+        因此分片数量与已记录的不一致时拒绝启动，需要在新目录中重新导入文档
+        """
+        config_path = os.path.join(self.persist_directory, _SHARD_CONFIG_FILE)
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                recorded = json.load(f).get("num_shards")
+        elif os.path.isdir(self.persist_directory):
+            # 没有记录文件的旧目录：启动时会创建全部shard_{i}，由已有的分片目录数推断
+            recorded = len([name for name in os.listdir(self.persist_directory)
+                            if re.fullmatch(r'shard_\d+', name)
+                            and os.path.isdir(os.path.join(self.persist_directory, name))]) or None
+        else:
+            recorded = None
+
+        if recorded is not None and recorded != self.num_shards:
+            raise ValueError(
+                f"分片目录 '{self.persist_directory}' 中的数据按 {recorded} 个分片写入，"
+                f"当前配置为 {self.num_shards} 个分片；请恢复原分片数量，或使用新的目录重新导入文档"
+            )
+        if not os.path.exists(config_path):
+            os.makedirs(self.persist_directory, exist_ok=True)
+            with open(config_path, "w", encoding="utf-8") as f:
+                json.dump({"num_shards": self.num_shards}, f)
+
+    def _validate_shard_key(self, shard_key: str) -> str:
+        """检查分片键能否安全地用作子目录名和ChromaDB集合名，不符合时抛出ValueError"""
+        if not isinstance(shard_key, str) or not _SHARD_KEY_PATTERN.fullmatch(shard_key):
+            raise ValueError(f"分片键只能包含字母、数字和'._-'，不能包含路径分隔符: {shard_key!r}")
+        collection_name = f"{self.collection_name}_{shard_key}"
+        if not _COLLECTION_NAME_PATTERN.fullmatch(collection_name) or ".." in collection_name:
+            raise ValueError(
+                f"分片键 {shard_key!r} 生成的集合名 '{collection_name}' 不符合ChromaDB规则"
+                f"（3-512个字符，首尾为字母或数字，不含'..'）"
+            )
+        return shard_key
+
+    def _get_shard(self, shard_key: str) -> ChromaRepository:
+        """获取分片仓库，不存在时创建；加锁避免并发写入时重复创建同一分片"""
+        self._validate_shard_key(shard_key)
+        with self._shards_lock:
+            if shard_key not in self.shards:
+                self.shards[shard_key] = ChromaRepository(
+                    collection_name=f"{self.collection_name}_{shard_key}",
+                    persist_directory=os.path.join(self.persist_directory, shard_key)
+                )
+            return self.shards[shard_key]
+
+    def _shards_for_files(self, file_names: Optional[List[str]]) -> List[ChromaRepository]:
+        """获取需要查询的分片，指定文件时只返回包含这些文件的分片"""
+        if not file_names:
+            return list(self.shards.values())
+        shard_keys = {self.shard_key_for_file(file_name) for file_name in file_names}
+        return [self.shards[key] for key in shard_keys if key in self.shards]
+
+    def store_documents(self, documents: List[Document], file_name: str, progress_callback=None) -> bool:
+        """存储文档到文件所属的分片"""
+        return self._get_shard(self.shard_key_for_file(file_name)).store_documents(
+            documents, file_name, progress_callback)
+
+    def store_chunk_batches(self, batches: Iterable[List[BaseNode]], file_name: str,
+                            batch_callback: Optional[Callable[[int], None]] = None) -> bool:
+        """按批次存储文档片段到文件所属的分片"""
+        return self._get_shard(self.shard_key_for_file(file_name)).store_chunk_batches(
+            batches, file_name, batch_callback)
+
+    def search(self, query_embedding: List[float], similarity_top_k: int = 5,
+               file_names: Optional[List[str]] = None) -> List[NodeWithScore]:
+        """
+        并发查询相关分片，并用堆合并各分片的top-k结果
+
+        Args:
+            query_embedding: 查询嵌入向量
+            similarity_top_k: 返回的节点数量
+            file_names: 目标文件名列表，None表示检索全部分片
+
+        Returns:
+            按相似度降序排列的节点列表
+        """
+        shards = [shard for shard in self._shards_for_files(file_names) if shard.is_available]
+        if not shards:
+            logger.warning("没有可查询的分片")
+            return []
+
+        where = {"file_name": {"$in": list(file_names)}} if file_names else None
+
+        def query_shard(shard: ChromaRepository) -> List[NodeWithScore]:
+            try:
+                count = shard.chroma_collection.count()
+                if count == 0:
+                    return []
+                results = shard.chroma_collection.query(
+                    query_embeddings=[query_embedding],
+                    n_results=min(similarity_top_k, count),
+                    where=where,
+                    include=["documents", "metadatas", "distances"]
+                )
+            except Exception as e:
+                logger.error(f"查询分片 '{shard.collection_name}' 失败: {e}")
+                return []
+
+            nodes = []
+            for node_id, text, metadata, distance in zip(
+                results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+            ):
+                node = TextNode(id_=node_id, text=text or "", metadata=metadata or {})
+                # 与ChromaVectorStore一致，将距离转换为相似度分数
+                nodes.append(NodeWithScore(node=node, score=math.exp(-distance)))
+            return nodes
+
+        shard_results = self._executor.map(query_shard, shards)
+        merged = heapq.nlargest(
+            similarity_top_k,
+            (node for nodes in shard_results for node in nodes),
+            key=lambda node: node.score
+        )
+        logger.info(f"分片检索完成，查询分片数: {len(shards)}, 返回节点数: {len(merged)}")
+        return merged
+
+    def get_query_engine(self, file_names: Optional[List[str]] = None, llm=None, streaming: bool = True):
+        """
+        获取基于分片检索器的查询引擎
+
+        Args:
+            file_names: 指定要检索的文件名列表，None表示检索所有文件
+            llm: 语言模型实例
+            streaming: 是否启用流式响应
+
+        Returns:
+            查询引擎对象
+        """
+        try:
+            if not self.is_available:
+                logger.error("❌ 没有可用的ChromaDB分片，无法创建查询引擎")
+                return None
+
+            retriever = ShardedRetriever(self, target_files=file_names, similarity_top_k=5)
+            query_engine = RetrieverQueryEngine.from_args(retriever, llm=llm, streaming=streaming)
+            # 与FilteredQueryEngine保持一致，便于上层按文件过滤
+            query_engine.target_files = file_names
+            logger.info(f"✅ 分片查询引擎创建成功，目标文件: {file_names}")
+            return query_engine
+
+        except Exception as e:
+            logger.error(f"❌ 创建分片查询引擎失败: {e}")
+            return None
+
+    def get_collection_info(self) -> Dict[str, Any]:
+        """
+        汇总所有分片的集合信息
+
+        Returns:
+            集合信息字典
+        """
+        shard_infos = list(self._executor.map(lambda shard: shard.get_collection_info(), list(self.shards.values())))
+        available_infos = [info for info in shard_infos if info.get("status") == "available"]
+        if not available_infos:
+            return {
+                "status": "unavailable",
+                "collection_name": self.collection_name,
+                "document_count": 0,
+                "message": "ChromaDB分片均不可用或未初始化"
+            }
+
+        document_count = sum(info["document_count"] for info in available_infos)
+        file_info = {}
+        for info in available_infos:
+            file_info.update(info.get("file_info", {}))
+
+        return {
+            "status": "available",
+            "collection_name": self.collection_name,
+            "document_count": document_count,
+            "file_count": len(file_info),
+            "file_names": list(file_info.keys()),
+            "file_info": file_info,
+            "persist_directory": self.persist_directory,
+            "shard_count": len(self.shards),
+            "message": f"ChromaDB分片集合'{self.collection_name}'共{len(self.shards)}个分片，"
+                       f"包含{document_count}个文档片段，来自{len(file_info)}个文件"
+        }
+
+    def clear_collection(self):
+        """清空所有分片中的数据"""
+        return all([shard.clear_collection() for shard in list(self.shards.values())])
+
+    def delete_file_documents(self, file_name: str) -> bool:
+        """从文件所属的分片中删除该文件的所有文档片段"""
+        shard_key = self.shard_key_for_file(file_name)
+        if shard_key not in self.shards:
+            logger.info(f"未找到文件 '{file_name}' 所属的分片")
+            return False
+        return self.shards[shard_key].delete_file_documents(file_name)
+
+    def export_snapshot(self, snapshot_path: str) -> bool:
+        """将每个分片导出为独立快照，文件名格式为{快照名}.{分片键}.npz"""
+        base_path = snapshot_path[:-4] if snapshot_path.endswith(".npz") else snapshot_path
+        return all([shard.export_snapshot(f"{base_path}.{shard_key}.npz")
+                    for shard_key, shard in list(self.shards.items())
+                    if shard.get_collection_info().get("document_count", 0) > 0])
+
+    def import_snapshot(self, snapshot_path: str, batch_size: Optional[int] = None) -> bool:
+        """从export_snapshot导出的分片快照导入，每个快照写回同名分片"""
+        base_path = snapshot_path[:-4] if snapshot_path.endswith(".npz") else snapshot_path
+        directory = os.path.dirname(base_path) or "."
+        prefix = os.path.basename(base_path) + "."
+        snapshot_files = [name for name in sorted(os.listdir(directory))
+                          if name.startswith(prefix) and name.endswith(".npz")]
+        if not snapshot_files:
+            logger.error(f"未找到分片快照: {base_path}.*.npz")
+            return False
+        return all([self._get_shard(name[len(prefix):-4]).import_snapshot(os.path.join(directory, name), batch_size)
+                    for name in snapshot_files])
+
+    def update_vector_store_with_new_documents(self):
+        """分片检索直接查询各分片集合，无需重建索引"""
+        return self.is_available
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+知识库快照工具
+导出ChromaDB集合为NPZ快照，或在新节点上从快照批量导入，无需重新生成嵌入
+
+用法:
+    python snapshot.py export kflow_snapshot.npz
+    python snapshot.py import kflow_snapshot.npz
+"""
+
+import argparse
+import logging
+import sys
+
+from chroma_repository import ChromaRepository
+from sharded_chroma_repository import ShardedChromaRepository
+
+
+def main():
+    """解析命令行参数并执行快照导出或导入"""
+    parser = argparse.ArgumentParser(description="KFlow知识库快照导出/导入工具")
+    parser.add_argument("action", choices=["export", "import"], help="export导出快照，import导入快照")
+    parser.add_argument("snapshot_path", help="快照文件路径（.npz）")
+    parser.add_argument("--collection", default="kflow", help="ChromaDB集合名称")
+    parser.add_argument("--persist-directory", default=None, help="ChromaDB数据持久化目录")
+    parser.add_argument("--shards", type=int, default=1, help="分片数量，大于1时按分片导出/导入")
+    parser.add_argument("--batch-size", type=int, default=None, help="导入时每次写入的记录数")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.shards > 1:
+        repo = ShardedChromaRepository(num_shards=args.shards, collection_name=args.collection,
+                                       persist_directory=args.persist_directory or "./chroma_shards")
+    else:
+        repo = ChromaRepository(collection_name=args.collection,
+                                persist_directory=args.persist_directory or "./chroma_db")
+    if args.action == "export":
+        success = repo.export_snapshot(args.snapshot_path)
+    else:
+        success = repo.import_snapshot(args.snapshot_path, batch_size=args.batch_size)
+
+    if success:
+        print(f"✅ 快照{'导出' if args.action == 'export' else '导入'}完成: {args.snapshot_path}")
+    else:
+        print(f"❌ 快照{'导出' if args.action == 'export' else '导入'}失败，请查看日志")
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())